@@ -1,22 +1,50 @@
 import os
-import io
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_file
-import openpyxl
-from openpyxl.drawing.image import Image as xlImage
-from openpyxl.styles import Font, Alignment, PatternFill
-from models import db, Usuario, Secretaria, Contratacao, Ente
+import hmac
+import threading
+import time
+import hashlib
+import shutil
+import tempfile
+import click
+from functools import wraps
+from flask import Flask, Response, jsonify, render_template, request, redirect, url_for, flash, session, send_file, stream_with_context
+from models import db, Usuario, Secretaria, Contratacao, Ente, incrementar_versao_dados
+from cache_global import cache_global
+from cache_exportacao import cache_exportacao
+from instrumentacao import instrumentacao
+from compressao import compressao
+from metricas import metricas, gerar_metricas, registrar_exportacao, contar_linhas, linhas_servidas, observar_espera_pool
+from consultas import filtros_normalizados, filtros_da_url, filtrar_contratacoes, contratacoes_filtradas, contratacoes_do_usuario, linhas_exportacao, COLUNAS_DADOS_ABERTOS
+from tarefas_exportacao import FilaTarefas, FilaCheia, TIPOS_TAREFA, registrar_tipo
+from pool_banco import url_mysql, opcoes_engine, metricas_pool, QueuePoolInstrumentado
+from migracoes import aplicar_migracoes, migracoes_pendentes, versao_schema, MIGRACOES, MigracaoEmAndamento
+from importacao import sanitizar_valor, ler_planilha, importar_contratacoes
+from fila_email import EnviadorEmail, enfileirar_email, esvaziar_fila
+from logotipo import salvar_logo, cache_logos
+from estaticos import estaticos, construir as construir_estaticos
+from resumo import resumo_gastos, exercicios_com_resumo, reconstruir_resumo
+from seguranca import SistemaOcupado, TAMANHO_MAXIMO_SENHA, conferir_hash, tentativas_por_ip, falhas_por_login
+from exportacao import formatar_moeda, gerar_excel_streaming, gerar_excel_em_memoria, gerar_pdf_streaming, gerar_csv, gerar_ndjson
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
-from werkzeug.utils import secure_filename
-from flask_mail import Mail, Message
+from datetime import datetime, timedelta, timezone
+from flask_mail import Mail
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadTimeSignature
 from flask_wtf.csrf import CSRFProtect
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 load_dotenv() # Carrega as variáveis do arquivo .env
 
 app = Flask(__name__)
 csrf = CSRFProtect(app)
 
+# Atrás de proxy reverso, request.remote_addr seria o IP do proxy para todo mundo, e o
+# limite de tentativas de login por IP (seguranca.py) bloquearia todos os cidadãos de uma
+# vez. PCA_PROXIES = quantos proxies confiáveis ficam na frente do Gunicorn (0: acesso
+# direto); o IP do cliente passa a vir do X-Forwarded-For que eles acrescentam.
+app.config['PROXIES'] = int(os.environ.get('PCA_PROXIES', 0))
+if app.config['PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXIES'], x_proto=app.config['PROXIES'])
+
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', os.urandom(24).hex())
 
 # Cria a pasta estática de uploads se não existir
@@ -24,6 +52,12 @@ UPLOAD_FOLDER = os.path.join('static', 'img')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# CSS/JS com hash no nome, pré-comprimidos (gzip/brotli) e cache imutável (estaticos.py).
+# Gerados por 'flask construir-estaticos' (build da imagem); sem eles, servem os originais.
+app.config['ESTATICOS_VERSIONADOS'] = os.environ.get('PCA_ESTATICOS_VERSIONADOS', 'True') == 'True'
+app.config['ESTATICOS_DIR'] = os.environ.get('PCA_ESTATICOS_DIR', os.path.join(app.static_folder, 'dist'))
+estaticos.init_app(app)
+
 # Configuração de Acesso ao Banco de Dados (MySQL 9.1)
 DB_USER = os.environ.get('DB_USER', 'root')
 DB_PASS = os.environ.get('DB_PASSWORD', '')
@@ -32,14 +66,19 @@ DB_PORT = os.environ.get('DB_PORT', '3307')
 DB_NAME = os.environ.get('DB_NAME', 'pca_sdlc')
 
 # A MÁGICA: Forçamos a verificação da variável de ambiente
-if os.environ.get('AMBIENTE_DE_TESTE') == 'True' or os.environ.get('CI') == 'true':
+if os.environ.get('PCA_DATABASE_URL'):
+    # URL explícita (ex: sqlite:///bench.db nos benchmarks ou um MySQL em container)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['PCA_DATABASE_URL']
+elif os.environ.get('AMBIENTE_DE_TESTE') == 'True' or os.environ.get('CI') == 'true':
     # Usa banco em memória (SQLite) para testes locais ou no GitHub Actions
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
 else:
-    # Usa MySQL para desenvolvimento local ou Produção
-    app.config['SQLALCHEMY_DATABASE_URI'] = f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    # Usa MySQL para desenvolvimento local ou Produção (driver em PCA_DB_DRIVER: pymysql ou mysqlconnector)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url_mysql(DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME, os.environ.get('PCA_DB_DRIVER', 'pymysql'))
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pool de conexões (tamanho, overflow, pre-ping, reciclagem) vindo do ambiente: ver pool_banco.py
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opcoes_engine(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=5)
 
 # ============================================================================
@@ -53,56 +92,131 @@ app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_USERNAME')
 
 mail = Mail(app)
+# Os e-mails saem por um thread de fundo (ver fila_email.py); desligável para rodar o envio por cron ('flask enviar-emails')
+app.config['EMAIL_ENVIO_AUTOMATICO'] = os.environ.get('PCA_EMAIL_ENVIO_AUTOMATICO', 'True') == 'True'
+enviador_email = EnviadorEmail(app, mail)
 # Gerador de tokens seguros usando a chave mestra da aplicação
 s = URLSafeTimedSerializer(app.secret_key)
 
 # Vincula o banco de dados à aplicação Flask
 db.init_app(app)
 
+# Janela máxima (segundos) em que um worker pode servir o Ente/última atualização sem reconferir o banco
+cache_global.janela = float(os.environ.get('PCA_CACHE_JANELA', 5))
+
+# Medição por requisição: comandos SQL, tempo no banco e total (cabeçalho Server-Timing)
+# e log de SQL/requisições acima dos limites (instrumentacao.py). Registrada antes dos
+# demais hooks para cobrir também o bootstrap da primeira requisição.
+app.config['INSTRUMENTACAO'] = os.environ.get('PCA_INSTRUMENTACAO', 'True') == 'True'
+app.config['LIMITE_SQL_LENTO_MS'] = float(os.environ.get('PCA_LIMITE_SQL_LENTO_MS', 200))
+app.config['LIMITE_REQUISICAO_LENTA_MS'] = float(os.environ.get('PCA_LIMITE_REQUISICAO_LENTA_MS', 1000))
+instrumentacao.init_app(app)
+
+# Métricas para o Prometheus em /metrics (metricas.py): latência por endpoint, exportações,
+# linhas servidas e pool do banco, somadas entre os workers do Gunicorn
+metricas.init_app(app, estado_pool=lambda: metricas_pool(db.engine))
+QueuePoolInstrumentado.observadores_espera.append(observar_espera_pool)
+
+# Compressão gzip/brotli/zstd das respostas de texto (compressao.py): páginas acima do
+# mínimo (bytes) e exportações em streaming; xlsx, pdf e arquivos estáticos ficam de fora
+app.config['COMPRESSAO'] = os.environ.get('PCA_COMPRESSAO', 'True') == 'True'
+app.config['COMPRESSAO_MINIMO'] = int(os.environ.get('PCA_COMPRESSAO_MINIMO', 1024))
+app.config['COMPRESSAO_NIVEIS'] = {
+    'gzip': int(os.environ.get('PCA_COMPRESSAO_NIVEL_GZIP', 6)),
+    'br': int(os.environ.get('PCA_COMPRESSAO_NIVEL_BROTLI', 4)),
+    'zstd': int(os.environ.get('PCA_COMPRESSAO_NIVEL_ZSTD', 3)),
+}
+compressao.init_app(app)
+
 # ============================================================================
-# BOOTSTRAP: CRIAÇÃO AUTOMÁTICA DE BANCO E ADMIN (Roda no Gunicorn e no Local)
+# BOOTSTRAP: CRIAÇÃO DE BANCO E ADMIN (flask init-db ou na 1ª requisição)
 # ============================================================================
-with app.app_context():
-        # 1. Cria todas as tabelas no MySQL baseadas no models.py
-        db.create_all()
-        
-        # 2. Verifica se existe pelo menos uma Secretaria (Obrigatório para o FK)
-        sec_padrao = Secretaria.query.filter_by(nome='Secretaria de Administração').first()
-        if not sec_padrao:
-            sec_padrao = Secretaria(nome='Secretaria de Administração')
-            db.session.add(sec_padrao)
-            db.session.commit() # Commitamos aqui para gerar o ID da secretaria
-            
-        # 3. Verifica se o usuário 'admin' existe, se não, cria.
-        admin_user = Usuario.query.filter_by(login='admin').first()
-        if not admin_user:
-            novo_admin = Usuario(
-                nome='Administrador do Sistema',
-                login='admin',
-                secretaria_id=sec_padrao.id
-            )
+# Importar o app não toca no banco: assim o master do Gunicorn (--preload) não
+# abre conexões que seriam herdadas pelos workers, e subir um worker (ou rodar
+# os testes) não depende do MySQL. O deploy roda 'flask init-db'; por garantia,
+# a primeira requisição de cada processo faz o mesmo (idempotente, sob trava),
+# menos as migrações: DDL num ALTER longo travaria requisições e vários workers.
+# Ali só se confere a versão do esquema e, se houver pendência, fica o aviso no log.
+# Em produção com init-db no deploy, dá para desligar com PCA_BOOTSTRAP_AUTOMATICO=False.
+app.config['BOOTSTRAP_AUTOMATICO'] = os.environ.get('PCA_BOOTSTRAP_AUTOMATICO', 'True') == 'True'
+
+def inicializar_banco(migrar=True):
+    """
+    Cria tabelas, aplica migrações e garante a Secretaria padrão e o usuário admin. Pode rodar várias vezes.
+    Com migrar=False (primeira requisição), as migrações pendentes só são avisadas no log.
+    """
+    # 1. Cria todas as tabelas no MySQL baseadas no models.py
+    db.create_all()
+    # 1.1 Índices e demais mudanças de esquema em bases que já existiam (migracoes.py)
+    if migrar:
+        aplicar_migracoes()
+    else:
+        with db.engine.connect() as conexao:
+            pendentes = migracoes_pendentes(conexao, criar=False)
+        if pendentes:
+            app.logger.warning("Esquema do banco desatualizado: migrações %s pendentes. Rode 'flask migrar'.",
+                               ', '.join(str(m[0]) for m in pendentes))
+
+    # 2. Verifica se existe pelo menos uma Secretaria (Obrigatório para o FK)
+    sec_padrao = Secretaria.query.filter_by(nome='Secretaria de Administração').first()
+    if not sec_padrao:
+        sec_padrao = Secretaria(nome='Secretaria de Administração')
+        db.session.add(sec_padrao)
+        db.session.commit() # Commitamos aqui para gerar o ID da secretaria
+
+    # 3. Verifica se o usuário 'admin' existe, se não, cria.
+    admin_user = Usuario.query.filter_by(login='admin').first()
+    if not admin_user:
+        novo_admin = Usuario(
+            nome='Administrador do Sistema',
+            login='admin',
+            secretaria_id=sec_padrao.id
+        )
 
-            # Puxa a senha do .env (Se não existir lá, usa uma senha aleatória gerada na hora para não travar)
-            import secrets
-            senha_inicial = os.environ.get('ADMIN_DEFAULT_PASSWORD', secrets.token_hex(8))
-            novo_admin.set_password(senha_inicial)
+        # Puxa a senha do .env (Se não existir lá, usa uma senha aleatória gerada na hora para não travar)
+        import secrets
+        senha_inicial = os.environ.get('ADMIN_DEFAULT_PASSWORD', secrets.token_hex(8))
+        novo_admin.set_password(senha_inicial)
 
-            #novo_admin.set_password('admin123') # Usa a função de hash segura do models.py!
-            
-            db.session.add(novo_admin)
-            db.session.commit()
-            print("Bootstrapping concluído: Secretaria Padrão e Usuário Admin criados.")
+        db.session.add(novo_admin)
+        db.session.commit()
+        print("Bootstrapping concluído: Secretaria Padrão e Usuário Admin criados.")
+
+_trava_bootstrap = threading.Lock()
+_banco_inicializado = False
+_enviador_iniciado = False  # Por processo: o master do --preload não atende requisições, só os workers
+
+@app.before_request
+def garantir_banco_inicializado():
+    global _banco_inicializado, _enviador_iniciado
+    if not _enviador_iniciado and app.config['EMAIL_ENVIO_AUTOMATICO']:
+        # Cada worker liga o seu enviador uma vez (mensagens que sobraram de antes do restart também saem)
+        enviador_email.iniciar()
+        _enviador_iniciado = True
+    if _banco_inicializado or not app.config['BOOTSTRAP_AUTOMATICO']:
+        return
+    with _trava_bootstrap:
+        if not _banco_inicializado:
+            inicializar_banco(migrar=False)
+            _banco_inicializado = True
+
+@app.cli.command('init-db')
+def init_db_cli():
+    """Cria/atualiza o esquema do banco e o usuário admin inicial (rodar a cada deploy)."""
+    try:
+        inicializar_banco()
+    except MigracaoEmAndamento as e:
+        raise click.ClickException(str(e))
+    click.echo('Banco de dados pronto.')
 
 # Injeta os dados do Ente e a data da última contratação em TODOS os arquivos HTML
 # Injeta os dados do Ente, data e o ano atual em TODOS os arquivos HTML
 # Injeta os dados Globais em TODOS os arquivos HTML
 @app.context_processor
 def injetar_dados_globais():
-    ente = Ente.query.first()
-    
-    # 1. HORA DA ÚLTIMA ATUALIZAÇÃO DO BANCO DE DADOS (Usado no site)
-    ultima_modificacao = Contratacao.query.order_by(Contratacao.data_atualizacao.desc()).first()
-    data_ultima_modificacao = ultima_modificacao.data_atualizacao if ultima_modificacao else None
+    # 1. ENTE E HORA DA ÚLTIMA ATUALIZAÇÃO DO BANCO DE DADOS (Usado no site)
+    # Vêm do cache por processo (cache_global.py), invalidado pelos eventos do models.py
+    ente, data_ultima_modificacao = cache_global.obter()
     
     # 2. HORA DE AGORA DO SERVIDOR (Usado no PDF e no ano atual)
     data_hora_agora = datetime.now()
@@ -118,22 +232,78 @@ def injetar_dados_globais():
 # ============================================================================
 # FILTROS CUSTOMIZADOS (LOCALIZAÇÃO PT-BR)
 # ============================================================================
-@app.template_filter('moeda_br')
-def formatar_moeda(valor):
-    if valor is None:
-        return "0,00"
-    # Coloca vírgula nos milhares e ponto no decimal, depois inverte para o padrão BR
-    return "{:,.2f}".format(valor).replace(",", "X").replace(".", ",").replace("X", ".")
+# formatar_moeda mora em exportacao.py porque o PDF nativo também a usa
+app.add_template_filter(formatar_moeda, 'moeda_br')
 
 # ============================================================================
-# PROTEÇÃO CONTRA CACHE DE NAVEGADOR (SEGURANÇA)
+# POLÍTICA DE CACHE HTTP (PÚBLICO x ADMINISTRATIVO)
 # ============================================================================
+# Por padrão, nada é guardado (área administrativa, login, tarefas). As rotas
+# públicas marcadas com @cache_publico são iguais para qualquer cidadão, então
+# recebem ETag forte (filtros + versão dos dados) e Cache-Control: public,
+# podendo ser servidas por navegador, proxy reverso ou CDN.
+app.config['CACHE_PUBLICO_MAX_AGE'] = int(os.environ.get('PCA_CACHE_PUBLICO_MAX_AGE', 60))
+
+def etag_publica():
+    """
+    Identifica o conteúdo da resposta pública sem gerá-la: rota + parâmetros
+    da URL + carimbo de versão dos dados (qualquer escrita em Contratacao, Ente
+    ou Secretaria muda o carimbo) + ano corrente (sugerido no filtro da home) +
+    compressão negociada (a versão gzip e a sem compressão são corpos diferentes) +
+    versão dos estáticos (depois de um deploy com CSS/JS novos, o HTML em cache
+    apontaria para nomes versionados que já não existem).
+    """
+    partes = (request.endpoint, sorted((request.view_args or {}).items()),
+              sorted(request.args.items(multi=True)), cache_global.versao_atual(), datetime.now().year,
+              compressao.codificacao_negociada(), estaticos.versao)
+    return hashlib.sha256(repr(partes).encode('utf-8')).hexdigest()[:32]
+
+def cache_publico(view):
+    """
+    Responde 304 a If-None-Match / If-Modified-Since ANTES de chamar a view
+    (nenhuma consulta pesada roda). Custo da validação: o carimbo de versão,
+    que já vem do cache por processo.
+    """
+    @wraps(view)
+    def view_com_cache(*args, **kwargs):
+        # Usuário logado ou mensagem flash pendente: a página não é a mesma para todos
+        if session.get('user_id') or session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        etag = etag_publica()
+        alterado_em = cache_global.alterado_em()
+        alterado_em = alterado_em.replace(microsecond=0).astimezone(timezone.utc) if alterado_em else None
+
+        if request.if_none_match:
+            # If-None-Match tem precedência e usa comparação fraca (proxies com gzip enfraquecem a ETag)
+            nao_mudou = request.if_none_match.contains_weak(etag)
+        else:
+            nao_mudou = bool(request.if_modified_since and alterado_em and alterado_em <= request.if_modified_since)
+
+        if nao_mudou:
+            resposta = app.response_class(status=304)
+        else:
+            resposta = app.make_response(view(*args, **kwargs))
+            if resposta.status_code != 200:
+                return resposta
+
+        resposta.set_etag(etag)
+        resposta.vary.add('Accept-Encoding')
+        if alterado_em:
+            resposta.last_modified = alterado_em
+        # Substitui inteiro: o send_file das exportações já vem com 'no-cache'
+        resposta.headers['Cache-Control'] = f"public, max-age={app.config['CACHE_PUBLICO_MAX_AGE']}"
+        return resposta
+    return view_com_cache
+
 @app.after_request
 def add_header(response):
     """
-    Força o navegador a não guardar cache de nenhuma página.
+    Força o navegador a não guardar cache das páginas não públicas.
     Impede que o usuário use o botão 'Voltar' do navegador após o logout.
     """
+    if response.cache_control.public:
+        return response  # Política já definida por @cache_publico
     response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '-1'
@@ -143,181 +313,430 @@ def add_header(response):
 # INTERFACE PÚBLICA (TRANSPARÊNCIA)
 # ============================================================================
 
+# ============================================================================
+# FILTROS E PAGINAÇÃO POR CURSOR (KEYSET) DA LISTAGEM PÚBLICA
+# ============================================================================
+# Tamanho padrão da página da consulta pública e o teto aceito via "?por_pagina="
+app.config['TAMANHO_PAGINA'] = int(os.environ.get('PCA_TAMANHO_PAGINA', 100))
+app.config['TAMANHO_PAGINA_MAXIMO'] = int(os.environ.get('PCA_TAMANHO_PAGINA_MAXIMO', 500))
+app.config['TAMANHO_PAGINA_PAINEL'] = int(os.environ.get('PCA_TAMANHO_PAGINA_PAINEL', 50)) # Itens por página no painel administrativo
+
+# Exportações: modo de memória constante (write-only) e tamanho do lote lido do banco por vez
+app.config['EXCEL_STREAMING'] = os.environ.get('PCA_EXCEL_STREAMING', 'True') == 'True'
+app.config['EXPORTACAO_LOTE'] = int(os.environ.get('PCA_EXPORTACAO_LOTE', 1000))
+# O ReportLab guarda as páginas prontas até o save(): PDFs maiores saem da fila de tarefas, não do worker web.
+# Os botões da home usam o mesmo limite para decidir entre o download direto e a fila (Excel e PDF)
+app.config['PDF_MAX_LINHAS'] = int(os.environ.get('PCA_PDF_MAX_LINHAS', 5000))
+
+# Importação em lote: linhas por INSERT executemany
+app.config['IMPORTACAO_LOTE'] = int(os.environ.get('PCA_IMPORTACAO_LOTE', 1000))
+
+# Cache em disco das exportações (pasta e limite em PCA_CACHE_EXPORTACAO_DIR / PCA_CACHE_EXPORTACAO_MB)
+app.config['CACHE_EXPORTACAO'] = os.environ.get('PCA_CACHE_EXPORTACAO', 'True') == 'True'
+
+def decodificar_cursor(valor):
+    """Converte o cursor da URL ("exercicio.id") na tupla (exercicio, id). Cursor inválido é ignorado."""
+    try:
+        exercicio, id_ = valor.split('.')
+        return int(exercicio), int(id_)
+    except (AttributeError, ValueError):
+        return None
+
+def url_com_cursor(**cursor):
+    """Monta a URL da página atual preservando os filtros e trocando apenas o cursor."""
+    args = request.args.to_dict()
+    args.pop('apos', None)
+    args.pop('antes', None)
+    args.update(cursor)
+    return url_for(request.endpoint, **args)
+
+def paginar_keyset(query):
+    """
+    Paginação por busca (seek) na chave (exercicio, id).
+    Diferente do OFFSET, o banco salta direto para o cursor pelo índice,
+    então o custo de qualquer página é o mesmo, seja a primeira ou a milésima.
+    """
+    tamanho = request.args.get('por_pagina', app.config['TAMANHO_PAGINA'], type=int)
+    tamanho = max(1, min(tamanho, app.config['TAMANHO_PAGINA_MAXIMO']))
+
+    # Contagem barata: COUNT direto no banco, sem ORDER BY e sem carregar linhas
+    total = query.order_by(None).with_entities(db.func.count(Contratacao.id)).scalar()
+
+    apos = decodificar_cursor(request.args.get('apos'))
+    antes = decodificar_cursor(request.args.get('antes'))
+
+    # O "exercicio >=" / "exercicio <=" na frente é redundante para o resultado,
+    # mas é o que deixa o banco entrar no índice (exercicio, id) direto no cursor;
+    # só com o OR ele percorria o índice desde o começo a cada página.
+    if antes:
+        # Página anterior: percorre a chave ao contrário e depois desinverte
+        query = query.filter(Contratacao.exercicio <= antes[0], db.or_(
+            Contratacao.exercicio < antes[0], Contratacao.id < antes[1]
+        )).order_by(Contratacao.exercicio.desc(), Contratacao.id.desc())
+    else:
+        if apos:
+            query = query.filter(Contratacao.exercicio >= apos[0], db.or_(
+                Contratacao.exercicio > apos[0], Contratacao.id > apos[1]
+            ))
+        query = query.order_by(Contratacao.exercicio, Contratacao.id)
+
+    # Busca um item a mais só para saber se existe página seguinte
+    itens = query.limit(tamanho + 1).all()
+    tem_mais = len(itens) > tamanho
+    itens = itens[:tamanho]
+    if antes: itens.reverse()
+
+    tem_proxima = tem_mais if not antes else True
+    tem_anterior = bool(apos) or (antes is not None and tem_mais)
+
+    paginacao = dict(total=total, tamanho=tamanho, url_proxima=None, url_anterior=None)
+    if itens and tem_proxima:
+        paginacao['url_proxima'] = url_com_cursor(apos=f"{itens[-1].exercicio}.{itens[-1].id}")
+    if itens and tem_anterior:
+        paginacao['url_anterior'] = url_com_cursor(antes=f"{itens[0].exercicio}.{itens[0].id}")
+    return itens, paginacao
+
 @app.route('/')
+@cache_publico
 def home():
     secretarias = Secretaria.query.all()
-    
-    # Filtros recebidos da URL
-    sec_id = request.args.get('secretaria')
-    exercicio = request.args.get('exercicio')
-    codigo = request.args.get('codigo')
 
-    query = Contratacao.query
-    if sec_id: query = query.filter_by(secretaria_id=sec_id)
-    if exercicio: query = query.filter_by(exercicio=exercicio)
-    if codigo: query = query.filter(Contratacao.codigo_identificador.like(f"%{codigo}%"))
-
-    contratacoes = query.all()
-    return render_template('home.html', contratacoes=contratacoes, secretarias=secretarias)
+    # Filtros recebidos da URL + página atual pelo cursor
+    contratacoes, paginacao = paginar_keyset(contratacoes_filtradas(request.args))
+    linhas_servidas.labels('home').inc(len(contratacoes))
+    return render_template('home.html', contratacoes=contratacoes, secretarias=secretarias, paginacao=paginacao,
+                           filtros=filtros_da_url(request.args))
+
+@app.route('/resumo')
+@cache_publico
+def resumo():
+    """Quanto cada secretaria planeja gastar por exercício (e mês), lido da tabela agregada (resumo.py)."""
+    exercicio = request.args.get('exercicio', type=int)
+    linhas = resumo_gastos(exercicio)
+    if request.args.get('formato') == 'json':
+        return jsonify(exercicio=exercicio, secretarias=linhas)
+    return render_template('resumo.html', linhas=linhas, exercicio=exercicio, exercicios=exercicios_com_resumo(),
+                           total_geral=sum(l['total'] or 0 for l in linhas))
 
 # ============================================================================
 # EXPORTAÇÃO DE RELATÓRIOS (EXCEL E PDF) OFICIAIS
 # ============================================================================
 
-def obter_dados_filtrados():
-    """Lê os filtros da URL e busca os dados exatos que o cidadão está vendo na tela."""
-    sec_id = request.args.get('secretaria')
+def obter_consulta_filtrada():
+    """Lê os filtros da URL e monta a consulta com os dados exatos que o cidadão está vendo na tela."""
+    # type=int: "Todas" ou um valor inválido (?secretaria=abc) ficam como None em vez de virar erro 500
+    sec_id = request.args.get('secretaria', type=int)
     exercicio = request.args.get('exercicio')
-    codigo = request.args.get('codigo')
-    
-    query = Contratacao.query
-    if sec_id: query = query.filter_by(secretaria_id=sec_id)
-    if exercicio: query = query.filter_by(exercicio=exercicio)
-    if codigo: query = query.filter(Contratacao.codigo_identificador.like(f"%{codigo}%"))
-        
+
+    query = contratacoes_filtradas(request.args).order_by(Contratacao.exercicio, Contratacao.id)
+
     orgao_nome = "Consolidado (Todas as Secretarias)"
-    if sec_id and sec_id != 'Todas':
-        sec = Secretaria.query.get(int(sec_id))
+    if sec_id is not None:
+        sec = db.session.get(Secretaria, sec_id)
         if sec: orgao_nome = sec.nome
-            
-    contratacoes = query.all()
-    ente = Ente.query.first()
-    return contratacoes, ente, exercicio, orgao_nome
 
-@app.route('/exportar/excel')
-def exportar_excel():
-    contratacoes, ente, exercicio, orgao_nome = obter_dados_filtrados()
-    
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "PCA_Exportacao"
-
-    # 1. CABEÇALHO DO ÓRGÃO
-    ws.merge_cells('B1:F1')
-    ws['B1'] = ente.nome if ente else 'Órgão Público'
-    ws['B1'].font = Font(size=14, bold=True, color="24549C")
-    
-    ws.merge_cells('B2:F2')
-    ws['B2'] = f"Plano de Contratações Anual - {exercicio or 'Geral'}"
-    ws['B2'].font = Font(size=12, bold=True)
+    ente, _ = cache_global.obter()
+    return query, ente, exercicio, orgao_nome
 
-    ws.merge_cells('B3:F3')
-    ws['B3'] = f"Escopo: {orgao_nome}"
-    
-    # Altura das linhas do cabeçalho
-    for i in range(1, 5): ws.row_dimensions[i].height = 20
+def obter_dados_filtrados():
+    """Mesma consulta de obter_consulta_filtrada(), já materializada em lista (usada pelo relatório HTML)."""
+    query, ente, exercicio, orgao_nome = obter_consulta_filtrada()
+    return query.all(), ente, exercicio, orgao_nome
 
-    # 2. INSERIR LOGOTIPO (Se existir)
-    if ente and ente.logo_path:
-        logo_full_path = os.path.join(app.root_path, 'static', ente.logo_path)
-        if os.path.exists(logo_full_path):
-            try:
-                img = xlImage(logo_full_path)
-                img.width, img.height = 75, 75
-                ws.add_image(img, 'A1')
-            except Exception as e:
-                print(f"Aviso: Não foi possível anexar a imagem no Excel: {e}")
-
-    # 3. CABEÇALHO DA TABELA
-    headers = ['Código', 'Exercício', 'Secretaria', 'Objeto', 'Data Planejada', 'Dotação', 'Valor Estimado (R$)']
-    row_num = 5
-    for col_num, header_title in enumerate(headers, 1):
-        cell = ws.cell(row=row_num, column=col_num, value=header_title)
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color="24549C", end_color="24549C", fill_type="solid")
-        cell.alignment = Alignment(horizontal="center")
-        ws.column_dimensions[openpyxl.utils.get_column_letter(col_num)].width = 20
-
-    # Alargando a coluna do Objeto
-    ws.column_dimensions['D'].width = 60
-
-    # 4. PREENCHER DADOS
-    # Criamos o estilo de alinhamento centralizado uma única vez para otimizar a memória
-    center_alignment = Alignment(horizontal="center", vertical="center")
-
-    for c in contratacoes:
-        row_num += 1
-        
-        # Coluna 1: Código (Centralizado)
-        cell_codigo = ws.cell(row=row_num, column=1, value=c.codigo_identificador)
-        cell_codigo.alignment = center_alignment
-        
-        # Coluna 2: Exercício (Centralizado)
-        cell_exercicio = ws.cell(row=row_num, column=2, value=c.exercicio)
-        cell_exercicio.alignment = center_alignment
-        
-        # Coluna 3: Secretaria (Padrão/Esquerda)
-        ws.cell(row=row_num, column=3, value=c.secretaria.nome)
-        
-        # Coluna 4: Objeto (Padrão/Esquerda)
-        ws.cell(row=row_num, column=4, value=c.objeto)
-        
-        # Coluna 5: Data Planejada (Centralizado)
-        cell_data = ws.cell(row=row_num, column=5, value=c.data_planejada.strftime('%d/%m/%Y') if c.data_planejada else '-')
-        cell_data.alignment = center_alignment
-        
-        # Coluna 6: Dotação (Centralizado)
-        cell_dotacao = ws.cell(row=row_num, column=6, value=c.dotacao)
-        cell_dotacao.alignment = center_alignment
-        
-        # Coluna 7: Valor Estimado (Formato Contábil, Excel alinha à direita nativamente)
-        cell_valor = ws.cell(row=row_num, column=7, value=float(c.valor_estimado))
-        cell_valor.number_format = 'R$ #,##0.00'
+def logo_ente(ente, variante):
+    """Bytes da variante ('excel' ou 'pdf') do logotipo do Ente, em cache na memória (ou None)."""
+    return cache_logos.obter(os.path.join(app.root_path, 'static'), ente.logo_path if ente else None, variante)
 
-    out = io.BytesIO()
-    wb.save(out)
-    out.seek(0)
-    
-    return send_file(
-        out, 
+def enviar_exportacao(tipo, extensao, mimetype, download_name, gerar, as_attachment=True, desviar=None):
+    """
+    Entrega uma exportação pelo cache em disco (cache_exportacao.py).
+    'gerar(arquivo)' só é chamado quando não existe arquivo para estes filtros
+    nesta versão dos dados; num acerto, a resposta é só um open() + sendfile.
+    'desviar()', se informado, é consultado antes de gerar: quando devolve uma
+    resposta, ela substitui a geração síncrona.
+    """
+    duracao = None
+    def gerar_medindo(arquivo):
+        nonlocal duracao
+        inicio = time.perf_counter()
+        gerar(arquivo)
+        duracao = time.perf_counter() - inicio
+
+    out = None
+    if app.config['CACHE_EXPORTACAO']:
+        chave = chave_exportacao(tipo, request.args)
+        out = cache_exportacao.abrir(chave, extensao)
+    if out is None:
+        resposta = desviar() if desviar is not None else None
+        if resposta is not None:
+            return resposta
+        if app.config['CACHE_EXPORTACAO']:
+            out = cache_exportacao.gravar(chave, extensao, gerar_medindo)
+        else:
+            # Sem cache: arquivo temporário apagado automaticamente quando o send_file termina
+            out = tempfile.TemporaryFile()
+            gerar_medindo(out)
+            out.seek(0)
+
+    registrar_exportacao(tipo, out, duracao)
+    return send_file(out, mimetype=mimetype, as_attachment=as_attachment, download_name=download_name)
+
+def chave_exportacao(tipo, valores):
+    """Chave do cache em disco para a exportação 'tipo' com os filtros de 'valores', na versão atual dos dados."""
+    return cache_exportacao.chave(tipo, filtros_normalizados(valores), cache_global.versao_atual())
+
+def exportacao_grande(valores):
+    """Mais linhas que PDF_MAX_LINHAS com os filtros de 'valores': grande demais para gerar no worker web."""
+    return contratacoes_filtradas(valores).order_by(None).count() > app.config['PDF_MAX_LINHAS']
+
+def gerar_excel(out):
+    """Monta a planilha dos filtros da requisição atual dentro do arquivo binário 'out'."""
+    query, ente, exercicio, orgao_nome = obter_consulta_filtrada()
+    logo = logo_ente(ente, 'excel')
+    if app.config['EXCEL_STREAMING']:
+        # Linhas lidas do banco em lotes e gravadas direto no arquivo (disco, não RAM)
+        linhas = contar_linhas('excel', linhas_exportacao(query, app.config['EXPORTACAO_LOTE']))
+        gerar_excel_streaming(out, linhas, ente, exercicio, orgao_nome, logo)
+    else:
+        contratacoes = query.all()
+        linhas_servidas.labels('excel').inc(len(contratacoes))
+        out.write(gerar_excel_em_memoria(contratacoes, ente, exercicio, orgao_nome, logo).getvalue())
+
+@app.route('/exportar/excel')
+@cache_publico
+def exportar_excel():
+    exercicio = request.args.get('exercicio')
+    return enviar_exportacao(
+        'excel', 'xlsx',
         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        as_attachment=True,
-        download_name=f'PCA_{exercicio or "Completo"}.xlsx'
+        download_name=f'PCA_{exercicio or "Completo"}.xlsx',
+        gerar=gerar_excel
+    )
+
+# ============================================================================
+# EXPORTAÇÕES EM SEGUNDO PLANO (FILA LOCAL DE TAREFAS)
+# ============================================================================
+fila_tarefas = FilaTarefas(
+    pasta=os.environ.get('PCA_TAREFAS_DIR', os.path.join(tempfile.gettempdir(), 'pca_tarefas')),
+    concorrencia=int(os.environ.get('PCA_TAREFAS_CONCORRENCIA', 1)),
+    max_fila=int(os.environ.get('PCA_TAREFAS_MAX_FILA', 4)),
+    ttl=int(os.environ.get('PCA_TAREFAS_TTL', 3600)),
+    modo=os.environ.get('PCA_TAREFAS_MODO', 'processo'),
+)
+
+def inicializar_processo_tarefas():
+    """Roda em cada processo do pool: as conexões herdadas do worker pai não podem ser reusadas."""
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+fila_tarefas.inicializador = inicializar_processo_tarefas
+
+def executar_em_contexto(tipo, extensao, gerar, rota):
+    """
+    Adapta um gerador de exportação ao formato de tarefa: reconstrói a requisição
+    (filtros) e grava no destino. O arquivo pronto também entra no cache em disco,
+    para o próximo pedido com os mesmos filtros sair pelo download direto.
+    """
+    def tarefa(args, destino):
+        with app.test_request_context(rota, query_string=args):
+            # Chave com a versão de antes da geração, como em enviar_exportacao()
+            chave = chave_exportacao(tipo, request.args) if app.config['CACHE_EXPORTACAO'] else None
+            with open(destino, 'wb') as out:
+                gerar(out)
+            if chave:
+                with open(destino, 'rb') as pronto:
+                    cache_exportacao.gravar(chave, extensao, lambda arquivo: shutil.copyfileobj(pronto, arquivo)).close()
+    return tarefa
+
+registrar_tipo('excel', 'xlsx', executar_em_contexto('excel', 'xlsx', gerar_excel, '/exportar/excel'))
+
+@app.route('/exportar/tarefas', methods=['POST'])
+@csrf.exempt # API pública sem sessão: nada é alterado em nome de um usuário logado
+def criar_tarefa_exportacao():
+    tipo = request.values.get('tipo', 'excel')
+    if tipo not in TIPOS_TAREFA:
+        return jsonify(erro=f'Tipo de exportação inválido: {tipo}'), 400
+
+    _, extensao = TIPOS_TAREFA[tipo]
+    em_cache = app.config['CACHE_EXPORTACAO'] and cache_exportacao.contem(chave_exportacao(tipo, request.values), extensao)
+    if em_cache or not exportacao_grande(request.values):
+        # Já pronta no cache ou pequena: o download direto responde na hora, sem ocupar o pool
+        filtros = {chave: request.values[chave] for chave, valor in filtros_normalizados(request.values) if valor}
+        return redirect(url_for(f'exportar_{tipo}', **filtros), 303)
+    return responder_tarefa(tipo, request.values)
+
+def responder_tarefa(tipo, valores):
+    """Põe a exportação na fila com os filtros de 'valores' e responde 202 com a URL de acompanhamento."""
+    filtros = {chave: valor for chave, valor in filtros_normalizados(valores) if valor}
+    try:
+        id_tarefa = fila_tarefas.submeter(tipo, filtros)
+    except FilaCheia:
+        return jsonify(erro='Muitas exportações em andamento. Tente novamente em instantes.'), 503, {'Retry-After': '10'}
+
+    url_status = url_for('status_tarefa_exportacao', id_tarefa=id_tarefa)
+    return jsonify(id=id_tarefa, estado='na_fila', url_status=url_status), 202, {'Location': url_status}
+
+@app.route('/exportar/tarefas/<id_tarefa>')
+def status_tarefa_exportacao(id_tarefa):
+    status = fila_tarefas.status(id_tarefa)
+    if status is None:
+        return jsonify(erro='Tarefa não encontrada ou expirada.'), 404
+    if status['estado'] == 'concluida':
+        status['url_download'] = url_for('download_tarefa_exportacao', id_tarefa=id_tarefa)
+    return jsonify(status)
+
+@app.route('/exportar/tarefas/<id_tarefa>/download')
+def download_tarefa_exportacao(id_tarefa):
+    status = fila_tarefas.status(id_tarefa)
+    if status is None or status['estado'] != 'concluida':
+        return jsonify(erro='Arquivo indisponível.'), 404
+    _, extensao = TIPOS_TAREFA[status['tipo']]
+    return send_file(fila_tarefas.caminho_arquivo(status), as_attachment=True, download_name=f'PCA_{id_tarefa[:8]}.{extensao}')
+
+# ============================================================================
+# DADOS ABERTOS (CSV E NDJSON) PARA CONSUMO AUTOMATIZADO
+# ============================================================================
+FORMATOS_DADOS_ABERTOS = {
+    'csv': (gerar_csv, 'text/csv; charset=utf-8'),
+    'ndjson': (gerar_ndjson, 'application/x-ndjson; charset=utf-8'),
+}
+
+@app.route('/exportar/<any(csv, ndjson):formato>')
+@cache_publico
+def exportar_dados_abertos(formato):
+    """
+    Mesmos filtros da tela, mas em streaming: as linhas saem do cursor do banco
+    direto para a resposta, sem objetos do ORM e sem montar o arquivo inteiro.
+    """
+    query, _, exercicio, _ = obter_consulta_filtrada()
+    gerador, mimetype = FORMATOS_DADOS_ABERTOS[formato]
+    nomes_colunas = [coluna.key for coluna in COLUNAS_DADOS_ABERTOS]
+    linhas = contar_linhas(formato, linhas_exportacao(query, app.config['EXPORTACAO_LOTE'], COLUNAS_DADOS_ABERTOS))
+
+    return Response(
+        stream_with_context(gerador(linhas, nomes_colunas)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=PCA_{exercicio or "Completo"}.{formato}'}
     )
 
+def gerar_pdf(out):
+    """Desenha o relatório PDF (ReportLab) dos filtros da requisição atual dentro do arquivo binário 'out'."""
+    query, ente, exercicio, orgao_nome = obter_consulta_filtrada()
+    linhas = contar_linhas('pdf', linhas_exportacao(query, app.config['EXPORTACAO_LOTE']))
+    gerar_pdf_streaming(out, linhas, ente, exercicio, orgao_nome, logo_ente(ente, 'pdf'))
+
+registrar_tipo('pdf', 'pdf', executar_em_contexto('pdf', 'pdf', gerar_pdf, '/exportar/pdf'))
+
+def desviar_pdf_grande():
+    """Acima de PDF_MAX_LINHAS, o PDF não é desenhado no worker web: o pedido vira tarefa (202)."""
+    if not exportacao_grande(request.args):
+        return None
+    return responder_tarefa('pdf', request.args)
+
 @app.route('/exportar/pdf')
+@cache_publico
 def exportar_pdf():
+    # PDF de verdade, gerado no servidor: entra no cache e pode ser baixado por scripts
+    exercicio = request.args.get('exercicio')
+    return enviar_exportacao(
+        'pdf', 'pdf',
+        mimetype='application/pdf',
+        download_name=f'PCA_{exercicio or "Completo"}.pdf',
+        gerar=gerar_pdf,
+        as_attachment=False,
+        desviar=desviar_pdf_grande
+    )
+
+@app.route('/exportar/impressao')
+@cache_publico
+def exportar_impressao():
+    """Versão HTML para impressão pelo navegador (window.print), mantida como alternativa ao PDF."""
     contratacoes, ente, exercicio, orgao_nome = obter_dados_filtrados()
     return render_template('relatorio_pdf.html', contratacoes=contratacoes, ente=ente, exercicio=exercicio, orgao_nome=orgao_nome)
 
+# ============================================================================
+# ENDPOINTS INTERNOS (OPERAÇÃO)
+# ============================================================================
+
+def acesso_interno_permitido():
+    """
+    Só a própria máquina (sem passar por proxy) ou quem apresentar o token
+    PCA_METRICAS_TOKEN no cabeçalho X-Token-Metricas.
+    """
+    token = os.environ.get('PCA_METRICAS_TOKEN')
+    if token and hmac.compare_digest(request.headers.get('X-Token-Metricas', ''), token):
+        return True
+    return request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers
+
+@app.route('/interno/pool')
+def metricas_pool_conexoes():
+    """Estado do pool de conexões deste worker (em uso, overflow, tempo de espera)."""
+    if not acesso_interno_permitido():
+        return jsonify(erro='Acesso negado.'), 403
+    return jsonify(metricas_pool(db.engine))
+
+@app.route('/metrics')
+def metricas_prometheus():
+    """Métricas de todos os workers no formato texto do Prometheus (metricas.py)."""
+    if not acesso_interno_permitido():
+        return jsonify(erro='Acesso negado.'), 403
+    metricas.atualizar_pool()
+    corpo, content_type = gerar_metricas()
+    return Response(corpo, content_type=content_type)
+
 # ============================================================================
 # INTERFACE ADMINISTRATIVA
 # ============================================================================
 
 @app.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
-    # 1. Busca os dados da prefeitura/ente no banco de dados primeiro
-    ente_atual = Ente.query.first()
+    # 1. Busca os dados da prefeitura/ente (em cache, sem ida ao banco na maioria das vezes)
+    ente_atual, _ = cache_global.obter()
     if request.method == 'POST':
         # TOLERÂNCIA A FALHAS: Tenta pegar pelo nome em português. Se não achar, pega pelo padrão inglês.
-        login_form = request.form.get('login') or request.form.get('username')
-        senha_form = request.form.get('senha') or request.form.get('password')
-        
-        user = Usuario.query.filter_by(login=login_form).first()
-        
-        senha_valida = False
-        if user and senha_form:
-            try:
-                # Tenta usar o método do seu models.py
-                senha_valida = user.check_password(senha_form)
-            except AttributeError:
-                # Se o método não existir no seu modelo, usa a validação padrão do framework
-                from werkzeug.security import check_password_hash
-                senha_valida = check_password_hash(user.senha, senha_form)
-
-        # Se o usuário existir e a senha for válida...
-        if user and senha_valida:
+        login_form = (request.form.get('login') or request.form.get('username') or '').strip()
+        senha_form = request.form.get('senha') or request.form.get('password') or ''
+        ip = request.remote_addr or 'desconhecido'
+        chave_login = login_form.lower()
+
+        # 2. Limite de tentativas ANTES de consultar o banco ou calcular qualquer hash
+        if tentativas_por_ip.bloqueado(ip) or (chave_login and falhas_por_login.bloqueado(chave_login)):
+            flash('Muitas tentativas de acesso. Aguarde alguns minutos e tente novamente.')
+            return render_template('admin_login.html', ente=ente_atual), 429, {'Retry-After': str(int(falhas_por_login.janela))}
+        tentativas_por_ip.registrar(ip)
+
+        # 3. Formulário incompleto não chega ao hash. Login inexistente paga o mesmo hash
+        #    (contra um hash fictício): nem a resposta nem o tempo revelam qual dos dois falhou.
+        user = None
+        if login_form and senha_form and len(senha_form) <= TAMANHO_MAXIMO_SENHA:
+            user = Usuario.query.filter_by(login=login_form).first()
+        if user is None and login_form:
+            conferir_hash(None, senha_form)  # Sempre False; só iguala o tempo de resposta
+
+        if user and user.check_password(senha_form):
+            falhas_por_login.liberar(chave_login)
+            if user.precisa_refazer_hash():
+                # Hash de um método/custo antigo: refeito agora que temos a senha em mãos
+                user.set_password(senha_form)
+                db.session.commit()
             session.clear()          # Prevenção contra Session Fixation (Sessão Zumbi)
             session.permanent = True # Ativa o Timeout de 5 minutos
             session['user_id'] = user.id
             session['user_login'] = user.login
             session['secretaria_id'] = user.secretaria_id
             return redirect(url_for('admin_dashboard'))
-        else:
-            flash('Login ou senha incorretos. Verifique suas credenciais.')
-            
+
+        if chave_login:
+            falhas_por_login.registrar(chave_login)
+        flash('Login ou senha incorretos. Verifique suas credenciais.')
+
     return render_template('admin_login.html', ente=ente_atual)
 
+@app.errorhandler(SistemaOcupado)
+def sistema_ocupado(erro):
+    """Pool de hash de senhas saturado neste worker: 503 imediato em vez de fila."""
+    return 'Sistema ocupado. Tente novamente em instantes.', 503, {'Retry-After': '5'}
+
 @app.route('/admin/logout')
 def admin_logout():
     session.clear() # Limpa absolutamente tudo da sessão no backend
@@ -334,8 +753,7 @@ def esqueci_senha():
         # Cria o link completo apontando para a nossa rota de reset
         link = url_for('resetar_senha_token', token=token, _external=True)
         
-        msg = Message('Recuperação de Senha - PCA', recipients=[email])
-        msg.body = f'''Olá {usuario.nome},
+        corpo = f'''Olá {usuario.nome},
 
 Você solicitou a recuperação da sua senha no sistema PCA.
 Para redefinir sua credencial, clique no link abaixo:
@@ -345,12 +763,12 @@ Para redefinir sua credencial, clique no link abaixo:
 Este link expira em 30 minutos.
 Se você não solicitou esta alteração, apenas ignore este e-mail.
 '''
-        try:
-            mail.send(msg)
-            flash('Se o e-mail estiver cadastrado, um link de recuperação será enviado. Verifique sua caixa de entrada e spam.')
-        except Exception as e:
-            flash('Erro interno ao tentar enviar o e-mail. Avise o suporte técnico.')
-            print(f"Erro SMTP: {e}")
+        # Só grava na caixa de saída: o SMTP fica com o thread de fundo, não com a requisição.
+        # Vários cliques seguidos para o mesmo e-mail viram uma única mensagem (a do link mais novo).
+        enfileirar_email(usuario.email, 'Recuperação de Senha - PCA', corpo, chave=f'recuperacao-senha:{usuario.id}')
+        if app.config['EMAIL_ENVIO_AUTOMATICO']:
+            enviador_email.avisar()
+        flash('Se o e-mail estiver cadastrado, um link de recuperação será enviado. Verifique sua caixa de entrada e spam.')
     else:
         # Regra de Segurança: Nunca revele se o e-mail existe ou não na base de dados
         flash('Se o e-mail estiver cadastrado, um link de recuperação será enviado. Verifique sua caixa de entrada e spam.')
@@ -399,16 +817,81 @@ def admin_dashboard():
     user_login = session.get('user_login')
     user_sec_id = session.get('secretaria_id')
     
-    # SE FOR O ADMIN: Vê todas as contratações e todas as secretarias no dropdown
+    # As contratações NÃO vêm mais na página: a tabela e os formulários de edição
+    # são carregados sob demanda pela API JSON abaixo, uma página por vez.
+
+    # SE FOR O ADMIN: Vê todas as secretarias no dropdown
     if user_login == 'admin':
-        contratacoes = Contratacao.query.all()
         secretarias = Secretaria.query.all()
     # SE FOR USUÁRIO COMUM: Vê apenas da sua secretaria e só pode escolher a sua própria
     else:
-        contratacoes = Contratacao.query.filter_by(secretaria_id=user_sec_id).all()
         secretarias = Secretaria.query.filter_by(id=user_sec_id).all()
         
-    return render_template('admin_dashboard.html', contratacoes=contratacoes, secretarias=secretarias)
+    return render_template('admin_dashboard.html', secretarias=secretarias, por_pagina=app.config['TAMANHO_PAGINA_PAINEL'])
+
+# ============================================================================
+# API JSON DO PAINEL (PAGINAÇÃO, ORDENAÇÃO E FILTROS NO SERVIDOR)
+# ============================================================================
+# Ordenações aceitas: nome -> colunas do ORDER BY (o id desempata, para a
+# paginação ser estável). A padrão (exercicio, id) usa os mesmos índices da home.
+ORDENACOES_PAINEL = {
+    'exercicio': (Contratacao.exercicio, Contratacao.id),
+    'codigo': (Contratacao.id,),
+    'objeto': (Contratacao.objeto, Contratacao.id),
+    'data': (Contratacao.data_planejada, Contratacao.id),
+    'valor': (Contratacao.valor_estimado, Contratacao.id),
+}
+def contratacao_para_dict(c):
+    return dict(
+        id=c.id, codigo=c.codigo_identificador, exercicio=c.exercicio,
+        secretaria_id=c.secretaria_id, secretaria=c.secretaria.nome,
+        objeto=c.objeto, descricao=c.descricao, dotacao=c.dotacao, valor_estimado=c.valor_estimado,
+        data_planejada=c.data_planejada.isoformat() if c.data_planejada else None,
+    )
+
+@app.route('/admin/api/contratacoes')
+def api_contratacoes():
+    """
+    Página de contratações visíveis para o usuário logado (admin: todas; demais:
+    só a própria secretaria). Parâmetros: pagina, por_pagina, ordem, direcao
+    (asc/desc) e os mesmos filtros da home (secretaria, exercicio, codigo, busca).
+    """
+    if 'user_id' not in session:
+        return jsonify(erro='Sessão expirada. Faça login novamente.'), 401
+
+    query = filtrar_contratacoes(contratacoes_do_usuario(session.get('user_login'), session.get('secretaria_id')), request.args)
+
+    pagina = max(1, request.args.get('pagina', 1, type=int))
+    por_pagina = request.args.get('por_pagina', app.config['TAMANHO_PAGINA_PAINEL'], type=int)
+    por_pagina = max(1, min(por_pagina, app.config['TAMANHO_PAGINA_MAXIMO']))
+    ordem = request.args.get('ordem', 'exercicio')
+    if ordem not in ORDENACOES_PAINEL:
+        return jsonify(erro=f"Ordenação inválida: {ordem}"), 400
+    colunas = ORDENACOES_PAINEL[ordem]
+    if request.args.get('direcao') == 'desc':
+        colunas = [coluna.desc() for coluna in colunas]
+
+    # Contagem sem ORDER BY nem JOIN da secretaria; página com LIMIT/OFFSET.
+    # (O painel é restrito e ordena por qualquer coluna: o cursor da home só serve para (exercicio, id).)
+    total = query.order_by(None).with_entities(db.func.count(Contratacao.id)).scalar()
+    itens = query.order_by(*colunas).limit(por_pagina).offset((pagina - 1) * por_pagina).all()
+    linhas_servidas.labels('painel').inc(len(itens))
+    return jsonify(
+        itens=[contratacao_para_dict(c) for c in itens],
+        pagina=pagina, por_pagina=por_pagina, total=total,
+        paginas=max(1, -(-total // por_pagina)),
+    )
+
+@app.route('/admin/api/contratacoes/<int:id>')
+def api_contratacao(id):
+    """Um item (para o formulário de edição), respeitando o mesmo RBAC da listagem."""
+    if 'user_id' not in session:
+        return jsonify(erro='Sessão expirada. Faça login novamente.'), 401
+    contratacao = contratacoes_do_usuario(session.get('user_login'), session.get('secretaria_id')).filter(Contratacao.id == id).first()
+    if contratacao is None:
+        # Item de outra secretaria responde igual a inexistente
+        return jsonify(erro='Contratação não encontrada.'), 404
+    return jsonify(contratacao_para_dict(contratacao))
 
 @app.route('/admin/cadastrar/contratacao', methods=['POST'])
 def cadastrar_contratacao():
@@ -424,26 +907,12 @@ def cadastrar_contratacao():
         flash('Erro de Segurança: Você só pode cadastrar itens para a sua própria secretaria.')
         return redirect(url_for('admin_dashboard'))
         
-    # === INÍCIO DA SANITIZAÇÃO DE DADOS (Lei de Postel) ===
-    valor_raw = request.form.get('valor', '0')
-        
-    # 1. Remove 'R$', espaços em branco e deixa tudo limpo
-    valor_clean = valor_raw.upper().replace('R$', '').strip()
-    
-    # 2. Se o usuário digitou no padrão BR com ponto de milhar e vírgula (ex: 1.000,00)
-    if '.' in valor_clean and ',' in valor_clean:
-        valor_clean = valor_clean.replace('.', '').replace(',', '.')
-    # 3. Se digitou no padrão BR só com vírgula (ex: 1000,00)
-    elif ',' in valor_clean:
-        valor_clean = valor_clean.replace(',', '.')
-    # 4. Se digitou padrão Americano (1000.00), deixamos como está, o float() aceita.
-    
+    # Sanitização do valor (Lei de Postel) - mesma regra da importação em lote
     try:
-        valor_final = float(valor_clean)
+        valor_final = sanitizar_valor(request.form.get('valor', '0'))
     except ValueError:
         flash('Erro: O valor estimado inserido tem um formato inválido.')
         return redirect(url_for('admin_dashboard'))
-    # === FIM DA SANITIZAÇÃO ===
 
     try:
         nova_contratacao = Contratacao(
@@ -466,6 +935,109 @@ def cadastrar_contratacao():
         
     return redirect(url_for('admin_dashboard'))
 
+# ============================================================================
+# IMPORTAÇÃO EM LOTE (XLSX / CSV)
+# ============================================================================
+
+MAX_ERROS_EXIBIDOS = 10
+
+@app.route('/admin/importar/contratacoes', methods=['POST'])
+def importar_contratacoes_planilha():
+    if 'user_id' not in session: return redirect(url_for('admin_login'))
+
+    user_login = session.get('user_login')
+    arquivo = request.files.get('planilha')
+    if not arquivo or arquivo.filename == '':
+        flash('Erro: Selecione uma planilha (.xlsx ou .csv) para importar.')
+        return redirect(url_for('admin_dashboard'))
+
+    # RBAC: o admin escolhe a secretaria padrão; o usuário comum só importa para a sua
+    secretaria_padrao = request.form.get('secretaria_id', type=int) if user_login == 'admin' else None
+    somente_secretaria = None if user_login == 'admin' else session.get('secretaria_id')
+
+    try:
+        inseridos, erros = importar_contratacoes(
+            ler_planilha(arquivo.stream, arquivo.filename),
+            secretaria_padrao=secretaria_padrao,
+            somente_secretaria=somente_secretaria,
+            lote=app.config['IMPORTACAO_LOTE'],
+        )
+    except ValueError as e:
+        flash(f'Erro na importação: {e}')
+        return redirect(url_for('admin_dashboard'))
+    except Exception as e:
+        flash('Erro interno ao importar a planilha. Nenhum item foi gravado.')
+        print(f"Erro DB (Importação): {e}")
+        return redirect(url_for('admin_dashboard'))
+
+    flash(f'Importação concluída: {inseridos} item(ns) cadastrado(s), {len(erros)} linha(s) com erro.')
+    for numero_linha, mensagem in erros[:MAX_ERROS_EXIBIDOS]:
+        flash(f'Linha {numero_linha}: {mensagem}')
+    if len(erros) > MAX_ERROS_EXIBIDOS:
+        flash(f'... e mais {len(erros) - MAX_ERROS_EXIBIDOS} linha(s) com erro.')
+    return redirect(url_for('admin_dashboard'))
+
+@app.cli.command('importar-contratacoes')
+@click.argument('caminho', type=click.Path(exists=True, dir_okay=False))
+@click.option('--secretaria', 'secretaria_id', type=int, default=None, help='Secretaria usada nas linhas que não informam uma.')
+@click.option('--lote', type=int, default=None, help='Linhas por INSERT em lote.')
+def importar_contratacoes_cli(caminho, secretaria_id, lote):
+    """Importa um PCA inteiro de uma planilha .xlsx ou .csv."""
+    with open(caminho, 'rb') as arquivo:
+        try:
+            inseridos, erros = importar_contratacoes(
+                ler_planilha(arquivo, caminho),
+                secretaria_padrao=secretaria_id,
+                lote=lote or app.config['IMPORTACAO_LOTE'],
+            )
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    for numero_linha, mensagem in erros:
+        click.echo(f'Linha {numero_linha}: {mensagem}', err=True)
+    click.echo(f'{inseridos} item(ns) importado(s), {len(erros)} linha(s) com erro.')
+
+@app.cli.command('enviar-emails')
+def enviar_emails_cli():
+    """Envia agora as mensagens vencidas da caixa de saída (para uso sem o thread de fundo, ex: cron)."""
+    enviados, falhas = esvaziar_fila(enviador_email.transporte)
+    enviador_email.transporte.fechar()
+    click.echo(f'{enviados} e-mail(s) enviado(s), {falhas} com falha (nova tentativa agendada).')
+
+@app.cli.command('reconstruir-resumo')
+def reconstruir_resumo_cli():
+    """Refaz do zero a tabela agregada do /resumo a partir das contratações (agregação com pandas)."""
+    with db.engine.begin() as conexao:
+        grupos = reconstruir_resumo(conexao)
+        incrementar_versao_dados(conexao) # Caches HTTP do /resumo deixam de valer
+    click.echo(f'Resumo reconstruído: {grupos} grupo(s) (secretaria, exercício, mês).')
+
+@app.cli.command('migrar')
+@click.option('--status', is_flag=True, help='Só mostra a versão do esquema e as migrações pendentes.')
+def migrar_cli(status):
+    """Aplica as migrações de esquema pendentes (índices etc.) na base configurada."""
+    if status:
+        with db.engine.connect() as conexao:
+            atual = versao_schema(conexao)
+            conexao.commit()
+        click.echo(f'Versão do esquema: {atual}')
+        for versao, descricao, _ in MIGRACOES:
+            click.echo(f"  [{'x' if versao <= atual else ' '}] {versao:03d} {descricao}")
+        return
+    try:
+        aplicadas = aplicar_migracoes()
+    except MigracaoEmAndamento as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Migrações aplicadas: {', '.join(map(str, aplicadas))}" if aplicadas else 'Esquema já está atualizado.')
+
+@app.cli.command('construir-estaticos')
+def construir_estaticos_cli():
+    """Gera os CSS/JS usados pelos templates com hash no nome e variantes .gz/.br (estaticos.py)."""
+    destino = app.config['ESTATICOS_DIR']
+    manifesto = construir_estaticos(app.static_folder, os.path.join(app.root_path, app.template_folder), destino)
+    estaticos.carregar(destino)
+    for original, versionado in manifesto.items():
+        click.echo(f'{original} -> {versionado}')
+
 # ============================================================================
 # EDITAR E EXCLUIR CONTRATAÇÕES
 # ============================================================================
@@ -483,14 +1055,9 @@ def editar_contratacao(id):
         flash('Erro: Acesso Negado. Você não pode alterar itens de outra secretaria.')
         return redirect(url_for('admin_dashboard'))
 
-    # Sanitização do Valor (Lei de Postel - idêntica ao cadastro)
-    valor_raw = request.form.get('valor', '0')
-    valor_clean = valor_raw.upper().replace('R$', '').strip()
-    if '.' in valor_clean and ',' in valor_clean: valor_clean = valor_clean.replace('.', '').replace(',', '.')
-    elif ',' in valor_clean: valor_clean = valor_clean.replace(',', '.')
-
     try:
-        valor_final = float(valor_clean)
+        # Sanitização do Valor (Lei de Postel - idêntica ao cadastro)
+        valor_final = sanitizar_valor(request.form.get('valor', '0'))
         
         # Atualiza os dados no banco
         contratacao.exercicio = int(request.form.get('exercicio'))
@@ -700,13 +1267,16 @@ def configuracoes_ente():
         ente.telefone = request.form.get('telefone')
         ente.email = request.form.get('email')
 
-        # Tratamento do Upload da Imagem
+        # Tratamento do Upload da Imagem: variantes (cabeçalho, Excel, PDF) geradas agora, não a cada uso
         logo = request.files.get('logo')
         if logo and logo.filename != '':
-            filename = secure_filename(logo.filename)
-            caminho_salvar = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            logo.save(caminho_salvar)
-            ente.logo_path = f"img/{filename}" # Salva o caminho relativo no banco
+            try:
+                nome_arquivo = salvar_logo(logo.stream, app.config['UPLOAD_FOLDER'])
+            except ValueError as e:
+                db.session.rollback()
+                flash(f'Erro: {e}')
+                return redirect(url_for('configuracoes_ente'))
+            ente.logo_path = f"img/{nome_arquivo}" # Caminho relativo da variante de cabeçalho
 
         db.session.commit()
         flash('Configurações do Órgão atualizadas com sucesso!')
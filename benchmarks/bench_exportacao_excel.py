@@ -0,0 +1,147 @@
+"""
+Benchmark da exportação Excel: modo streaming (write-only) x implementação original (em memória).
+
+Cada medição roda num processo Python separado, para que o pico de memória (RSS)
+de um modo não contamine o outro, e gera a planilha de verdade: sem o cache em
+disco das exportações, que serviria o segundo modo com o arquivo do primeiro.
+A base SQLite de cada tamanho é gerada uma única vez na pasta temporária e
+reaproveitada nas execuções seguintes.
+
+Uso:
+    python benchmarks/bench_exportacao_excel.py                      # 10k, 100k e 500k linhas
+    python benchmarks/bench_exportacao_excel.py --linhas 10000 50000 --json resultado.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+from datetime import date
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODOS = ('memoria', 'streaming')
+
+
+def caminho_banco(linhas):
+    return os.path.join(tempfile.gettempdir(), f'pca_bench_excel_{linhas}.db')
+
+
+def pico_rss_mb():
+    # No Linux o ru_maxrss vem em KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def preparar_banco(linhas, secretarias=20):
+    """Executado no processo filho: popula um SQLite com 'linhas' contratações entre secretarias e exercícios."""
+    banco = caminho_banco(linhas)
+    provisorio = banco + '.tmp'
+    if os.path.exists(provisorio):
+        os.remove(provisorio)
+
+    os.environ['PCA_DATABASE_URL'] = f'sqlite:///{provisorio}'
+    sys.path.insert(0, RAIZ)
+    from app import app, db, Secretaria, Contratacao
+
+    rnd = random.Random(42)
+    with app.app_context():
+        db.create_all()
+        for i in range(secretarias):
+            db.session.add(Secretaria(nome=f'Secretaria Benchmark {i + 1:02d}'))
+        db.session.commit()
+        ids_sec = [s.id for s in Secretaria.query.all()]
+
+        tabela = Contratacao.__table__
+        lote = []
+        for id_ in range(1, linhas + 1):
+            exercicio = rnd.choice((2024, 2025, 2026))
+            sec = rnd.choice(ids_sec)
+            lote.append(dict(
+                id=id_, exercicio=exercicio, secretaria_id=sec,
+                objeto=f'Aquisição de material de consumo lote {id_} ' + 'x' * rnd.randint(20, 120),
+                descricao='Descrição detalhada ' * rnd.randint(1, 10),
+                valor_estimado=round(rnd.uniform(100, 2_000_000), 2),
+                dotacao=f'02.{sec:02d}.04.122.0001.2.{rnd.randint(1, 999):03d}',
+                data_planejada=date(exercicio, rnd.randint(1, 12), rnd.randint(1, 28)),
+                codigo_identificador=f'PCA-{id_}.{exercicio}-{sec}',
+            ))
+            if len(lote) == 10_000:
+                db.session.execute(tabela.insert(), lote)
+                lote = []
+        if lote:
+            db.session.execute(tabela.insert(), lote)
+        db.session.commit()
+    # Só publica o arquivo depois de completo: uma execução interrompida não deixa base pela metade
+    os.replace(provisorio, banco)
+    return banco
+
+
+def medir(modo, banco):
+    """Executado no processo filho: faz a exportação completa e devolve tempo, bytes e memória."""
+    os.environ['PCA_DATABASE_URL'] = f'sqlite:///{banco}'
+    os.environ['PCA_BOOTSTRAP_AUTOMATICO'] = 'False'
+    # Pasta de cache própria desta medição: o modo medido depois não pode acertar o arquivo do anterior
+    os.environ['PCA_CACHE_EXPORTACAO_DIR'] = tempfile.mkdtemp(prefix='pca_bench_cache_')
+    sys.path.insert(0, RAIZ)
+    from app import app
+
+    app.config['EXCEL_STREAMING'] = (modo == 'streaming')
+    app.config['CACHE_EXPORTACAO'] = False
+    client = app.test_client()
+    rss_inicial = pico_rss_mb()
+
+    inicio = time.perf_counter()
+    resposta = client.get('/exportar/excel')
+    tamanho = sum(len(parte) for parte in resposta.response)
+    segundos = time.perf_counter() - inicio
+
+    assert resposta.status_code == 200, resposta.status
+    return dict(modo=modo, segundos=round(segundos, 3), bytes=tamanho,
+                pico_rss_mb=round(pico_rss_mb(), 1), crescimento_rss_mb=round(pico_rss_mb() - rss_inicial, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--linhas', type=int, nargs='+', default=[10_000, 100_000, 500_000])
+    parser.add_argument('--modos', nargs='+', choices=MODOS, default=list(MODOS))
+    parser.add_argument('--json', help='Arquivo onde salvar os resultados')
+    parser.add_argument('--preparar', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--medir', choices=MODOS, help=argparse.SUPPRESS)
+    parser.add_argument('--banco', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # O app.py escolhe o banco na importação, então cada base/medição roda num processo novo
+    if args.preparar:
+        preparar_banco(args.preparar)
+        return
+    if args.medir:
+        print(json.dumps(medir(args.medir, args.banco)))
+        return
+
+    resultados = []
+    print(f"{'linhas':>8}  {'modo':<10} {'tempo (s)':>10} {'arquivo (MB)':>13} {'pico RSS (MB)':>14} {'+RSS (MB)':>10}")
+    for linhas in args.linhas:
+        banco = caminho_banco(linhas)
+        if not os.path.exists(banco):
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--preparar', str(linhas)],
+                           check=True, capture_output=True, cwd=RAIZ)
+        for modo in args.modos:
+            saida = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--medir', modo, '--banco', banco],
+                check=True, capture_output=True, text=True, cwd=RAIZ,
+            ).stdout.strip().splitlines()[-1]
+            resultado = dict(json.loads(saida), linhas=linhas)
+            resultados.append(resultado)
+            print(f"{linhas:>8}  {modo:<10} {resultado['segundos']:>10.2f} {resultado['bytes'] / 1e6:>13.1f} "
+                  f"{resultado['pico_rss_mb']:>14.1f} {resultado['crescimento_rss_mb']:>10.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+Teste de carga local: sobe o app no Gunicorn (mesmo gunicorn.conf.py da
+produção) sobre uma base gerada por dados_benchmark.py, ou usa um servidor já
+rodando (--url), e dispara requisições concorrentes por um tempo fixo com uma
+mistura ponderada de rotas públicas. Relata vazão, p50/p95/p99 (geral e por
+rota), erros e o pico de memória (RSS) do servidor somando master e workers.
+
+A sequência de rotas de cada cliente vem de uma semente: duas execuções com os
+mesmos parâmetros pedem exatamente as mesmas URLs.
+
+Uso:
+    python benchmarks/carga.py --contratacoes 50000 --workers 3 --clientes 16 --duracao 30 --json carga.json
+    python benchmarks/carga.py --url http://127.0.0.1:5000 --clientes 8 --comparar carga.json
+"""
+import os
+import sys
+import time
+import random
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit
+
+from comum import RAIZ, estatisticas, metadados, salvar, comparar, banco_descrito
+import dados_benchmark
+
+# rota: (url, peso). Mistura típica do portal: quase tudo é a listagem pública
+MISTURA = {
+    'home': ('/', 40),
+    'home_exercicio': ('/?exercicio=2025', 20),
+    'home_secretaria': ('/?secretaria=2&exercicio=2026', 10),
+    'home_busca': ('/?busca=merenda', 10),
+    'resumo': ('/resumo', 10),
+    'exportar_csv': ('/exportar/csv?exercicio=2026&secretaria=3', 5),
+    'exportar_excel': ('/exportar/excel?exercicio=2026&secretaria=3', 3),
+    'exportar_pdf': ('/exportar/pdf?exercicio=2026&secretaria=3', 2),
+}
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def rss_arvore_mb(pid):
+    """RSS somado do processo e dos filhos diretos (master + workers do Gunicorn), lido do /proc."""
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            pids += [int(p) for p in f.read().split()]
+    except OSError:
+        pass
+    total_kb = 0
+    for p in pids:
+        try:
+            with open(f'/proc/{p}/status') as f:
+                total_kb += next(int(l.split()[1]) for l in f if l.startswith('VmRSS:'))
+        except (OSError, StopIteration):
+            pass
+    return total_kb / 1024
+
+
+def subir_servidor(banco, workers, porta):
+    ambiente = dict(os.environ, PCA_DATABASE_URL=banco, PCA_GUNICORN_WORKERS=str(workers),
+                    PCA_GUNICORN_BIND=f'127.0.0.1:{porta}', PCA_BOOTSTRAP_AUTOMATICO='False',
+                    PCA_EMAIL_ENVIO_AUTOMATICO='False')
+    processo = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                                cwd=RAIZ, env=ambiente, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    limite = time.monotonic() + 60
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError('O Gunicorn não subiu (rode-o manualmente para ver o erro).')
+        try:
+            conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=5)
+            conexao.request('GET', '/resumo')
+            conexao.getresponse().read()
+            return processo
+        except OSError:
+            time.sleep(.2)
+    processo.terminate()
+    raise RuntimeError('O Gunicorn não respondeu em 60s.')
+
+
+class Cliente(threading.Thread):
+    """Um usuário: conexão keep-alive própria, rotas sorteadas pela própria semente."""
+
+    def __init__(self, url, semente, fim):
+        super().__init__(daemon=True)
+        partes = urlsplit(url)
+        self.host, self.porta = partes.hostname, partes.port or 80
+        self.rnd = random.Random(semente)
+        self.fim = fim
+        self.amostras = []  # (rota, segundos, status)
+        self.erros = 0
+
+    def run(self):
+        rotas = list(MISTURA)
+        pesos = [MISTURA[r][1] for r in rotas]
+        conexao = http.client.HTTPConnection(self.host, self.porta, timeout=60)
+        while time.monotonic() < self.fim:
+            rota = self.rnd.choices(rotas, pesos)[0]
+            inicio = time.perf_counter()
+            try:
+                conexao.request('GET', MISTURA[rota][0], headers={'Accept-Encoding': 'identity'})
+                resposta = conexao.getresponse()
+                resposta.read()
+                self.amostras.append((rota, time.perf_counter() - inicio, resposta.status))
+            except (OSError, http.client.HTTPException):
+                self.erros += 1
+                conexao.close()
+                conexao = http.client.HTTPConnection(self.host, self.porta, timeout=60)
+        conexao.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Servidor já rodando (não sobe o Gunicorn nem gera a base)')
+    parser.add_argument('--banco', help='URL do SQLAlchemy (padrão: SQLite gerado na pasta temporária)')
+    parser.add_argument('--secretarias', type=int, default=20)
+    parser.add_argument('--usuarios', type=int, default=50)
+    parser.add_argument('--contratacoes', type=int, default=10_000)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=3, help='Workers do Gunicorn')
+    parser.add_argument('--clientes', type=int, default=8, help='Requisições simultâneas')
+    parser.add_argument('--duracao', type=float, default=20, help='Segundos de carga (após o aquecimento)')
+    parser.add_argument('--aquecimento', type=float, default=3)
+    parser.add_argument('--json', help='Arquivo onde salvar os resultados')
+    parser.add_argument('--comparar', help='JSON de uma execução anterior: aponta regressões no p95')
+    args = parser.parse_args()
+
+    servidor, banco = None, None
+    url = args.url
+    if not url:
+        exercicios = (2024, 2025, 2026)
+        banco = args.banco or 'sqlite:///' + dados_benchmark.caminho_sqlite(
+            args.secretarias, args.usuarios, args.contratacoes, exercicios, args.semente)
+        # A base é gerada num processo à parte (o app.py escolhe o banco na importação)
+        subprocess.run([sys.executable, os.path.join(RAIZ, 'benchmarks', 'dados_benchmark.py'), '--banco', banco,
+                        '--secretarias', str(args.secretarias), '--usuarios', str(args.usuarios),
+                        '--contratacoes', str(args.contratacoes), '--semente', str(args.semente)],
+                       check=True, stdout=subprocess.DEVNULL)
+        porta = porta_livre()
+        servidor = subir_servidor(banco, args.workers, porta)
+        url = f'http://127.0.0.1:{porta}'
+
+    try:
+        if args.aquecimento:
+            fim = time.monotonic() + args.aquecimento
+            aquecimento = [Cliente(url, -i, fim) for i in range(1, args.clientes + 1)]
+            for cliente in aquecimento:
+                cliente.start()
+            for cliente in aquecimento:
+                cliente.join()
+
+        pico_rss = [0.0]
+        parar = threading.Event()
+        def amostrar_rss():
+            while not parar.wait(.25):
+                pico_rss[0] = max(pico_rss[0], rss_arvore_mb(servidor.pid))
+        if servidor:
+            threading.Thread(target=amostrar_rss, daemon=True).start()
+
+        inicio = time.monotonic()
+        clientes = [Cliente(url, args.semente * 1000 + i, inicio + args.duracao) for i in range(args.clientes)]
+        for cliente in clientes:
+            cliente.start()
+        for cliente in clientes:
+            cliente.join()
+        decorrido = time.monotonic() - inicio
+        parar.set()
+    finally:
+        if servidor:
+            servidor.terminate()
+            servidor.wait(timeout=30)
+
+    amostras = [a for c in clientes for a in c.amostras]
+    erros = sum(c.erros for c in clientes) + sum(1 for _, _, status in amostras if status >= 500)
+    geral = dict(nome='geral', requisicoes=len(amostras), erros=erros,
+                 vazao_rps=round(len(amostras) / decorrido, 1), **estatisticas([s for _, s, _ in amostras]))
+    por_rota = [dict(nome=rota, requisicoes=len(duracoes), **estatisticas(duracoes))
+                for rota in MISTURA for duracoes in [[s for r, s, _ in amostras if r == rota]] if duracoes]
+    resultados = [geral] + por_rota
+
+    print(f"{'rota':<16} {'req':>6} {'p50 (ms)':>10} {'p95 (ms)':>10} {'p99 (ms)':>10}")
+    for r in resultados:
+        print(f"{r['nome']:<16} {r['requisicoes']:>6} {r['p50_ms']:>10.1f} {r['p95_ms']:>10.1f} {r['p99_ms']:>10.1f}")
+    print(f"\nVazão: {geral['vazao_rps']} req/s em {decorrido:.1f}s com {args.clientes} clientes, {erros} erro(s)")
+    if servidor:
+        print(f"Pico de RSS do servidor (master + {args.workers} workers): {pico_rss[0]:.1f} MB")
+
+    saida = dict(metadados=metadados(url=args.url, banco=banco_descrito(banco) if banco else None,
+                                     workers=None if args.url else args.workers, clientes=args.clientes,
+                                     duracao=args.duracao, contratacoes=None if args.url else args.contratacoes,
+                                     semente=args.semente),
+                 pico_rss_servidor_mb=round(pico_rss[0], 1) if servidor else None,
+                 resultados=resultados)
+    if args.json:
+        salvar(args.json, saida)
+    if args.comparar and comparar(resultados, args.comparar):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
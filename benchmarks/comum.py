@@ -0,0 +1,99 @@
+"""
+Funções compartilhadas pelos benchmarks: percentis, metadados da execução e
+gravação/comparação dos resultados em JSON (para acompanhar regressões entre
+execuções: rode de novo com --comparar resultado_anterior.json).
+"""
+import os
+import sys
+import json
+import platform
+import resource
+import subprocess
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentil(ordenados, fracao):
+    """Percentil por interpolação linear (mesmo critério do numpy.percentile)."""
+    if not ordenados:
+        return 0.0
+    posicao = (len(ordenados) - 1) * fracao
+    abaixo = int(posicao)
+    acima = min(abaixo + 1, len(ordenados) - 1)
+    return ordenados[abaixo] + (ordenados[acima] - ordenados[abaixo]) * (posicao - abaixo)
+
+
+def estatisticas(segundos):
+    """Resumo de uma lista de durações (s) em milissegundos."""
+    ordenados = sorted(segundos)
+    ms = lambda valor: round(valor * 1000, 2)
+    return dict(
+        amostras=len(ordenados),
+        media_ms=ms(sum(ordenados) / len(ordenados)) if ordenados else 0.0,
+        min_ms=ms(ordenados[0]) if ordenados else 0.0,
+        p50_ms=ms(percentil(ordenados, .50)),
+        p95_ms=ms(percentil(ordenados, .95)),
+        p99_ms=ms(percentil(ordenados, .99)),
+        max_ms=ms(ordenados[-1]) if ordenados else 0.0,
+    )
+
+
+def pico_rss_mb():
+    # No Linux o ru_maxrss vem em KB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def banco_descrito(url):
+    """URL do banco sem a senha (vai para o JSON de resultados)."""
+    if '@' in url and '://' in url:
+        esquema, resto = url.split('://', 1)
+        credenciais, endereco = resto.rsplit('@', 1)
+        return f"{esquema}://{credenciais.split(':', 1)[0]}:***@{endereco}"
+    return url
+
+
+def metadados(**extras):
+    """Contexto da execução: versão do código, Python, máquina e parâmetros informados."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(data=datetime.now().isoformat(timespec='seconds'), commit=commit,
+                python=platform.python_version(), plataforma=platform.platform(),
+                cpus=os.cpu_count(), **extras)
+
+
+def salvar(caminho, dados):
+    with open(caminho, 'w', encoding='utf-8') as f:
+        json.dump(dados, f, indent=2, ensure_ascii=False)
+
+
+def comparar(atuais, caminho_anterior, chave='nome', metrica='p95_ms', tolerancia=0.10):
+    """
+    Imprime a variação de 'metrica' entre esta execução e uma anterior (mesmo
+    'chave'). Devolve True se alguma piorou mais que 'tolerancia' (10%).
+    """
+    with open(caminho_anterior, encoding='utf-8') as f:
+        anteriores = {r[chave]: r for r in json.load(f)['resultados']}
+    piorou = False
+    print(f"\nComparação com {caminho_anterior} ({metrica}):")
+    for resultado in atuais:
+        anterior = anteriores.get(resultado[chave])
+        if not anterior or not anterior.get(metrica):
+            print(f"  {resultado[chave]:<32} (sem medição anterior)")
+            continue
+        variacao = resultado[metrica] / anterior[metrica] - 1
+        alerta = ''
+        if variacao > tolerancia:
+            piorou, alerta = True, '  <-- REGRESSÃO'
+        print(f"  {resultado[chave]:<32} {anterior[metrica]:>10.2f} -> {resultado[metrica]:>10.2f} ({variacao:+.0%}){alerta}")
+    return piorou
+
+
+def preparar_caminho():
+    """Permite 'from app import ...' e 'import dados_benchmark' rodando de qualquer pasta."""
+    for pasta in (RAIZ, os.path.dirname(os.path.abspath(__file__))):
+        if pasta not in sys.path:
+            sys.path.insert(0, pasta)
@@ -0,0 +1,252 @@
+import re
+import bisect
+import threading
+import unicodedata
+from datetime import datetime, timedelta
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.orm import Session, object_session
+from models import db, Contratacao
+from cache_global import cache_global
+
+# ============================================================================
+# BUSCA INDEXADA (CÓDIGO, OBJETO E DESCRIÇÃO)
+# ============================================================================
+# O filtro antigo fazia LIKE '%...%' no código, o que obriga o banco a ler a
+# tabela inteira a cada pesquisa. Aqui:
+#   - Código: o formato PCA-<id>.<ano>-<sec> permite igualdade exata ou faixa
+#     de prefixo (>= 'PCA-12' AND < 'PCA-13'), que usa o índice único da coluna.
+#   - Texto (objeto/descrição): no MySQL, índice FULLTEXT com MATCH ... AGAINST.
+#     Nos demais bancos (SQLite dos testes e instalações pequenas), um índice
+#     invertido em memória por processo: token -> lista ordenada de ids.
+# Todas as palavras digitadas precisam aparecer (E); a última vale como prefixo,
+# para "compu" já achar "computador".
+
+NOME_INDICE_FULLTEXT = 'ix_contratacoes_busca_texto'
+TAMANHO_MINIMO_TOKEN = 2
+MARGEM_RECARGA = timedelta(seconds=60)  # Folga para relógios de workers/servidores diferentes
+INTERVALO_REMONTAGEM = timedelta(hours=1)  # Descarta do índice em memória o que outro processo excluiu
+
+# O InnoDB não indexa palavras menores que innodb_ft_min_token_size (3) nem as da
+# lista INNODB_FT_DEFAULT_STOPWORD; num MATCH em modo booleano, '+de' ou '+ti'
+# viram termos obrigatórios que nunca casam e a busca volta vazia. Esses tokens
+# ficam fora do MATCH. Se o servidor usar outros valores, ajustar aqui.
+FULLTEXT_TAMANHO_MINIMO = 3
+FULLTEXT_STOPWORDS = frozenset('''
+    a about an are as at be by com de en for from how i in is it la of on or
+    that the this to was what when where who will with und www
+'''.split())
+
+# Criado pelo create_all (e pelas migrações) só no MySQL; o SQLite ignora
+db.Index(NOME_INDICE_FULLTEXT, Contratacao.objeto, Contratacao.descricao,
+         mysql_prefix='FULLTEXT').ddl_if(dialect='mysql')
+
+def tokenizar(texto):
+    """Palavras em minúsculas e sem acento ("Licitação" e "licitacao" são o mesmo token)."""
+    if not texto:
+        return []
+    texto = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii').lower()
+    return [t for t in re.findall(r'\w+', texto) if len(t) >= TAMANHO_MINIMO_TOKEN]
+
+# ----------------------------------------------------------------------------
+# CÓDIGO IDENTIFICADOR
+# ----------------------------------------------------------------------------
+CODIGO_COMPLETO = re.compile(r'^PCA-\d+\.\d+-\d+$')
+
+def filtro_codigo(codigo):
+    """
+    Condição indexável para o código digitado: "PCA-12.2026-3" é igualdade;
+    "PCA-12", "pca-12." ou só "12" viram faixa de prefixo em 'PCA-12'.
+    """
+    codigo = codigo.strip().upper().replace(' ', '')
+    if not codigo.startswith('PCA-'):
+        codigo = 'PCA-' + codigo.lstrip('-')
+    coluna = Contratacao.codigo_identificador
+    if CODIGO_COMPLETO.match(codigo):
+        return coluna == codigo
+    # Próximo valor possível depois de todos os que começam com o prefixo
+    limite = codigo[:-1] + chr(ord(codigo[-1]) + 1)
+    return db.and_(coluna >= codigo, coluna < limite)
+
+# ----------------------------------------------------------------------------
+# ÍNDICE INVERTIDO EM MEMÓRIA (bancos sem FULLTEXT)
+# ----------------------------------------------------------------------------
+class IndiceInvertido:
+    """
+    Montado na primeira busca do processo e mantido depois de duas formas:
+      - alterações feitas por este processo entram na hora (eventos da sessão,
+        aplicados no commit);
+      - alterações de outros workers ou de INSERTs em massa são percebidas pela
+        versão dos dados (cache_global) e recarregadas só as linhas com
+        data_atualizacao recente.
+    A busca em si custa uma consulta por token no dicionário e a interseção das
+    listas: cresce com o número de resultados, não com o tamanho da tabela.
+    Já a manutenção não é de graça: cada mudança de versão custa uma consulta
+    às linhas alteradas, e a cada INTERVALO_REMONTAGEM o índice é relido
+    inteiro (O(tabela)) para esquecer as exclusões feitas por outros processos.
+    Até lá, esses ids só sobram na lista: a consulta final (id IN ...) os
+    descarta. As leituras do banco acontecem fora do lock das buscas, que
+    seguem respondendo com o índice anterior enquanto o novo é montado.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()        # Estruturas abaixo (buscas e aplicações rápidas)
+        self._lock_carga = threading.Lock()  # Uma carga do banco por vez
+        self._ids_por_token = {}     # token -> [ids em ordem crescente]
+        self._vocabulario = []       # tokens em ordem alfabética (busca por prefixo)
+        self._tokens_por_id = {}     # id -> tokens indexados (para remover na atualização)
+        self._versao = None
+        self._carregado_em = None
+        self._montado_em = None
+
+    def descartar(self):
+        with self._lock:
+            self._ids_por_token, self._vocabulario, self._tokens_por_id = {}, [], {}
+            self._versao = self._carregado_em = self._montado_em = None
+
+    def _remover(self, id_contratacao):
+        for token in self._tokens_por_id.pop(id_contratacao, ()):
+            ids = self._ids_por_token[token]
+            posicao = bisect.bisect_left(ids, id_contratacao)
+            if posicao < len(ids) and ids[posicao] == id_contratacao:
+                del ids[posicao]
+            if not ids:
+                del self._ids_por_token[token]
+                del self._vocabulario[bisect.bisect_left(self._vocabulario, token)]
+
+    def _indexar(self, id_contratacao, objeto, descricao):
+        self._remover(id_contratacao)
+        tokens = frozenset(tokenizar(objeto) + tokenizar(descricao))
+        for token in tokens:
+            ids = self._ids_por_token.get(token)
+            if ids is None:
+                ids = self._ids_por_token[token] = []
+                bisect.insort(self._vocabulario, token)
+            bisect.insort(ids, id_contratacao)
+        self._tokens_por_id[id_contratacao] = tokens
+
+    def aplicar(self, alteracoes):
+        """Aplica {id: (objeto, descricao) ou None se excluído} vindas dos eventos da sessão."""
+        with self._lock:
+            if self._versao is None:
+                return  # Ainda não montado: a primeira busca lê tudo do banco
+            for id_contratacao, valores in alteracoes.items():
+                if valores is None:
+                    self._remover(id_contratacao)
+                else:
+                    self._indexar(id_contratacao, *valores)
+
+    def sincronizar(self):
+        """Confere a versão dos dados e recarrega o que mudou desde a última carga."""
+        versao = cache_global.versao_atual()
+        if versao == self._versao:
+            return
+        with self._lock_carga:
+            if versao == self._versao:
+                return
+            inicio = datetime.now()
+            colunas = db.session.query(Contratacao.id, Contratacao.objeto, Contratacao.descricao)
+            if self._versao is None or inicio - self._montado_em >= INTERVALO_REMONTAGEM:
+                # Monta um índice novo ao lado e só troca as referências sob o lock
+                novo = IndiceInvertido()
+                for linha in colunas.yield_per(1000):
+                    novo._indexar(linha.id, linha.objeto, linha.descricao)
+                with self._lock:
+                    self._ids_por_token, self._vocabulario, self._tokens_por_id = (
+                        novo._ids_por_token, novo._vocabulario, novo._tokens_por_id)
+                self._montado_em = inicio
+            else:
+                alteradas = colunas.filter(Contratacao.data_atualizacao >= self._carregado_em - MARGEM_RECARGA).all()
+                with self._lock:
+                    for linha in alteradas:
+                        self._indexar(linha.id, linha.objeto, linha.descricao)
+            self._versao, self._carregado_em = versao, inicio
+
+    def buscar(self, texto):
+        """Ids (ordenados) que contêm todas as palavras; a última vale como prefixo."""
+        tokens = tokenizar(texto)
+        if not tokens:
+            return None
+        self.sincronizar()
+        with self._lock:
+            listas = [self._ids_por_token.get(t, []) for t in tokens[:-1]]
+            prefixo = tokens[-1]
+            inicio = bisect.bisect_left(self._vocabulario, prefixo)
+            fim = bisect.bisect_left(self._vocabulario, prefixo + '\uffff')
+            por_prefixo = set()
+            for token in self._vocabulario[inicio:fim]:
+                por_prefixo.update(self._ids_por_token[token])
+            # Começa pela menor lista: a interseção nunca é maior que ela
+            resultado = por_prefixo
+            for ids in sorted(listas, key=len):
+                if not resultado:
+                    break
+                resultado = resultado.intersection(ids)
+            return sorted(resultado)
+
+indice_busca = IndiceInvertido()
+
+@event.listens_for(Contratacao, 'after_insert')
+@event.listens_for(Contratacao, 'after_update')
+def registrar_alteracao_busca(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('pca_busca', {})[target.id] = (target.objeto, target.descricao)
+
+@event.listens_for(Contratacao, 'after_delete')
+def registrar_exclusao_busca(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('pca_busca', {})[target.id] = None
+
+@event.listens_for(Session, 'after_commit')
+def aplicar_alteracoes_busca(session):
+    alteracoes = session.info.pop('pca_busca', None)
+    if alteracoes:
+        indice_busca.aplicar(alteracoes)
+
+@event.listens_for(Session, 'after_rollback')
+def descartar_alteracoes_busca(session):
+    session.info.pop('pca_busca', None)
+
+# ----------------------------------------------------------------------------
+# FILTRO DE TEXTO
+# ----------------------------------------------------------------------------
+_fulltext_por_processo = {}
+
+def usa_fulltext():
+    """MySQL com o índice FULLTEXT já criado (conferido uma vez por processo)."""
+    engine = db.engine
+    if engine.dialect.name != 'mysql':
+        return False
+    if engine.url not in _fulltext_por_processo:
+        indices = inspect(engine).get_indexes(Contratacao.__tablename__)
+        _fulltext_por_processo[engine.url] = any(i['name'] == NOME_INDICE_FULLTEXT for i in indices)
+    return _fulltext_por_processo[engine.url]
+
+def termos_fulltext(tokens):
+    """
+    Expressão do MATCH em modo booleano: todas as palavras obrigatórias (+), a
+    última como prefixo (*). Sem as que o InnoDB não indexa (ou None se não sobrar nenhuma).
+    """
+    validos = [t for t in tokens if len(t) >= FULLTEXT_TAMANHO_MINIMO and t not in FULLTEXT_STOPWORDS]
+    if not validos:
+        return None
+    sufixo = '*' if validos[-1] == tokens[-1] else ''
+    return ' '.join(f'+{t}' for t in validos) + sufixo
+
+def filtro_texto(texto):
+    """Condição para 'busca' em objeto/descrição, ou None se não houver palavras válidas."""
+    tokens = tokenizar(texto)
+    if not tokens:
+        return None
+    if usa_fulltext():
+        termos = termos_fulltext(tokens)
+        if termos is None:
+            return None  # Só palavras que o FULLTEXT não indexa ("de", "ti"): nada a filtrar
+        return match(Contratacao.objeto, Contratacao.descricao, against=termos).in_boolean_mode()
+    ids = indice_busca.buscar(texto)
+    if not ids:
+        return db.false()
+    # literal_execute: a lista vai no SQL, sem estourar o limite de parâmetros do SQLite
+    return Contratacao.id.in_(db.bindparam('ids_busca', ids, expanding=True, literal_execute=True))
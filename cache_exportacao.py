@@ -0,0 +1,107 @@
+import os
+import time
+import hashlib
+import tempfile
+
+# ============================================================================
+# CACHE EM DISCO DAS EXPORTAÇÕES (ENDEREÇADO POR CONTEÚDO)
+# ============================================================================
+# A mesma planilha ("Todas" as secretarias, exercício atual) é pedida centenas
+# de vezes entre uma edição e outra. A chave do arquivo é o hash de:
+#   tipo da exportação + filtros normalizados + carimbo de versão dos dados.
+# Qualquer escrita em Contratacao/Ente/Secretaria muda o carimbo, então uma
+# chave nunca aponta para conteúdo velho e não existe "invalidação" a fazer:
+# arquivos de versões antigas simplesmente deixam de ser pedidos e saem pelo LRU.
+#
+# Um acerto custa um open() + sendfile, em vez de montar a planilha inteira.
+# A pasta pode ser compartilhada pelos workers do Gunicorn (gravação atômica).
+
+class CacheExportacao:
+    def __init__(self, pasta, limite_bytes):
+        self.pasta = pasta
+        self.limite_bytes = limite_bytes
+
+    @staticmethod
+    def chave(tipo, filtros, versao):
+        """Hash SHA-256 que identifica unicamente o conteúdo de uma exportação."""
+        return hashlib.sha256(repr((tipo, tuple(filtros), versao)).encode('utf-8')).hexdigest()
+
+    def _caminho(self, chave, extensao):
+        return os.path.join(self.pasta, f"{chave}.{extensao}")
+
+    def abrir(self, chave, extensao):
+        """
+        Devolve o arquivo já aberto (ou None se não estiver em cache). Abrir aqui,
+        e não só checar se existe, evita corrida com a poda de outro worker: no
+        Linux, um arquivo apagado continua legível por quem já o abriu.
+        """
+        caminho = self._caminho(chave, extensao)
+        try:
+            arquivo = open(caminho, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(caminho)  # Marca como usado recentemente (LRU pelo mtime)
+        except OSError:
+            pass
+        return arquivo
+
+    def contem(self, chave, extensao):
+        """Só confere se o arquivo existe (sem abrir): usado para decidir entre o download direto e a fila."""
+        return os.path.isfile(self._caminho(chave, extensao))
+
+    def gravar(self, chave, extensao, gerar):
+        """
+        Gera o arquivo chamando gerar(arquivo_binario) e publica com os.replace
+        (atômico): nenhum worker enxerga um arquivo pela metade. Devolve-o aberto.
+        """
+        os.makedirs(self.pasta, exist_ok=True)
+        fd, provisorio = tempfile.mkstemp(dir=self.pasta, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as arquivo:
+                gerar(arquivo)
+            os.replace(provisorio, self._caminho(chave, extensao))
+        except BaseException:
+            if os.path.exists(provisorio):
+                os.remove(provisorio)
+            raise
+        arquivo = open(self._caminho(chave, extensao), 'rb')
+        self.podar()
+        return arquivo
+
+    def podar(self):
+        """Remove os arquivos usados há mais tempo até o total caber no limite (LRU por tamanho)."""
+        entradas = []
+        total = 0
+        try:
+            with os.scandir(self.pasta) as it:
+                for entrada in it:
+                    if not entrada.is_file():
+                        continue
+                    info = entrada.stat()
+                    if entrada.name.endswith('.tmp'):
+                        # Sobra de um worker que morreu no meio da geração
+                        if info.st_mtime < time.time() - 3600:
+                            try:
+                                os.remove(entrada.path)
+                            except FileNotFoundError:
+                                pass
+                        continue
+                    entradas.append((info.st_mtime, info.st_size, entrada.path))
+                    total += info.st_size
+        except FileNotFoundError:
+            return
+
+        for _, tamanho, caminho in sorted(entradas):
+            if total <= self.limite_bytes:
+                break
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass  # Outro worker já removeu
+            total -= tamanho
+
+cache_exportacao = CacheExportacao(
+    pasta=os.environ.get('PCA_CACHE_EXPORTACAO_DIR', os.path.join(tempfile.gettempdir(), 'pca_cache_exportacao')),
+    limite_bytes=int(float(os.environ.get('PCA_CACHE_EXPORTACAO_MB', 512)) * 1024 * 1024),
+)
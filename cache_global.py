@@ -0,0 +1,91 @@
+import time
+import threading
+from types import SimpleNamespace
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, Contratacao, Ente, VersaoDados
+
+# ============================================================================
+# CACHE POR PROCESSO DOS DADOS GLOBAIS (Ente + data da última modificação)
+# ============================================================================
+# O context processor roda em TODA página renderizada. Sem cache, isso custava
+# duas idas ao banco por página. Aqui guardamos uma cópia em memória e só
+# conferimos a tabela 'versao_dados' (SELECT por chave primária) no máximo uma
+# vez a cada 'janela' segundos. Assim, um worker do Gunicorn nunca mostra dados
+# desatualizados por mais tempo que a janela configurada.
+
+class CacheDadosGlobais:
+    def __init__(self, janela=5.0):
+        self.janela = janela
+        self._lock = threading.Lock()
+        self._dados = None          # (versao, ente, data_ultima_modificacao, versao_alterada_em)
+        self._verificado_em = 0.0
+
+    def invalidar(self):
+        """Descarta o cache local (chamado após o commit de uma alteração neste processo)."""
+        with self._lock:
+            self._dados = None
+
+    def versao_atual(self):
+        """Carimbo da versão dos dados que este worker está servindo (confere o banco se a janela venceu)."""
+        return self._obter()[0]
+
+    def alterado_em(self):
+        """Momento da última escrita em Contratacao/Ente/Secretaria (base do Last-Modified), ou None."""
+        return self._obter()[3]
+
+    def obter(self):
+        """Retorna (ente, data_ultima_modificacao), recarregando só se a versão mudou."""
+        _, ente, data_ultima_modificacao, _ = self._obter()
+        return ente, data_ultima_modificacao
+
+    def _obter(self):
+        agora = time.monotonic()
+        dados = self._dados
+        if dados is not None and agora - self._verificado_em < self.janela:
+            return dados
+
+        linha = db.session.query(VersaoDados.versao, VersaoDados.atualizado_em).filter_by(id=1).first()
+        versao = self._carimbo_versao(linha)
+        if dados is None or dados[0] != versao:
+            dados = (versao, self._copiar_ente(), db.session.query(db.func.max(Contratacao.data_atualizacao)).scalar(),
+                     linha.atualizado_em if linha else None)
+        with self._lock:
+            self._dados = dados
+            self._verificado_em = agora
+        return dados
+
+    @staticmethod
+    def _carimbo_versao(linha):
+        """
+        Carimbo "contador.horário" da versão. O horário do último incremento
+        garante que uma base recriada (contador voltando a 1) nunca repita um
+        carimbo antigo, o que é vital para quem usa a versão como chave de cache.
+        """
+        if linha is None:
+            return '0'
+        versao, atualizado_em = linha
+        return f"{versao}.{atualizado_em:%Y%m%d%H%M%S%f}" if atualizado_em else str(versao)
+
+    @staticmethod
+    def _copiar_ente():
+        """
+        Cópia simples (sem vínculo com a sessão) do registro do Ente. Guardar o
+        objeto do ORM entre requisições causaria DetachedInstanceError após o commit.
+        """
+        ente = Ente.query.first()
+        if ente is None:
+            return None
+        return SimpleNamespace(**{coluna.name: getattr(ente, coluna.name) for coluna in Ente.__table__.columns})
+
+cache_global = CacheDadosGlobais()
+
+@event.listens_for(Session, 'after_commit')
+def invalidar_cache_apos_commit(session):
+    if session.info.pop('pca_dados_alterados', False):
+        cache_global.invalidar()
+
+@event.listens_for(Session, 'after_rollback')
+def descartar_marcacao_apos_rollback(session):
+    # O incremento da versão foi desfeito junto com o resto da transação
+    session.info.pop('pca_dados_alterados', None)
@@ -0,0 +1,134 @@
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Opcionais: sem eles, o algoritmo só não é oferecido
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# ============================================================================
+# COMPRESSÃO DAS RESPOSTAS (GZIP, BROTLI E ZSTD)
+# ============================================================================
+# A listagem da home e o relatório para impressão são tabelas HTML grandes e
+# repetitivas, e nada na pilha (app, Gunicorn, docker-compose) comprimia: o
+# cidadão em conexão lenta baixava tudo cru.
+#
+# Um after_request comprime as respostas de texto (HTML, CSV, JSON, NDJSON...)
+# com o melhor algoritmo aceito pelo navegador:
+#   - respostas montadas em memória, só acima de COMPRESSAO_MINIMO bytes;
+#   - respostas em streaming (CSV/NDJSON), pedaço a pedaço, sem juntar tudo;
+#   - arquivos (send_file: xlsx, pdf, cache em disco, estáticos) ficam de fora:
+#     xlsx/pdf já são comprimidos e assim o sendfile e os Range continuam valendo.
+# A @cache_publico inclui a codificação negociada na ETag: a versão gzip e a
+# sem compressão nunca compartilham a mesma ETag (cabeçalho Vary: Accept-Encoding).
+
+TIPOS_COMPRIMIVEIS = ('application/json', 'application/x-ndjson', 'application/javascript',
+                      'application/xml', 'image/svg+xml')
+
+class _Gzip:
+    def __init__(self, nivel):
+        self._objeto = zlib.compressobj(nivel, zlib.DEFLATED, 31)  # 31: cabeçalho gzip
+    def comprimir(self, dados):
+        return self._objeto.compress(dados)
+    def finalizar(self):
+        return self._objeto.flush()
+
+class _Brotli:
+    def __init__(self, nivel):
+        self._objeto = brotli.Compressor(quality=nivel)
+    def comprimir(self, dados):
+        return self._objeto.process(dados)
+    def finalizar(self):
+        return self._objeto.finish()
+
+class _Zstd:
+    def __init__(self, nivel):
+        self._objeto = zstandard.ZstdCompressor(level=nivel).compressobj()
+    def comprimir(self, dados):
+        return self._objeto.compress(dados)
+    def finalizar(self):
+        return self._objeto.flush()
+
+# Em empate de preferência do navegador, o zstd vem primeiro: no nível padrão
+# comprime tanto quanto o gzip e gasta bem menos CPU do worker
+COMPRESSORES = {
+    codificacao: classe for codificacao, classe, disponivel in (
+        ('zstd', _Zstd, zstandard is not None),
+        ('br', _Brotli, brotli is not None),
+        ('gzip', _Gzip, True),
+    ) if disponivel
+}
+
+def comprimivel(mimetype):
+    return bool(mimetype) and (mimetype.startswith('text/') or mimetype in TIPOS_COMPRIMIVEIS)
+
+class Compressao:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('COMPRESSAO', True)
+        app.config.setdefault('COMPRESSAO_MINIMO', 1024)
+        app.config.setdefault('COMPRESSAO_NIVEIS', {'gzip': 6, 'br': 4, 'zstd': 3})
+        app.after_request(self._comprimir)
+
+    def codificacao_negociada(self):
+        """Algoritmo que esta requisição receberia (ou None), pelo Accept-Encoding."""
+        if not self.app.config['COMPRESSAO']:
+            return None
+        aceitas = request.accept_encodings
+        melhor, melhor_qualidade = None, 0
+        for codificacao in COMPRESSORES:
+            qualidade = aceitas[codificacao]
+            if qualidade > melhor_qualidade:
+                melhor, melhor_qualidade = codificacao, qualidade
+        return melhor
+
+    def _novo_compressor(self, codificacao):
+        return COMPRESSORES[codificacao](self.app.config['COMPRESSAO_NIVEIS'][codificacao])
+
+    def _comprimir(self, response):
+        if (response.direct_passthrough or 'Content-Encoding' in response.headers
+                or response.status_code in (204, 206, 304) or response.status_code < 200
+                or not comprimivel(response.mimetype) or response.cache_control.no_transform):
+            return response
+        codificacao = self.codificacao_negociada()
+        if codificacao is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self._comprimir_fluxo(response.response, codificacao)
+            response.headers.pop('Content-Length', None)
+        else:
+            dados = response.get_data()
+            if len(dados) < self.app.config['COMPRESSAO_MINIMO']:
+                response.vary.add('Accept-Encoding')
+                return response
+            compressor = self._novo_compressor(codificacao)
+            response.set_data(compressor.comprimir(dados) + compressor.finalizar())
+        response.headers['Content-Encoding'] = codificacao
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def _comprimir_fluxo(self, partes, codificacao):
+        """Comprime um gerador sem materializá-lo; fechar a resposta fecha o gerador original."""
+        compressor = self._novo_compressor(codificacao)
+        try:
+            for parte in partes:
+                if isinstance(parte, str):
+                    parte = parte.encode('utf-8')
+                saida = compressor.comprimir(parte)
+                if saida:
+                    yield saida
+            yield compressor.finalizar()
+        finally:
+            if hasattr(partes, 'close'):
+                partes.close()
+
+compressao = Compressao()
@@ -0,0 +1,84 @@
+from sqlalchemy.orm import joinedload
+from models import Contratacao, Secretaria
+from busca import filtro_codigo, filtro_texto, tokenizar
+
+# ============================================================================
+# CAMADA ÚNICA DE CONSULTAS DAS LISTAGENS (Home, Dashboard, Excel e PDF)
+# ============================================================================
+# Toda tela que percorre contratações e mostra "c.secretaria.nome" deve partir
+# daqui. O relacionamento 'secretaria' é carregado no MESMO SELECT (JOIN), o que
+# elimina o problema N+1: sem isso, cada secretaria diferente da lista disparava
+# um SELECT extra, e atrás de um MySQL remoto cada ida e volta custa caro.
+
+def consulta_contratacoes():
+    """Consulta base de contratações já com a secretaria carregada via JOIN."""
+    return Contratacao.query.options(joinedload(Contratacao.secretaria))
+
+def filtrar_contratacoes(query, args):
+    """Aplica na consulta os filtros da URL (secretaria, exercício, código e busca textual)."""
+    sec_id = args.get('secretaria')
+    exercicio = args.get('exercicio')
+    codigo = (args.get('codigo') or '').strip()
+    busca = (args.get('busca') or '').strip()
+
+    if sec_id and sec_id != 'Todas': query = query.filter_by(secretaria_id=sec_id)
+    if exercicio: query = query.filter_by(exercicio=exercicio)
+    # Código e texto passam por índices (ver busca.py), nunca por LIKE '%...%'
+    if codigo: query = query.filter(filtro_codigo(codigo))
+    if busca:
+        condicao = filtro_texto(busca)
+        if condicao is not None: query = query.filter(condicao)
+    return query
+
+# Parâmetros da URL que são filtros (o resto, como cursores e 'formato', não é repassado)
+CHAVES_FILTRO = ('secretaria', 'exercicio', 'codigo', 'busca')
+
+def filtros_da_url(args):
+    """Só os filtros preenchidos, para montar links (exportações, impressão) com os mesmos filtros da tela."""
+    return {chave: args[chave] for chave in CHAVES_FILTRO if args.get(chave)}
+
+def filtros_normalizados(args):
+    """
+    Tupla canônica dos filtros que afetam o resultado (ignora cursores e outros
+    parâmetros). "Todas" e vazio são o mesmo filtro. Usada como chave de cache.
+    """
+    sec_id = (args.get('secretaria') or '').strip()
+    if sec_id == 'Todas': sec_id = ''
+    return (
+        ('secretaria', sec_id),
+        ('exercicio', (args.get('exercicio') or '').strip()),
+        ('codigo', (args.get('codigo') or '').strip()),
+        ('busca', ' '.join(tokenizar(args.get('busca')))),
+    )
+
+def contratacoes_filtradas(args):
+    """Atalho usado pelas telas públicas: consulta base + filtros da URL."""
+    return filtrar_contratacoes(consulta_contratacoes(), args)
+
+# Colunas (na ordem) da planilha Excel e do PDF
+COLUNAS_PLANILHA = (
+    Contratacao.codigo_identificador, Contratacao.exercicio, Secretaria.nome.label('secretaria'),
+    Contratacao.objeto, Contratacao.data_planejada, Contratacao.dotacao, Contratacao.valor_estimado,
+)
+
+# Colunas dos formatos de dados abertos (CSV e NDJSON): inclui ids, descrição e data de atualização
+COLUNAS_DADOS_ABERTOS = (
+    Contratacao.id, Contratacao.codigo_identificador, Contratacao.exercicio, Contratacao.secretaria_id,
+    Secretaria.nome.label('secretaria'), Contratacao.objeto, Contratacao.descricao,
+    Contratacao.data_planejada, Contratacao.dotacao, Contratacao.valor_estimado, Contratacao.data_atualizacao,
+)
+
+def linhas_exportacao(query, lote=1000, colunas=COLUNAS_PLANILHA):
+    """
+    Projeção só com as colunas das exportações, sem criar objetos do ORM.
+    O banco entrega as linhas em lotes (yield_per, que no MySQL usa cursor no
+    servidor), então a memória fica limitada ao lote, não ao tamanho do PCA.
+    """
+    return query.join(Contratacao.secretaria).with_entities(*colunas).yield_per(lote)
+
+def contratacoes_do_usuario(user_login, user_sec_id):
+    """Consulta do painel respeitando o RBAC: o admin vê tudo, os demais só a própria secretaria."""
+    query = consulta_contratacoes()
+    if user_login != 'admin':
+        query = query.filter_by(secretaria_id=user_sec_id)
+    return query
@@ -0,0 +1,141 @@
+import os
+import re
+import gzip
+import json
+import hashlib
+import mimetypes
+from flask import request, send_file
+
+try:
+    import brotli
+except ImportError:  # Opcional: sem ele, só a variante .gz é gerada
+    brotli = None
+
+# ============================================================================
+# ARQUIVOS ESTÁTICOS VERSIONADOS E PRÉ-COMPRIMIDOS
+# ============================================================================
+# O bootstrap.min.css e o bootstrap.bundle.min.js saíam pelo handler padrão
+# com o 'no-store' do add_header: cada página baixava ~300 KB de novo.
+#
+# 'flask construir-estaticos' (rodado no build da imagem) copia para
+# static/dist só os arquivos que os templates realmente usam
+# (url_for('static', filename='...') com nome fixo), com o hash do conteúdo no
+# nome, mais as variantes .gz e .br já comprimidas no nível máximo, e grava o
+# manifest.json (nome original -> nome versionado).
+#
+# Em execução, um url_defaults troca o filename do url_for('static') pelo
+# nome versionado, e a view 'static' entrega esses arquivos com cache
+# imutável de um ano (o nome muda quando o conteúdo muda) e a variante
+# comprimida aceita pelo navegador, sem comprimir nada por requisição. Sem
+# manifesto (ex: desenvolvimento sem o build), tudo continua como antes.
+
+PREFIXO = 'dist/'
+NOME_MANIFESTO = 'manifest.json'
+CACHE_IMUTAVEL = 'public, max-age=31536000, immutable'
+URL_ESTATICO_NOS_TEMPLATES = re.compile(r"""url_for\(\s*['"]static['"]\s*,\s*filename\s*=\s*['"]([^'"]+)['"]""")
+# (codificação no Accept-Encoding, extensão do arquivo), na ordem de preferência
+CODIFICACOES = [('br', '.br'), ('gzip', '.gz')]
+
+def arquivos_usados(pasta_templates):
+    """Arquivos estáticos citados com nome fixo nos templates (nomes dinâmicos, como o logotipo, ficam de fora)."""
+    usados = set()
+    for raiz, _, arquivos in os.walk(pasta_templates):
+        for nome in arquivos:
+            if nome.endswith('.html'):
+                with open(os.path.join(raiz, nome), encoding='utf-8') as f:
+                    usados.update(URL_ESTATICO_NOS_TEMPLATES.findall(f.read()))
+    return sorted(usados)
+
+def _gravar(caminho, conteudo):
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    provisorio = caminho + '.tmp'
+    with open(provisorio, 'wb') as f:
+        f.write(conteudo)
+    os.replace(provisorio, caminho)
+
+def construir(pasta_static, pasta_templates, destino):
+    """
+    Gera os arquivos versionados (e as variantes .gz/.br) em 'destino' e o
+    manifesto. Retorna o manifesto. Rodar de novo com o mesmo conteúdo gera
+    exatamente os mesmos arquivos (gzip sem data).
+    """
+    manifesto = {}
+    for nome in arquivos_usados(pasta_templates):
+        origem = os.path.join(pasta_static, nome)
+        if not os.path.isfile(origem):
+            raise FileNotFoundError(f'Arquivo estático usado nos templates não existe: {nome}')
+        with open(origem, 'rb') as f:
+            conteudo = f.read()
+        base, extensao = os.path.splitext(nome)
+        versionado = f"{base}.{hashlib.sha256(conteudo).hexdigest()[:12]}{extensao}"
+        caminho = os.path.join(destino, versionado)
+        _gravar(caminho, conteudo)
+        _gravar(caminho + '.gz', gzip.compress(conteudo, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _gravar(caminho + '.br', brotli.compress(conteudo, quality=11))
+        manifesto[nome] = versionado
+    _gravar(os.path.join(destino, NOME_MANIFESTO), json.dumps(manifesto, indent=2, sort_keys=True).encode())
+    return manifesto
+
+class Estaticos:
+    def __init__(self, app=None):
+        self.manifesto = {}
+        self.versao = ''  # Resumo do manifesto: entra na ETag das páginas públicas (muda a cada build com assets novos)
+        self.pasta = None
+        self.variantes = {}  # nome versionado -> codificações disponíveis (sem stat por requisição)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self._servir_original = app.view_functions['static']
+        app.view_functions['static'] = self.servir
+        app.url_defaults(self._versionar_url)
+        self.carregar(app.config.get('ESTATICOS_DIR') or os.path.join(app.static_folder, 'dist'))
+
+    def carregar(self, pasta):
+        """Lê o manifesto de 'pasta' (sem ele, os arquivos originais continuam sendo usados)."""
+        self.pasta = pasta
+        try:
+            with open(os.path.join(pasta, NOME_MANIFESTO), encoding='utf-8') as f:
+                manifesto = json.load(f)
+        except FileNotFoundError:
+            manifesto = {}
+        self.variantes = {
+            versionado: [(cod, ext) for cod, ext in CODIFICACOES if os.path.isfile(os.path.join(pasta, versionado + ext))]
+            for versionado in manifesto.values()
+        }
+        self.manifesto = manifesto
+        self.versao = hashlib.sha256(json.dumps(manifesto, sort_keys=True).encode()).hexdigest()[:12] if manifesto else ''
+
+    def _versionar_url(self, endpoint, valores):
+        if endpoint == 'static' and self.app.config.get('ESTATICOS_VERSIONADOS', True):
+            versionado = self.manifesto.get(valores.get('filename'))
+            if versionado:
+                valores['filename'] = PREFIXO + versionado
+
+    def servir(self, filename):
+        versionado = filename[len(PREFIXO):] if filename.startswith(PREFIXO) else None
+        if versionado not in self.variantes:
+            # Demais arquivos (logotipos enviados, build antigo): handler padrão, cache público curto
+            resposta = self._servir_original(filename=filename)
+            resposta.cache_control.no_cache = None
+            resposta.cache_control.public = True
+            resposta.cache_control.max_age = self.app.config.get('CACHE_PUBLICO_MAX_AGE', 60)
+            return resposta
+
+        aceitas = request.accept_encodings
+        caminho, codificacao = os.path.join(self.pasta, versionado), None
+        for cod, ext in self.variantes[versionado]:
+            if aceitas[cod]:
+                caminho, codificacao = caminho + ext, cod
+                break
+        resposta = send_file(caminho, mimetype=mimetypes.guess_type(versionado)[0] or 'application/octet-stream',
+                             conditional=True, etag=True)
+        if codificacao:
+            resposta.headers['Content-Encoding'] = codificacao
+        resposta.vary.add('Accept-Encoding')
+        resposta.headers['Cache-Control'] = CACHE_IMUTAVEL
+        return resposta
+
+estaticos = Estaticos()
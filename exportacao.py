@@ -0,0 +1,385 @@
+import io
+import csv
+import json
+from datetime import date, datetime
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.drawing.image import Image as xlImage
+from openpyxl.styles import Font, Alignment, PatternFill
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader, simpleSplit
+from reportlab.pdfgen import canvas
+
+def formatar_moeda(valor):
+    if valor is None:
+        return "0,00"
+    # Coloca vírgula nos milhares e ponto no decimal, depois inverte para o padrão BR
+    return "{:,.2f}".format(valor).replace(",", "X").replace(".", ",").replace("X", ".")
+
+# ============================================================================
+# GERAÇÃO DA PLANILHA EXCEL DO PCA
+# ============================================================================
+# Dois modos com o MESMO layout (cabeçalho do órgão, logotipo, títulos azuis e
+# valores em formato contábil):
+#   - gerar_excel_streaming: planilha "write-only" do openpyxl. Cada linha vai
+#     direto para o arquivo de destino e é descartada; a memória fica constante
+#     seja a exportação de 10 ou de 500 mil itens. É o modo padrão.
+#   - gerar_excel_em_memoria: implementação original (Workbook completo em RAM).
+#     Mantida como referência para o benchmark e como plano B (PCA_EXCEL_STREAMING=False).
+
+TITULOS_COLUNAS = ['Código', 'Exercício', 'Secretaria', 'Objeto', 'Data Planejada', 'Dotação', 'Valor Estimado (R$)']
+FORMATO_MOEDA = 'R$ #,##0.00'
+COR_INSTITUCIONAL = "24549C"
+
+def _titulos_cabecalho(ente, exercicio, orgao_nome):
+    return (
+        ente.nome if ente else 'Órgão Público',
+        f"Plano de Contratações Anual - {exercicio or 'Geral'}",
+        f"Escopo: {orgao_nome}",
+    )
+
+def _abrir_logo(logo):
+    """O logotipo chega como bytes já redimensionados (logotipo.py) ou, por compatibilidade, como caminho."""
+    return io.BytesIO(logo) if isinstance(logo, bytes) else logo
+
+def _anexar_logo(ws, logo):
+    if logo:
+        try:
+            img = xlImage(_abrir_logo(logo))
+            img.width, img.height = 75, 75
+            ws.add_image(img, 'A1')
+        except Exception as e:
+            print(f"Aviso: Não foi possível anexar a imagem no Excel: {e}")
+
+def gerar_excel_streaming(destino, linhas, ente, exercicio, orgao_nome, logo=None):
+    """
+    Escreve a planilha em 'destino' (caminho ou arquivo binário) consumindo
+    'linhas' sob demanda. Cada linha é uma tupla na ordem de TITULOS_COLUNAS:
+    (codigo, exercicio, secretaria, objeto, data_planejada, dotacao, valor).
+    Retorna a quantidade de linhas de dados escritas.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("PCA_Exportacao")
+
+    # No modo write-only, larguras, alturas e mesclagens são definidas ANTES das linhas
+    for col_num in range(1, len(TITULOS_COLUNAS) + 1):
+        ws.column_dimensions[openpyxl.utils.get_column_letter(col_num)].width = 20
+    ws.column_dimensions['D'].width = 60
+    for i in range(1, 5): ws.row_dimensions[i].height = 20
+    for intervalo in ('B1:F1', 'B2:F2', 'B3:F3'): ws.merged_cells.add(intervalo)
+    _anexar_logo(ws, logo)
+
+    # 1. CABEÇALHO DO ÓRGÃO
+    nome_orgao, titulo_plano, escopo = _titulos_cabecalho(ente, exercicio, orgao_nome)
+    cell_nome = WriteOnlyCell(ws, value=nome_orgao)
+    cell_nome.font = Font(size=14, bold=True, color=COR_INSTITUCIONAL)
+    cell_plano = WriteOnlyCell(ws, value=titulo_plano)
+    cell_plano.font = Font(size=12, bold=True)
+    ws.append([None, cell_nome])
+    ws.append([None, cell_plano])
+    ws.append([None, escopo])
+    ws.append([])
+
+    # 2. CABEÇALHO DA TABELA
+    fonte_titulo = Font(bold=True, color="FFFFFF")
+    fundo_titulo = PatternFill(start_color=COR_INSTITUCIONAL, end_color=COR_INSTITUCIONAL, fill_type="solid")
+    alinhamento_titulo = Alignment(horizontal="center")
+    titulos = []
+    for header_title in TITULOS_COLUNAS:
+        cell = WriteOnlyCell(ws, value=header_title)
+        cell.font = fonte_titulo
+        cell.fill = fundo_titulo
+        cell.alignment = alinhamento_titulo
+        titulos.append(cell)
+    ws.append(titulos)
+
+    # 3. DADOS: uma linha por vez, sem guardar nada
+    center_alignment = Alignment(horizontal="center", vertical="center")
+    total = 0
+    for codigo, exercicio_item, secretaria, objeto, data_planejada, dotacao, valor in linhas:
+        cell_codigo = WriteOnlyCell(ws, value=codigo)
+        cell_codigo.alignment = center_alignment
+        cell_exercicio = WriteOnlyCell(ws, value=exercicio_item)
+        cell_exercicio.alignment = center_alignment
+        cell_data = WriteOnlyCell(ws, value=data_planejada.strftime('%d/%m/%Y') if data_planejada else '-')
+        cell_data.alignment = center_alignment
+        cell_dotacao = WriteOnlyCell(ws, value=dotacao)
+        cell_dotacao.alignment = center_alignment
+        cell_valor = WriteOnlyCell(ws, value=float(valor or 0))
+        cell_valor.number_format = FORMATO_MOEDA
+        ws.append([cell_codigo, cell_exercicio, secretaria, objeto, cell_data, cell_dotacao, cell_valor])
+        total += 1
+
+    wb.save(destino)
+    return total
+
+def gerar_excel_em_memoria(contratacoes, ente, exercicio, orgao_nome, logo=None):
+    """Implementação original: monta o Workbook inteiro em memória e devolve um BytesIO."""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "PCA_Exportacao"
+
+    # 1. CABEÇALHO DO ÓRGÃO
+    nome_orgao, titulo_plano, escopo = _titulos_cabecalho(ente, exercicio, orgao_nome)
+    ws.merge_cells('B1:F1')
+    ws['B1'] = nome_orgao
+    ws['B1'].font = Font(size=14, bold=True, color=COR_INSTITUCIONAL)
+
+    ws.merge_cells('B2:F2')
+    ws['B2'] = titulo_plano
+    ws['B2'].font = Font(size=12, bold=True)
+
+    ws.merge_cells('B3:F3')
+    ws['B3'] = escopo
+
+    # Altura das linhas do cabeçalho
+    for i in range(1, 5): ws.row_dimensions[i].height = 20
+
+    # 2. INSERIR LOGOTIPO (Se existir)
+    _anexar_logo(ws, logo)
+
+    # 3. CABEÇALHO DA TABELA
+    row_num = 5
+    for col_num, header_title in enumerate(TITULOS_COLUNAS, 1):
+        cell = ws.cell(row=row_num, column=col_num, value=header_title)
+        cell.font = Font(bold=True, color="FFFFFF")
+        cell.fill = PatternFill(start_color=COR_INSTITUCIONAL, end_color=COR_INSTITUCIONAL, fill_type="solid")
+        cell.alignment = Alignment(horizontal="center")
+        ws.column_dimensions[openpyxl.utils.get_column_letter(col_num)].width = 20
+
+    # Alargando a coluna do Objeto
+    ws.column_dimensions['D'].width = 60
+
+    # 4. PREENCHER DADOS
+    # Criamos o estilo de alinhamento centralizado uma única vez para otimizar a memória
+    center_alignment = Alignment(horizontal="center", vertical="center")
+
+    for c in contratacoes:
+        row_num += 1
+
+        # Coluna 1: Código (Centralizado)
+        cell_codigo = ws.cell(row=row_num, column=1, value=c.codigo_identificador)
+        cell_codigo.alignment = center_alignment
+
+        # Coluna 2: Exercício (Centralizado)
+        cell_exercicio = ws.cell(row=row_num, column=2, value=c.exercicio)
+        cell_exercicio.alignment = center_alignment
+
+        # Coluna 3: Secretaria (Padrão/Esquerda)
+        ws.cell(row=row_num, column=3, value=c.secretaria.nome)
+
+        # Coluna 4: Objeto (Padrão/Esquerda)
+        ws.cell(row=row_num, column=4, value=c.objeto)
+
+        # Coluna 5: Data Planejada (Centralizado)
+        cell_data = ws.cell(row=row_num, column=5, value=c.data_planejada.strftime('%d/%m/%Y') if c.data_planejada else '-')
+        cell_data.alignment = center_alignment
+
+        # Coluna 6: Dotação (Centralizado)
+        cell_dotacao = ws.cell(row=row_num, column=6, value=c.dotacao)
+        cell_dotacao.alignment = center_alignment
+
+        # Coluna 7: Valor Estimado (Formato Contábil, Excel alinha à direita nativamente)
+        cell_valor = ws.cell(row=row_num, column=7, value=float(c.valor_estimado))
+        cell_valor.number_format = FORMATO_MOEDA
+
+    out = io.BytesIO()
+    wb.save(out)
+    out.seek(0)
+    return out
+
+
+# ============================================================================
+# RELATÓRIO PDF NATIVO (REPORTLAB)
+# ============================================================================
+# Mesmo layout do relatorio_pdf.html (A4 paisagem, margens de 12mm, cabeçalho
+# do Ente repetido em toda página, títulos azuis), mas gerado no servidor: o
+# arquivo pode ir para o cache e ser baixado por scripts. As linhas são
+# desenhadas conforme chegam do banco (sem lista de objetos do ORM), mas o
+# canvas do ReportLab guarda o conteúdo de cada página fechada (showPage) até
+# o save(): a memória cresce ~1,5 KB por linha. Por isso o app limita o PDF
+# síncrono a PDF_MAX_LINHAS e manda os maiores para a fila de tarefas.
+
+PDF_MARGEM = 12 * mm
+PDF_FONTE_TAMANHO = 8
+PDF_ENTRELINHA = 10
+PDF_PADDING = 3
+COR_PDF_INSTITUCIONAL = colors.HexColor('#24549C')
+COR_PDF_BORDA = colors.HexColor('#DEE2E6')
+
+# (título, fração da largura útil, alinhamento) — mesmas proporções do template HTML
+PDF_COLUNAS = (
+    ('Código', 0.12, 'centro'),
+    ('Exercício', 0.08, 'centro'),
+    ('Secretaria', 0.15, 'esquerda'),
+    ('Objeto', 0.31, 'esquerda'),
+    ('Data Planejada', 0.10, 'centro'),
+    ('Dotação', 0.12, 'centro'),
+    ('Valor Estimado', 0.12, 'direita'),
+)
+
+class _PaginaPDF:
+    """Controla o cursor vertical, a quebra de página e a repetição do cabeçalho."""
+
+    def __init__(self, pdf, cabecalho, rodape):
+        self.pdf = pdf
+        self.largura, self.altura = landscape(A4)
+        self.largura_util = self.largura - 2 * PDF_MARGEM
+        self.larguras = [fracao * self.largura_util for _, fracao, _ in PDF_COLUNAS]
+        self.cabecalho = cabecalho
+        self.rodape = rodape
+        self.numero = 0
+        self.y = None
+
+    def nova(self):
+        if self.numero:
+            self.pdf.showPage()
+        self.numero += 1
+        self.y = self.cabecalho(self.pdf, self.altura - PDF_MARGEM)
+        self.y = self.linha(TITULOS_PDF, negrito=True, fundo=COR_PDF_INSTITUCIONAL, cor_texto=colors.white)
+        self.rodape(self.pdf, self.numero)
+
+    def cabe(self, altura):
+        return self.y - altura >= PDF_MARGEM + 12
+
+    def altura_linha(self, valores, negrito=False):
+        fonte = 'Helvetica-Bold' if negrito else 'Helvetica'
+        linhas = [simpleSplit(str(v), fonte, PDF_FONTE_TAMANHO, largura - 2 * PDF_PADDING) or ['']
+                  for v, largura in zip(valores, self.larguras)]
+        return linhas, max(len(l) for l in linhas) * PDF_ENTRELINHA + 2 * PDF_PADDING
+
+    def linha(self, valores, negrito=False, fundo=None, cor_texto=colors.black):
+        """Desenha uma linha da tabela (quebrando texto longo) e devolve o novo y."""
+        textos, altura = self.altura_linha(valores, negrito)
+        if self.y is not None and self.numero and not self.cabe(altura) and valores is not TITULOS_PDF:
+            self.nova()
+        pdf = self.pdf
+        x = PDF_MARGEM
+        topo = self.y
+        if fundo is not None:
+            pdf.setFillColor(fundo)
+            pdf.rect(PDF_MARGEM, topo - altura, self.largura_util, altura, stroke=0, fill=1)
+        pdf.setStrokeColor(COR_PDF_BORDA)
+        pdf.setFillColor(cor_texto)
+        pdf.setFont('Helvetica-Bold' if negrito else 'Helvetica', PDF_FONTE_TAMANHO)
+        for (_, _, alinhamento), largura, linhas in zip(PDF_COLUNAS, self.larguras, textos):
+            pdf.rect(x, topo - altura, largura, altura, stroke=1, fill=0)
+            base = topo - PDF_PADDING - PDF_FONTE_TAMANHO
+            for texto in linhas:
+                if alinhamento == 'centro':
+                    pdf.drawCentredString(x + largura / 2, base, texto)
+                elif alinhamento == 'direita':
+                    pdf.drawRightString(x + largura - PDF_PADDING, base, texto)
+                else:
+                    pdf.drawString(x + PDF_PADDING, base, texto)
+                base -= PDF_ENTRELINHA
+            x += largura
+        self.y = topo - altura
+        return self.y
+
+TITULOS_PDF = tuple(titulo for titulo, _, _ in PDF_COLUNAS)
+
+def gerar_pdf_streaming(destino, linhas, ente, exercicio, orgao_nome, logo=None, gerado_em=None):
+    """
+    Escreve o relatório PDF em 'destino' (caminho ou arquivo binário) consumindo
+    'linhas' sob demanda, na mesma ordem de colunas da planilha. Termina com a
+    linha de totais. Retorna a quantidade de linhas de dados escritas.
+    """
+    gerado_em = gerado_em or datetime.now()
+    pdf = canvas.Canvas(destino, pagesize=landscape(A4), pageCompression=1)
+    pdf.setTitle(f"Relatório PCA - {exercicio or 'Geral'}")
+    pdf.setAuthor(ente.nome if ente else 'Órgão Público')
+
+    imagem_logo = None
+    if logo:
+        try:
+            imagem_logo = ImageReader(_abrir_logo(logo))
+        except Exception as e:
+            print(f"Aviso: Não foi possível anexar a imagem no PDF: {e}")
+
+    def cabecalho(pdf, topo):
+        altura_logo = 20 * mm
+        x_texto = PDF_MARGEM
+        if imagem_logo is not None:
+            largura_img, altura_img = imagem_logo.getSize()
+            largura_logo = altura_logo * largura_img / altura_img
+            pdf.drawImage(imagem_logo, PDF_MARGEM, topo - altura_logo, width=largura_logo, height=altura_logo, mask='auto')
+            x_texto += largura_logo + 6 * mm
+        pdf.setFillColor(COR_PDF_INSTITUCIONAL)
+        pdf.setFont('Helvetica-Bold', 15)
+        pdf.drawString(x_texto, topo - 6 * mm, ente.nome if ente else 'Órgão Público')
+        pdf.setFillColor(colors.black)
+        pdf.setFont('Helvetica', 11)
+        pdf.drawString(x_texto, topo - 12 * mm, f"Plano de Contratações Anual - Exercício {exercicio or 'Todos'}")
+        pdf.setFillColor(colors.grey)
+        pdf.setFont('Helvetica-Bold', 9)
+        pdf.drawString(x_texto, topo - 17 * mm, f"Escopo: {orgao_nome}")
+        base = topo - altura_logo - 3 * mm
+        pdf.setStrokeColor(COR_PDF_BORDA)
+        pdf.line(PDF_MARGEM, base, pdf._pagesize[0] - PDF_MARGEM, base)
+        return base - 3 * mm
+
+    def rodape(pdf, numero):
+        pdf.setFillColor(colors.grey)
+        pdf.setFont('Helvetica', 7)
+        pdf.drawString(PDF_MARGEM, PDF_MARGEM - 4 * mm, f"Relatório gerado pelo Sistema PCA em: {gerado_em.strftime('%d/%m/%Y às %H:%M')}")
+        pdf.drawRightString(pdf._pagesize[0] - PDF_MARGEM, PDF_MARGEM - 4 * mm, f"Página {numero}")
+
+    pagina = _PaginaPDF(pdf, cabecalho, rodape)
+    pagina.nova()
+
+    total, soma = 0, 0.0
+    for codigo, exercicio_item, secretaria, objeto, data_planejada, dotacao, valor in linhas:
+        pagina.linha((
+            codigo or '', exercicio_item, secretaria or '', objeto or '',
+            data_planejada.strftime('%d/%m/%Y') if data_planejada else '-',
+            dotacao or '-', f"R$ {formatar_moeda(valor)}",
+        ))
+        total += 1
+        soma += float(valor or 0)
+
+    if total == 0:
+        pagina.linha(('', '', '', 'Nenhum registro encontrado para estes filtros.', '', '', ''))
+    pagina.linha(('', '', '', f"Total: {total} item(ns)", '', '', f"R$ {formatar_moeda(soma)}"), negrito=True)
+
+    pdf.save()
+    return total
+
+# ============================================================================
+# DADOS ABERTOS: CSV E NDJSON EM STREAMING
+# ============================================================================
+# Geradores que transformam as linhas do banco em pedaços de texto conforme são
+# lidas. Nada é acumulado: o worker envia cada bloco e já parte para o próximo.
+
+LINHAS_POR_BLOCO = 500
+
+def _valor_aberto(valor):
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    return valor
+
+def gerar_csv(linhas, nomes_colunas):
+    """CSV (RFC 4180, UTF-8, separador vírgula, datas ISO 8601) entregue em blocos."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, lineterminator='\n')
+    escritor.writerow(nomes_colunas)
+    for i, linha in enumerate(linhas, 1):
+        escritor.writerow(['' if v is None else _valor_aberto(v) for v in linha])
+        if i % LINHAS_POR_BLOCO == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def gerar_ndjson(linhas, nomes_colunas):
+    """NDJSON: um objeto JSON por linha, entregue em blocos."""
+    bloco = []
+    for linha in linhas:
+        bloco.append(json.dumps(dict(zip(nomes_colunas, map(_valor_aberto, linha))), ensure_ascii=False))
+        if len(bloco) == LINHAS_POR_BLOCO:
+            yield '\n'.join(bloco) + '\n'
+            bloco = []
+    if bloco:
+        yield '\n'.join(bloco) + '\n'
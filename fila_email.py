@@ -0,0 +1,186 @@
+import os
+import time
+import uuid
+import smtplib
+import threading
+from datetime import datetime, timedelta
+from flask_mail import Message
+from models import db, EmailPendente
+
+# ============================================================================
+# CAIXA DE SAÍDA DE E-MAILS (ENVIO ASSÍNCRONO)
+# ============================================================================
+# O "esqueci minha senha" chamava mail.send() dentro da requisição: conexão,
+# TLS e envio ao smtp.gmail.com levavam segundos, e um SMTP lento prendia um
+# worker do Gunicorn. Agora a requisição só grava a mensagem na tabela
+# 'fila_email' e acorda o enviador, que roda num thread de fundo:
+#   - manda em lotes, reaproveitando a mesma conexão SMTP entre mensagens e
+#     entre lotes (fechada depois de PCA_EMAIL_CONEXAO_OCIOSA segundos parada);
+#   - falhou? Nova tentativa com espera exponencial, até PCA_EMAIL_MAX_TENTATIVAS;
+#   - pedidos repetidos com a mesma chave enquanto a mensagem não saiu (ou
+#     logo depois de sair) não geram outro e-mail.
+#
+# Cada worker tem seu enviador; a reserva de cada lote é feita por UPDATE no
+# banco, então dois workers nunca mandam a mesma mensagem. Sem thread (ex:
+# cron), 'flask enviar-emails' esvazia a fila uma vez.
+
+EMAIL_LOTE = int(os.environ.get('PCA_EMAIL_LOTE', 20))
+EMAIL_MAX_TENTATIVAS = int(os.environ.get('PCA_EMAIL_MAX_TENTATIVAS', 5))
+EMAIL_ESPERA_BASE = int(os.environ.get('PCA_EMAIL_ESPERA_BASE', 30))        # 30s, 60s, 120s...
+EMAIL_JANELA_DUPLICADOS = int(os.environ.get('PCA_EMAIL_JANELA_DUPLICADOS', 120))
+EMAIL_CONEXAO_OCIOSA = int(os.environ.get('PCA_EMAIL_CONEXAO_OCIOSA', 60))
+EMAIL_INTERVALO = float(os.environ.get('PCA_EMAIL_INTERVALO', 10))          # Varredura periódica da fila (s)
+RESERVA_EXPIRADA = timedelta(minutes=10) # Reserva de um worker que morreu no meio do envio
+
+def enfileirar_email(destinatario, assunto, corpo, chave=None):
+    """
+    Grava a mensagem na caixa de saída e retorna o registro. Se já existe uma
+    mensagem com a mesma 'chave' aguardando envio, ela recebe o conteúdo novo
+    (ex: o link de recuperação mais recente); se uma saiu há menos de
+    EMAIL_JANELA_DUPLICADOS segundos, nada é gravado e o retorno é None.
+    """
+    if chave:
+        existente = (EmailPendente.query
+                     .filter(EmailPendente.chave == chave, EmailPendente.estado == 'pendente')
+                     .order_by(EmailPendente.id.desc()).first())
+        if existente:
+            existente.assunto, existente.corpo = assunto, corpo
+            db.session.commit()
+            return existente
+        recente = EmailPendente.query.filter(
+            EmailPendente.chave == chave,
+            EmailPendente.estado.in_(('enviando', 'enviado')),
+            EmailPendente.criado_em >= datetime.now() - timedelta(seconds=EMAIL_JANELA_DUPLICADOS),
+        ).first()
+        if recente:
+            return None
+
+    mensagem = EmailPendente(destinatario=destinatario, assunto=assunto, corpo=corpo, chave=chave)
+    db.session.add(mensagem)
+    db.session.commit()
+    return mensagem
+
+def reservar_lote(limite=None):
+    """Marca até 'limite' mensagens vencidas como 'enviando' para este worker e as retorna."""
+    agora = datetime.now()
+    vencidas = db.or_(
+        db.and_(EmailPendente.estado == 'pendente', EmailPendente.proxima_tentativa <= agora),
+        db.and_(EmailPendente.estado == 'enviando', EmailPendente.reservado_em < agora - RESERVA_EXPIRADA),
+    )
+    ids = [i for (i,) in db.session.query(EmailPendente.id).filter(vencidas)
+           .order_by(EmailPendente.proxima_tentativa, EmailPendente.id).limit(limite or EMAIL_LOTE)]
+    if not ids:
+        return []
+    lote = uuid.uuid4().hex
+    # A condição é repetida no UPDATE: se outro worker reservou antes, a linha não vem para cá
+    db.session.execute(db.update(EmailPendente).where(EmailPendente.id.in_(ids), vencidas)
+                       .values(estado='enviando', lote=lote, reservado_em=agora))
+    db.session.commit()
+    return EmailPendente.query.filter_by(lote=lote, estado='enviando').order_by(EmailPendente.id).all()
+
+class TransporteSMTP:
+    """
+    Conexão SMTP do Flask-Mail mantida aberta entre envios. Com
+    MAIL_SUPPRESS_SEND (testes), nada sai e o Flask-Mail só registra as
+    mensagens (mail.record_messages()).
+    """
+
+    def __init__(self, mail, ociosa=EMAIL_CONEXAO_OCIOSA):
+        self.mail = mail
+        self.ociosa = ociosa
+        self._conexao = None
+        self._ultimo_uso = 0.0
+
+    def enviar(self, mensagem):
+        if self._conexao is None:
+            self._conexao = self.mail.connect().__enter__()
+        try:
+            self._conexao.send(mensagem)
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError):
+            # Conexão quebrada: descarta e deixa a retentativa abrir outra
+            self._conexao = None
+            raise
+        self._ultimo_uso = time.monotonic()
+
+    def fechar_se_ociosa(self):
+        if self._conexao is not None and time.monotonic() - self._ultimo_uso >= self.ociosa:
+            self.fechar()
+
+    def fechar(self):
+        conexao, self._conexao = self._conexao, None
+        if conexao is not None:
+            try:
+                conexao.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+
+def processar_fila(transporte, limite=None):
+    """Envia um lote da caixa de saída. Retorna (enviados, com_falha)."""
+    enviados = falhas = 0
+    for registro in reservar_lote(limite):
+        mensagem = Message(registro.assunto, recipients=[registro.destinatario], body=registro.corpo)
+        try:
+            transporte.enviar(mensagem)
+        except Exception as e:
+            falhas += 1
+            registro.tentativas += 1
+            registro.ultimo_erro = str(e)[:500]
+            if registro.tentativas >= EMAIL_MAX_TENTATIVAS:
+                registro.estado = 'falhou'
+                print(f"E-mail {registro.id} descartado após {registro.tentativas} tentativas: {e}")
+            else:
+                registro.estado = 'pendente'
+                registro.proxima_tentativa = datetime.now() + timedelta(seconds=EMAIL_ESPERA_BASE * 2 ** (registro.tentativas - 1))
+        else:
+            enviados += 1
+            registro.estado, registro.enviado_em = 'enviado', datetime.now()
+        registro.lote = None
+        # Cada mensagem é gravada na hora: uma queda no meio do lote não reenvia as que já saíram
+        db.session.commit()
+    return enviados, falhas
+
+def esvaziar_fila(transporte, limite=None):
+    """Processa lotes até não sobrar mensagem vencida (ou um lote inteiro falhar). Retorna (enviados, com_falha)."""
+    total_enviados = total_falhas = 0
+    while True:
+        enviados, falhas = processar_fila(transporte, limite)
+        total_enviados += enviados
+        total_falhas += falhas
+        if enviados == 0:
+            return total_enviados, total_falhas
+
+class EnviadorEmail:
+    """Thread de fundo (um por processo) que esvazia a caixa de saída."""
+
+    def __init__(self, app, mail, intervalo=EMAIL_INTERVALO):
+        self.app = app
+        self.transporte = TransporteSMTP(mail)
+        self.intervalo = intervalo
+        self._acordar = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        # Recriado após o fork (gunicorn --preload): threads não sobrevivem ao fork
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._laco, name='pca-email', daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def avisar(self):
+        """Acorda o enviador na hora (chamado logo depois de enfileirar)."""
+        self.iniciar()
+        self._acordar.set()
+
+    def _laco(self):
+        while True:
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            try:
+                with self.app.app_context():
+                    esvaziar_fila(self.transporte)
+            except Exception as e:
+                print(f"Erro no envio da fila de e-mails: {e}")
+            self.transporte.fechar_se_ociosa()
@@ -0,0 +1,40 @@
+import os
+
+# ============================================================================
+# CONFIGURAÇÃO DO GUNICORN (uso: gunicorn -c gunicorn.conf.py app:app)
+# ============================================================================
+# Com preload, o app é importado uma vez no master e os workers nascem por
+# fork (menos memória e início mais rápido). Importar o app não abre conexões
+# com o banco (o bootstrap roda no 'flask init-db' ou na 1ª requisição), mas
+# o post_fork garante que nenhum worker reaproveite conexões do master: um
+# socket MySQL compartilhado entre processos corrompe o protocolo.
+
+# Workers sync: uma requisição por processo. Por isso o teto de hashes de senha
+# (seguranca.py) é travado por arquivo e vale para a máquina inteira, somando
+# os workers; aumentar PCA_GUNICORN_WORKERS não aumenta a CPU gasta com hashes.
+
+bind = os.environ.get('PCA_GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('PCA_GUNICORN_WORKERS', 3))
+timeout = int(os.environ.get('PCA_GUNICORN_TIMEOUT', 30))
+preload_app = True
+
+# Métricas do Prometheus somadas entre os workers (metricas.py): cada processo grava
+# seus valores em arquivos nesta pasta. Este arquivo é lido antes de o preload
+# importar o app, então a pasta já existe (e está limpa) quando as métricas nascem:
+# arquivos de uma execução anterior somariam contadores de processos que já não existem.
+pasta_metricas = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.environ.get('PCA_METRICAS_DIR', '/tmp/pca_metricas'))
+os.makedirs(pasta_metricas, exist_ok=True)
+for _arquivo in os.listdir(pasta_metricas):
+    if _arquivo.endswith('.db'):
+        os.remove(os.path.join(pasta_metricas, _arquivo))
+
+def child_exit(server, worker):
+    # Medidores "ao vivo" (conexões do pool) do worker que saiu deixam de entrar na soma
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+def post_fork(server, worker):
+    from app import app, db
+    with app.app_context():
+        # close=False: só esquece as conexões herdadas (quem fecha é o master)
+        db.engine.dispose(close=False)
@@ -0,0 +1,253 @@
+import io
+import csv
+import codecs
+import unicodedata
+from datetime import date, datetime
+from openpyxl import load_workbook
+from models import db, Secretaria, Contratacao, incrementar_versao_dados
+from resumo import aplicar_deltas, anotar_delta, chave_resumo
+
+# ============================================================================
+# IMPORTAÇÃO EM LOTE DO PCA (XLSX / CSV)
+# ============================================================================
+# Cadastrar um plano de milhares de linhas pelo formulário custava um commit
+# (mais o UPDATE do código) por item. Aqui a planilha é lida linha a linha
+# (openpyxl em modo read_only / csv.reader), cada linha é validada com as
+# mesmas regras do formulário e as válidas entram em INSERTs executemany de
+# 'lote' em 'lote'. Cada lote custa um só UPDATE (pelos ids do lote) para gerar os códigos.
+# Linhas inválidas não derrubam a importação: voltam numa lista de erros.
+
+LINHAS_PARA_ACHAR_CABECALHO = 20  # A planilha exportada pelo portal tem título antes da tabela
+
+# CSV do Excel brasileiro sai em Windows-1252 ("ANSI"); o dos sistemas, em UTF-8.
+# Vale a primeira que decodifica o arquivo inteiro; o latin-1 aceita qualquer byte.
+CODIFICACOES_CSV = ('utf-8-sig', 'cp1252', 'latin-1')
+
+# Título normalizado da coluna (sem acento, minúsculo) -> campo
+COLUNAS_IMPORTACAO = {
+    'exercicio': 'exercicio',
+    'secretaria': 'secretaria',
+    'secretaria id': 'secretaria_id',
+    'objeto': 'objeto',
+    'descricao': 'descricao',
+    'data': 'data_planejada',
+    'data planejada': 'data_planejada',
+    'dotacao': 'dotacao',
+    'dotacao orcamentaria': 'dotacao',
+    'valor': 'valor',
+    'valor estimado': 'valor',
+    'valor estimado (r$)': 'valor',
+}
+
+def sanitizar_valor(valor_raw):
+    """
+    Converte o valor monetário digitado (Lei de Postel): aceita "R$ 1.000,00",
+    "1000,00" e "1000.00". Levanta ValueError se o formato for inválido.
+    """
+    if isinstance(valor_raw, (int, float)):
+        return float(valor_raw)
+
+    # 1. Remove 'R$', espaços em branco e deixa tudo limpo
+    valor_clean = str(valor_raw).upper().replace('R$', '').strip()
+    # 2. Padrão BR com ponto de milhar e vírgula (ex: 1.000,00)
+    if '.' in valor_clean and ',' in valor_clean:
+        valor_clean = valor_clean.replace('.', '').replace(',', '.')
+    # 3. Padrão BR só com vírgula (ex: 1000,00)
+    elif ',' in valor_clean:
+        valor_clean = valor_clean.replace(',', '.')
+    # 4. Padrão Americano (1000.00): o float() já aceita
+    return float(valor_clean)
+
+def _normalizar_titulo(titulo):
+    texto = unicodedata.normalize('NFKD', str(titulo or '')).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(texto.replace('_', ' ').lower().split())
+
+def _linhas_xlsx(arquivo):
+    planilha = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        yield from planilha.active.iter_rows(values_only=True)
+    finally:
+        planilha.close()
+
+def _codificacao_csv(arquivo, bloco=64 * 1024):
+    """Primeira de CODIFICACOES_CSV que decodifica o arquivo todo (lido em blocos e rebobinado depois)."""
+    inicio = arquivo.tell()
+    try:
+        for codificacao in CODIFICACOES_CSV[:-1]:
+            arquivo.seek(inicio)
+            decodificador = codecs.getincrementaldecoder(codificacao)()
+            try:
+                for dados in iter(lambda: arquivo.read(bloco), b''):
+                    decodificador.decode(dados)
+                decodificador.decode(b'', final=True)
+                return codificacao
+            except UnicodeDecodeError:
+                continue
+        return CODIFICACOES_CSV[-1]
+    finally:
+        arquivo.seek(inicio)
+
+def _linhas_csv(arquivo):
+    texto = io.TextIOWrapper(arquivo, encoding=_codificacao_csv(arquivo), newline='')
+    primeira = texto.readline()
+    # O Excel brasileiro salva CSV com ';'; o export de dados abertos usa ','
+    separador = ';' if primeira.count(';') > primeira.count(',') else ','
+    yield from csv.reader([primeira], delimiter=separador)
+    yield from csv.reader(texto, delimiter=separador)
+
+def ler_planilha(arquivo, nome_arquivo):
+    """
+    Gera um dicionário por linha de dados (chaves de COLUNAS_IMPORTACAO mais
+    'numero_linha'). Linhas totalmente vazias são ignoradas.
+    Levanta ValueError se o formato ou o cabeçalho não forem reconhecidos.
+    """
+    extensao = nome_arquivo.rsplit('.', 1)[-1].lower() if '.' in nome_arquivo else ''
+    if extensao == 'xlsx':
+        linhas = _linhas_xlsx(arquivo)
+    elif extensao == 'csv':
+        linhas = _linhas_csv(arquivo)
+    else:
+        raise ValueError('Formato não suportado. Envie uma planilha .xlsx ou .csv.')
+
+    campos = None
+    for numero_linha, valores in enumerate(linhas, 1):
+        if campos is None:
+            titulos = [_normalizar_titulo(v) for v in valores]
+            if 'objeto' in titulos:
+                campos = [COLUNAS_IMPORTACAO.get(t) for t in titulos]
+            elif numero_linha >= LINHAS_PARA_ACHAR_CABECALHO:
+                break
+            continue
+
+        if all(v is None or str(v).strip() == '' for v in valores):
+            continue
+        registro = {campo: valor for campo, valor in zip(campos, valores) if campo}
+        registro['numero_linha'] = numero_linha
+        yield registro
+
+    if campos is None:
+        raise ValueError('Cabeçalho não encontrado: a planilha precisa ter ao menos as colunas Exercício, Objeto e Valor.')
+
+def _texto(valor):
+    if valor is None:
+        return None
+    texto = str(valor).strip()
+    return texto or None
+
+def _converter_data(valor):
+    if valor is None or isinstance(valor, date):
+        return valor.date() if isinstance(valor, datetime) else valor
+    texto = str(valor).strip()
+    if not texto:
+        return None
+    for formato in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(texto[:10], formato).date()
+        except ValueError:
+            pass
+    raise ValueError(f'data planejada inválida ({texto})')
+
+def _resolver_secretaria(registro, secretarias_por_id, secretarias_por_nome):
+    referencia = _texto(registro.get('secretaria_id')) or _texto(registro.get('secretaria'))
+    if referencia is None:
+        return None
+    if referencia.replace('.0', '', 1).isdigit():
+        secretaria_id = int(float(referencia))
+        if secretaria_id in secretarias_por_id:
+            return secretaria_id
+    elif referencia.lower() in secretarias_por_nome:
+        return secretarias_por_nome[referencia.lower()]
+    raise ValueError(f'secretaria não encontrada ({referencia})')
+
+def validar_linha(registro, secretarias_por_id, secretarias_por_nome, secretaria_padrao=None, somente_secretaria=None):
+    """Monta os valores de um INSERT a partir da linha. Levanta ValueError com o motivo se algo estiver errado."""
+    objeto = _texto(registro.get('objeto'))
+    if objeto is None:
+        raise ValueError('objeto não informado')
+    if len(objeto) > 500:
+        raise ValueError('objeto com mais de 500 caracteres')
+
+    try:
+        exercicio = int(float(str(registro.get('exercicio')).strip()))
+    except (TypeError, ValueError):
+        raise ValueError(f"exercício inválido ({registro.get('exercicio')})")
+
+    valor_raw = registro.get('valor')
+    try:
+        valor_final = sanitizar_valor(valor_raw if valor_raw is not None else '')
+    except ValueError:
+        raise ValueError(f'valor estimado com formato inválido ({valor_raw})')
+
+    dotacao = _texto(registro.get('dotacao'))
+    if dotacao and len(dotacao) > 100:
+        raise ValueError('dotação com mais de 100 caracteres')
+
+    secretaria_id = _resolver_secretaria(registro, secretarias_por_id, secretarias_por_nome) or somente_secretaria or secretaria_padrao
+    if secretaria_id is None:
+        raise ValueError('secretaria não informada')
+    # Mesma regra de RBAC do cadastro: usuário comum só importa para a própria secretaria
+    if somente_secretaria is not None and secretaria_id != somente_secretaria:
+        raise ValueError('você só pode importar itens para a sua própria secretaria')
+
+    return dict(
+        exercicio=exercicio,
+        objeto=objeto,
+        descricao=_texto(registro.get('descricao')),
+        valor_estimado=valor_final,
+        dotacao=dotacao,
+        data_planejada=_converter_data(registro.get('data_planejada')),
+        secretaria_id=secretaria_id,
+    )
+
+def importar_contratacoes(registros, secretaria_padrao=None, somente_secretaria=None, lote=1000):
+    """
+    Valida e insere as linhas em lotes, numa única transação.
+    Retorna (quantidade_inserida, [(numero_linha, mensagem), ...]).
+    """
+    secretarias = db.session.query(Secretaria.id, Secretaria.nome).all()
+    secretarias_por_id = {s.id for s in secretarias}
+    secretarias_por_nome = {s.nome.strip().lower(): s.id for s in secretarias}
+
+    tabela = Contratacao.__table__
+    inseridos = 0
+    erros = []
+    pendentes = []
+    deltas_resumo = {}
+
+    def descarregar():
+        nonlocal inseridos
+        if pendentes:
+            # Core, sem eventos por linha do ORM. O UPDATE dos códigos (models.py) precisa dos
+            # ids criados: executemany com RETURNING onde o banco permite; no MySQL, um único
+            # INSERT com várias linhas, cujos ids são consecutivos a partir do lastrowid
+            if db.session.connection().dialect.insert_executemany_returning:
+                db.session.execute(tabela.insert().return_defaults(), pendentes)
+            else:
+                db.session.execute(tabela.insert().values(pendentes))
+            for p in pendentes:
+                anotar_delta(deltas_resumo, chave_resumo(p['secretaria_id'], p['exercicio'], p['data_planejada']), p['valor_estimado'])
+            inseridos += len(pendentes)
+            pendentes.clear()
+
+    try:
+        for registro in registros:
+            try:
+                pendentes.append(validar_linha(registro, secretarias_por_id, secretarias_por_nome, secretaria_padrao, somente_secretaria))
+            except ValueError as e:
+                erros.append((registro['numero_linha'], str(e)))
+            if len(pendentes) >= lote:
+                descarregar()
+        descarregar()
+
+        if inseridos:
+            # O INSERT em massa não passa pelos eventos do mapper: versiona e atualiza o resumo explicitamente.
+            # Os códigos já foram gerados (um UPDATE por lote, ver models.py).
+            incrementar_versao_dados(db.session.connection())
+            aplicar_deltas(db.session.connection(), deltas_resumo)
+            db.session.info['pca_dados_alterados'] = True
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return inseridos, erros
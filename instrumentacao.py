@@ -0,0 +1,113 @@
+import re
+import time
+import hashlib
+from contextvars import ContextVar
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# ============================================================================
+# INSTRUMENTAÇÃO POR REQUISIÇÃO (SQL, TEMPO TOTAL E LOG DE LENTIDÃO)
+# ============================================================================
+# Para saber se um /exportar/excel lento está no banco, no openpyxl ou em
+# carregamentos preguiçosos, cada requisição mede:
+#   - quantos comandos SQL rodou e quanto tempo passou esperando o banco
+#     (eventos before/after_cursor_execute de todo Engine);
+#   - o tempo total, do before_request ao fim da resposta (inclusive streaming).
+# Os números saem no cabeçalho Server-Timing (aba Network do navegador) e,
+# acima dos limites configurados, no log do app: comando lento com a rota, os
+# filtros e a "impressão digital" do SQL (literais trocados por '?', para
+# agrupar o mesmo comando com valores diferentes); requisição lenta com os
+# totais. O custo por comando é um perf_counter e uma consulta a ContextVar:
+# pode ficar ligado em produção (PCA_INSTRUMENTACAO).
+
+_medicao = ContextVar('pca_medicao', default=None)
+
+class Medicao:
+    __slots__ = ('inicio', 'comandos', 'tempo_sql', 'comandos_lentos')
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.comandos = 0
+        self.tempo_sql = 0.0
+        self.comandos_lentos = 0
+
+def medicao_atual():
+    """Medição da requisição em andamento neste thread (None fora de requisição)."""
+    return _medicao.get()
+
+# Literais e marcadores de parâmetro dos drivers (?, %s, %(nome)s) viram '?'
+_LITERAIS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|%s")
+_LISTAS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_ESPACOS = re.compile(r"\s+")
+
+def impressao_digital(sql):
+    """(hash curto, SQL normalizado): literais viram '?', listas IN viram '(?+)'."""
+    normalizado = _LISTAS.sub('(?+)', _ESPACOS.sub(' ', _LITERAIS.sub('?', sql)).strip())
+    return hashlib.sha1(normalizado.encode()).hexdigest()[:12], normalizado
+
+def _descricao_requisicao():
+    return f"{request.method} {request.endpoint or request.path} args={request.args.to_dict(flat=False)}"
+
+class Instrumentacao:
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('INSTRUMENTACAO', True)
+        app.config.setdefault('LIMITE_SQL_LENTO_MS', 200)
+        app.config.setdefault('LIMITE_REQUISICAO_LENTA_MS', 1000)
+        # Registrado antes dos demais hooks do app: mede também o bootstrap da 1ª requisição
+        app.before_request(self._iniciar)
+        app.after_request(self._cabecalho)
+        app.teardown_request(self._finalizar)
+        event.listen(Engine, 'before_cursor_execute', self._antes_sql)
+        event.listen(Engine, 'after_cursor_execute', self._depois_sql)
+
+    def _iniciar(self):
+        if self.app.config['INSTRUMENTACAO']:
+            _medicao.set(Medicao())
+
+    def _antes_sql(self, conn, cursor, statement, parameters, context, executemany):
+        if _medicao.get() is not None:
+            conn.info.setdefault('pca_inicio_sql', []).append(time.perf_counter())
+
+    def _depois_sql(self, conn, cursor, statement, parameters, context, executemany):
+        medicao = _medicao.get()
+        inicios = conn.info.get('pca_inicio_sql')
+        if medicao is None or not inicios:
+            return
+        duracao = time.perf_counter() - inicios.pop()
+        medicao.comandos += 1
+        medicao.tempo_sql += duracao
+        if duracao * 1000 >= self.app.config['LIMITE_SQL_LENTO_MS']:
+            medicao.comandos_lentos += 1
+            codigo, normalizado = impressao_digital(statement)
+            self.app.logger.warning('SQL lento %.1f ms [%s] em %s: %s',
+                                    duracao * 1000, codigo, _descricao_requisicao(), normalizado[:500])
+
+    def _cabecalho(self, response):
+        medicao = _medicao.get()
+        if medicao is not None:
+            total = (time.perf_counter() - medicao.inicio) * 1000
+            sql = medicao.tempo_sql * 1000
+            # Numa resposta em streaming, estes são os números até o início do envio
+            response.headers.add('Server-Timing',
+                                 f'db;desc="{medicao.comandos} SQL";dur={sql:.1f}, '
+                                 f'app;dur={max(total - sql, 0):.1f}, total;dur={total:.1f}')
+        return response
+
+    def _finalizar(self, erro=None):
+        medicao = _medicao.get()
+        if medicao is None:
+            return
+        _medicao.set(None)
+        total = (time.perf_counter() - medicao.inicio) * 1000
+        if total >= self.app.config['LIMITE_REQUISICAO_LENTA_MS']:
+            self.app.logger.warning('Requisição lenta %.1f ms em %s: %d SQL (%.1f ms, %d lento[s])',
+                                    total, _descricao_requisicao(), medicao.comandos,
+                                    medicao.tempo_sql * 1000, medicao.comandos_lentos)
+
+instrumentacao = Instrumentacao()
@@ -0,0 +1,125 @@
+import io
+import os
+import re
+import hashlib
+import threading
+from PIL import Image, ImageOps
+
+# ============================================================================
+# LOGOTIPO DO ENTE: VARIANTES PRONTAS NO UPLOAD
+# ============================================================================
+# O arquivo enviado era salvo como veio (às vezes um PNG de vários MB) e o
+# mesmo original ia para o cabeçalho de todas as páginas, para cada Excel
+# (lido e decodificado do disco a cada exportação) e para o PDF. Agora o
+# upload gera, uma única vez, uma variante para cada uso:
+#   - cabecalho: páginas HTML (até 80px na tela, gerada em 2x para telas retina)
+#   - excel:     quadro de 75x75 da planilha (proporção mantida, fundo transparente)
+#   - pdf:       20 mm de altura a ~300 dpi
+# Os nomes levam o hash do conteúdo (logo-<hash>-<variante>.png): um logotipo
+# novo tem URL nova, e o navegador pode guardar a imagem sem revalidar.
+# As exportações recebem os bytes da variante já em memória (cache_logos).
+
+VARIANTES = {
+    'cabecalho': dict(altura=160),
+    'pdf': dict(altura=240),
+    'excel': dict(quadro=(75, 75)),
+}
+NOME_VARIANTE = re.compile(r'^(?P<base>.*logo-[0-9a-f]{16})-(?P<variante>[a-z]+)\.png$')
+MAX_BYTES_LOGO = 10 * 1024 * 1024
+
+def _redimensionar(imagem, altura=None, quadro=None):
+    if quadro:
+        miniatura = imagem.copy()
+        miniatura.thumbnail(quadro, Image.LANCZOS)
+        fundo = Image.new('RGBA', quadro, (255, 255, 255, 0))
+        fundo.paste(miniatura, ((quadro[0] - miniatura.width) // 2, (quadro[1] - miniatura.height) // 2))
+        return fundo
+    if imagem.height <= altura:
+        return imagem
+    largura = max(1, round(imagem.width * altura / imagem.height))
+    return imagem.resize((largura, altura), Image.LANCZOS)
+
+def gerar_variantes(conteudo):
+    """
+    Gera as variantes PNG a partir dos bytes de uma imagem.
+    Retorna (hash do conteúdo, {variante: bytes}). Levanta ValueError se não for imagem.
+    """
+    if len(conteudo) > MAX_BYTES_LOGO:
+        raise ValueError('Imagem maior que 10 MB.')
+    try:
+        imagem = Image.open(io.BytesIO(conteudo))
+        imagem = ImageOps.exif_transpose(imagem).convert('RGBA')
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ValueError(f'Arquivo de imagem inválido: {e}')
+
+    variantes = {}
+    for nome, opcoes in VARIANTES.items():
+        saida = io.BytesIO()
+        _redimensionar(imagem, **opcoes).save(saida, 'PNG', optimize=True)
+        variantes[nome] = saida.getvalue()
+    return hashlib.sha256(conteudo).hexdigest()[:16], variantes
+
+def salvar_logo(arquivo, pasta):
+    """
+    Processa o upload ('arquivo' com .read()) e grava as variantes em 'pasta'.
+    Retorna o nome do arquivo da variante de cabeçalho (o que vai em Ente.logo_path).
+    """
+    codigo, variantes = gerar_variantes(arquivo.read())
+    os.makedirs(pasta, exist_ok=True)
+    for nome, conteudo in variantes.items():
+        destino = os.path.join(pasta, f"logo-{codigo}-{nome}.png")
+        if not os.path.exists(destino):  # Mesmo conteúdo = mesmo arquivo: reenvio não regrava
+            with open(destino, 'wb') as f:
+                f.write(conteudo)
+    cache_logos.guardar(f"logo-{codigo}", variantes)
+    return f"logo-{codigo}-cabecalho.png"
+
+class CacheLogos:
+    """Bytes das variantes do logotipo atual, por processo (o nome já muda quando o logotipo muda)."""
+
+    def __init__(self):
+        self._base = None
+        self._variantes = {}
+        self._lock = threading.Lock()
+
+    def guardar(self, base, variantes):
+        with self._lock:
+            self._base, self._variantes = os.path.basename(base), dict(variantes)
+
+    def obter(self, pasta_static, logo_path, variante):
+        """
+        Bytes da 'variante' do logotipo em 'logo_path' (relativo a static/), ou
+        None se não houver arquivo. Logotipos enviados antes desta versão (sem
+        variantes no disco) são convertidos em memória a partir do original.
+        """
+        if not logo_path:
+            return None
+        casamento = NOME_VARIANTE.match(logo_path)
+        base = os.path.basename(casamento.group('base')) if casamento else logo_path
+        with self._lock:
+            if self._base == base and variante in self._variantes:
+                return self._variantes[variante]
+
+        if casamento:
+            caminho = os.path.join(pasta_static, f"{casamento.group('base')}-{variante}.png")
+            try:
+                with open(caminho, 'rb') as f:
+                    conteudo = f.read()
+            except FileNotFoundError:
+                return None
+            with self._lock:
+                if self._base != base:
+                    self._base, self._variantes = base, {}
+                self._variantes[variante] = conteudo
+            return conteudo
+
+        try:
+            with open(os.path.join(pasta_static, logo_path), 'rb') as f:
+                _, variantes = gerar_variantes(f.read())
+        except (FileNotFoundError, ValueError) as e:
+            print(f"Aviso: logotipo indisponível ({logo_path}): {e}")
+            return None
+        self.guardar(base, variantes)
+        return variantes[variante]
+
+cache_logos = CacheLogos()
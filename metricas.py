@@ -0,0 +1,137 @@
+import os
+import time
+from contextvars import ContextVar
+from flask import request
+
+# ============================================================================
+# MÉTRICAS NO FORMATO DO PROMETHEUS (/metrics)
+# ============================================================================
+# Latência por endpoint do Flask, tamanho e duração das exportações, linhas
+# servidas e estado do pool de conexões, para alertar sobre regressões e
+# dimensionar workers/pool sem agente externo: o Prometheus lê /metrics.
+#
+# Com vários workers do Gunicorn, cada processo tem seus contadores; o modo
+# multiprocesso do prometheus_client grava os valores em arquivos mapeados em
+# memória numa pasta compartilhada (PROMETHEUS_MULTIPROC_DIR, ou
+# PCA_METRICAS_DIR) e o /metrics de qualquer worker soma todos. O
+# gunicorn.conf.py limpa a pasta ao subir e descarta os medidores "ao vivo"
+# de workers que morreram. Sem a pasta (flask run, testes), as métricas ficam
+# só no processo atual.
+
+if os.environ.get('PCA_METRICAS_DIR'):
+    # Precisa estar no ambiente antes do primeiro import do prometheus_client
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.environ['PCA_METRICAS_DIR'])
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+                               CONTENT_TYPE_LATEST, generate_latest, multiprocess)
+
+MODO_MULTIPROCESSO = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+# Exportações grandes levam minutos e passam de dezenas de MB: faixas próprias
+FAIXAS_LATENCIA = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+FAIXAS_BYTES = tuple(2 ** n for n in range(10, 31, 2))  # 1 KB a 1 GB
+
+requisicoes = Histogram(
+    'pca_requisicao_segundos', 'Duração das requisições por endpoint, até o fim da resposta (inclusive streaming)',
+    ['endpoint', 'metodo', 'status'], buckets=FAIXAS_LATENCIA)
+exportacoes = Counter(
+    'pca_exportacoes_total', 'Exportações entregues, por tipo e resultado do cache em disco',
+    ['tipo', 'cache'])
+exportacao_bytes = Histogram(
+    'pca_exportacao_bytes', 'Tamanho dos arquivos de exportação entregues', ['tipo'], buckets=FAIXAS_BYTES)
+exportacao_geracao = Histogram(
+    'pca_exportacao_geracao_segundos', 'Tempo para gerar uma exportação (só quando não estava em cache)',
+    ['tipo'], buckets=FAIXAS_LATENCIA)
+linhas_servidas = Counter(
+    'pca_linhas_servidas_total', 'Contratações entregues em páginas, APIs e exportações', ['origem'])
+espera_pool = Histogram(
+    'pca_pool_espera_segundos', 'Espera por uma conexão do pool do banco', buckets=FAIXAS_LATENCIA)
+timeouts_pool = Counter('pca_pool_timeouts_total', 'Requisições que desistiram de esperar uma conexão do pool')
+# livesum: soma dos workers vivos (o de um worker morto some com ele)
+pool = Gauge('pca_pool_conexoes', 'Conexões do pool do banco por estado (soma dos workers)',
+             ['estado'], multiprocess_mode='livesum')
+
+_inicio = ContextVar('pca_metricas_inicio', default=None)
+
+def observar_espera_pool(espera, estourou):
+    """Observador do QueuePoolInstrumentado (pool_banco.observadores_espera)."""
+    espera_pool.observe(espera)
+    if estourou:
+        timeouts_pool.inc()
+
+def contar_linhas(origem, linhas):
+    """Repassa as linhas de um gerador e soma quantas passaram (um único inc no fim)."""
+    total = 0
+    try:
+        for linha in linhas:
+            total += 1
+            yield linha
+    finally:
+        linhas_servidas.labels(origem).inc(total)
+
+def registrar_exportacao(tipo, arquivo, duracao=None):
+    """Conta uma exportação entregue; 'duracao' só vem quando ela foi gerada agora (falta no cache)."""
+    exportacoes.labels(tipo, 'acerto' if duracao is None else 'falta').inc()
+    exportacao_bytes.labels(tipo).observe(os.fstat(arquivo.fileno()).st_size)
+    if duracao is not None:
+        exportacao_geracao.labels(tipo).observe(duracao)
+
+def gerar_metricas():
+    """(corpo, content-type) com as métricas de todos os workers (ou só deste processo)."""
+    if MODO_MULTIPROCESSO:
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+    else:
+        registro = REGISTRY
+    return generate_latest(registro), CONTENT_TYPE_LATEST
+
+class Metricas:
+    """
+    Mede cada requisição (before_request até o teardown, que numa resposta em
+    streaming só roda no fim do envio) e, no máximo a cada 'intervalo_pool'
+    segundos por worker, copia o estado do pool para os medidores.
+    """
+
+    def __init__(self, app=None, estado_pool=None, intervalo_pool=5):
+        self.estado_pool = estado_pool
+        self.intervalo_pool = intervalo_pool
+        self._ultimo_pool = 0.0
+        if app is not None:
+            self.init_app(app, estado_pool)
+
+    def init_app(self, app, estado_pool=None):
+        self.estado_pool = estado_pool or self.estado_pool
+        app.before_request(self._iniciar)
+        app.after_request(self._status)
+        app.teardown_request(self._finalizar)
+
+    def _iniciar(self):
+        _inicio.set([time.perf_counter(), 500])
+
+    def _status(self, response):
+        medicao = _inicio.get()
+        if medicao is not None:
+            medicao[1] = response.status_code
+        return response
+
+    def _finalizar(self, erro=None):
+        medicao = _inicio.get()
+        if medicao is None:
+            return
+        _inicio.set(None)
+        # Rotas inexistentes ficam todas em um rótulo só (senão cada URL vira uma série)
+        requisicoes.labels(request.endpoint or 'sem_rota', request.method, str(medicao[1])).observe(
+            time.perf_counter() - medicao[0])
+        agora = time.monotonic()
+        if self.estado_pool and agora - self._ultimo_pool >= self.intervalo_pool:
+            self._ultimo_pool = agora
+            self.atualizar_pool()
+
+    def atualizar_pool(self):
+        estado = self.estado_pool()
+        for chave in ('em_uso', 'livres', 'overflow', 'tamanho'):
+            if chave in estado:
+                pool.labels(chave).set(estado[chave])
+
+metricas = Metricas()
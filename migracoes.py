@@ -0,0 +1,108 @@
+from datetime import datetime
+from sqlalchemy import inspect, text
+from models import db, Contratacao, ResumoGasto
+from busca import NOME_INDICE_FULLTEXT
+from resumo import recalcular_grupos
+
+# ============================================================================
+# MIGRAÇÕES DE ESQUEMA VERSIONADAS
+# ============================================================================
+# O db.create_all() só cria o que não existe: numa base que já tem a tabela,
+# índices novos declarados no models.py nunca chegam ao banco. Cada migração
+# aqui tem um número, roda uma única vez e fica registrada em 'schema_versao'.
+# Os passos conferem o que já existe antes de criar, então a mesma lista serve
+# para uma base nova (create_all já criou tudo: só registra) e para o MySQL de
+# produção (cria o que falta). Uso: 'flask migrar' ou 'flask init-db', no deploy.
+# A primeira requisição de cada worker não roda DDL: só confere a versão.
+#
+# Regra: migração publicada não se edita. Mudou o esquema? Acrescente outra.
+
+NOME_TRAVA = 'pca_migracoes'
+ESPERA_TRAVA = 60      # Segundos de cada GET_LOCK
+TENTATIVAS_TRAVA = 5   # Migração longa de outra instância: espera até 5 x 60s antes de desistir
+
+class MigracaoEmAndamento(RuntimeError):
+    """Outra instância segura a trava das migrações (ou o GET_LOCK falhou)."""
+
+schema_versao = db.Table(
+    'schema_versao',
+    db.Column('versao', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('descricao', db.String(255), nullable=False),
+    db.Column('aplicada_em', db.DateTime, nullable=False),
+)
+
+def _criar_indices(conexao, tabela, nomes):
+    """Cria, dentre os índices declarados em 'tabela', os que ainda não existem no banco."""
+    existentes = {i['name'] for i in inspect(conexao).get_indexes(tabela.name)}
+    for indice in tabela.indexes:
+        if indice.name in nomes and indice.name not in existentes:
+            indice.create(conexao)
+
+def _m001_indices_consultas_publicas(conexao):
+    _criar_indices(conexao, Contratacao.__table__, {
+        'ix_contratacoes_exercicio_id',
+        'ix_contratacoes_secretaria_exercicio_id',
+        'ix_contratacoes_data_atualizacao',
+    })
+    if conexao.dialect.name == 'mysql':
+        _criar_indices(conexao, Contratacao.__table__, {NOME_INDICE_FULLTEXT})
+
+def _m002_resumo_gastos(conexao):
+    # Base antiga: a tabela nasce vazia no create_all e é preenchida aqui, uma vez
+    ResumoGasto.__table__.create(conexao, checkfirst=True)
+    recalcular_grupos(conexao)
+
+# (versão, descrição, função). Sempre em ordem crescente.
+MIGRACOES = [
+    (1, 'Índices (exercicio, id), (secretaria_id, exercicio, id), data_atualizacao e FULLTEXT da busca', _m001_indices_consultas_publicas),
+    (2, 'Tabela agregada resumo_gastos (secretaria, exercício, mês)', _m002_resumo_gastos),
+]
+
+def versao_schema(conexao, criar=True):
+    """Maior migração já aplicada nesta base (0 se nenhuma). Com criar=False, não roda DDL."""
+    if criar:
+        schema_versao.create(conexao, checkfirst=True)
+    elif not inspect(conexao).has_table(schema_versao.name):
+        return 0
+    return conexao.execute(db.select(db.func.max(schema_versao.c.versao))).scalar() or 0
+
+def migracoes_pendentes(conexao, criar=True):
+    atual = versao_schema(conexao, criar)
+    return [m for m in MIGRACOES if m[0] > atual]
+
+def obter_trava(conexao, tentativas=TENTATIVAS_TRAVA, espera=ESPERA_TRAVA):
+    """
+    GET_LOCK do MySQL: 1 = trava obtida; 0 = tempo esgotado (outra instância
+    migrando); NULL = erro. Tenta de novo e, se não conseguir, levanta
+    MigracaoEmAndamento em vez de migrar sem a trava.
+    """
+    for _ in range(tentativas):
+        if conexao.execute(text("SELECT GET_LOCK(:nome, :espera)"), dict(nome=NOME_TRAVA, espera=espera)).scalar() == 1:
+            return
+    raise MigracaoEmAndamento(
+        f"Não foi possível obter a trava '{NOME_TRAVA}' em {tentativas * espera}s: "
+        "outra instância ainda está aplicando migrações. Rode 'flask migrar' de novo depois.")
+
+def aplicar_migracoes(engine=None):
+    """Aplica, em ordem, as migrações pendentes. Retorna a lista de versões aplicadas."""
+    engine = engine or db.engine
+    aplicadas = []
+    with engine.connect() as conexao:
+        mysql = conexao.dialect.name == 'mysql'
+        if mysql:
+            # Várias instâncias rodando o deploy ao mesmo tempo: só uma migra, as outras esperam
+            obter_trava(conexao)
+        try:
+            pendentes = migracoes_pendentes(conexao)
+            conexao.commit()
+            for versao, descricao, funcao in pendentes:
+                # No MySQL, DDL faz commit implícito: por isso os passos são idempotentes
+                with conexao.begin():
+                    funcao(conexao)
+                    conexao.execute(schema_versao.insert().values(versao=versao, descricao=descricao, aplicada_em=datetime.now()))
+                aplicadas.append(versao)
+        finally:
+            if mysql:
+                conexao.execute(text("SELECT RELEASE_LOCK(:nome)"), dict(nome=NOME_TRAVA))
+                conexao.commit()
+    return aplicadas
@@ -2,8 +2,12 @@ import os
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from seguranca import gerar_hash, conferir_hash, precisa_refazer_hash
 from sqlalchemy import event # <-- IMPORTANTE ADICIONAR ISSO
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.expression import Insert
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.orm.attributes import set_committed_value
 
 db = SQLAlchemy()
 
@@ -25,12 +29,22 @@ class Usuario(db.Model):
     secretaria = db.relationship('Secretaria', back_populates='usuarios')
     
     def set_password(self, password):
-        self.senha = generate_password_hash(password)
+        self.senha = gerar_hash(password)
     def check_password(self, password):
-        return check_password_hash(self.senha, password)
+        # O hash roda no pool limitado de seguranca.py (pode levantar SistemaOcupado)
+        return conferir_hash(self.senha, password)
+    def precisa_refazer_hash(self):
+        return precisa_refazer_hash(self.senha)
 
 class Contratacao(db.Model):
     __tablename__ = 'contratacoes'
+    # Índices no formato exato das consultas quentes (ver migracoes.py para bases já existentes):
+    #   - home e exportações: filtro por exercício, ordenação/cursor por (exercicio, id)
+    #   - filtro por secretaria na home e painel do usuário comum: (secretaria_id, exercicio, id)
+    __table_args__ = (
+        db.Index('ix_contratacoes_exercicio_id', 'exercicio', 'id'),
+        db.Index('ix_contratacoes_secretaria_exercicio_id', 'secretaria_id', 'exercicio', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     exercicio = db.Column(db.Integer, nullable=False)
     objeto = db.Column(db.String(500), nullable=False)
@@ -39,7 +53,7 @@ class Contratacao(db.Model):
     dotacao = db.Column(db.String(100))
     data_planejada = db.Column(db.Date)
     secretaria_id = db.Column(db.Integer, db.ForeignKey('secretarias.id'), nullable=False)
-    data_atualizacao = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    data_atualizacao = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now, index=True)
     
     # A coluna agora é normal e permite nulo inicialmente (pois será preenchida logo após o insert)
     codigo_identificador = db.Column(db.String(100), unique=True, nullable=True)
@@ -55,20 +69,164 @@ class Ente(db.Model):
     email = db.Column(db.String(100), default="contato@modelo.gov.br")
     logo_path = db.Column(db.String(255), nullable=True) # Caminho da imagem salva
 
+class VersaoDados(db.Model):
+    """
+    Contador único (linha id=1) incrementado a cada escrita em Contratacao, Ente ou Secretaria.
+    Os workers do Gunicorn comparam este número com o que têm em cache para
+    saber, com um SELECT por chave primária, se precisam recarregar os dados.
+    """
+    __tablename__ = 'versao_dados'
+    id = db.Column(db.Integer, primary_key=True)
+    versao = db.Column(db.Integer, nullable=False, default=0)
+    atualizado_em = db.Column(db.DateTime, default=datetime.now)
+
+class ResumoGasto(db.Model):
+    """
+    Agregado do valor estimado por secretaria, exercício e mês planejado
+    (mes=0: sem data planejada). Mantido por resumo.py a cada escrita em
+    Contratacao; a página /resumo lê só esta tabela.
+    """
+    __tablename__ = 'resumo_gastos'
+    secretaria_id = db.Column(db.Integer, db.ForeignKey('secretarias.id'), primary_key=True, autoincrement=False)
+    exercicio = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    mes = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    quantidade = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float)
+    minimo = db.Column(db.Float)
+    maximo = db.Column(db.Float)
+
+class EmailPendente(db.Model):
+    """
+    Caixa de saída de e-mails (ver fila_email.py). A requisição só grava a
+    mensagem aqui; o envio por SMTP acontece num thread de fundo.
+    """
+    __tablename__ = 'fila_email'
+    # O enviador busca "pendentes cuja próxima tentativa já venceu", em ordem
+    __table_args__ = (
+        db.Index('ix_fila_email_estado_proxima', 'estado', 'proxima_tentativa'),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    destinatario = db.Column(db.String(150), nullable=False)
+    assunto = db.Column(db.String(255), nullable=False)
+    corpo = db.Column(db.Text, nullable=False)
+    # Pedidos repetidos com a mesma chave (ex: recuperação de senha do mesmo e-mail) viram uma só mensagem
+    chave = db.Column(db.String(200), index=True)
+    estado = db.Column(db.String(20), nullable=False, default='pendente') # pendente, enviando, enviado, falhou
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    proxima_tentativa = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    lote = db.Column(db.String(32)) # Reserva do worker que está enviando
+    reservado_em = db.Column(db.DateTime)
+    ultimo_erro = db.Column(db.String(500))
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    enviado_em = db.Column(db.DateTime)
+
 # =====================================================================
-# EVENT HOOK: Para corrigir o erro da Computed Column
+# CÓDIGO IDENTIFICADOR ("PCA-{id}.{exercicio}-{secretaria_id}")
 # =====================================================================
-@event.listens_for(Contratacao, 'after_insert')
-def gerar_codigo_apos_insert(mapper, connection, target):
+# O código depende do 'id', que só existe depois do INSERT. Antes, um hook
+# after_insert disparava um UPDATE por linha inserida (e os INSERTs em massa
+# pelo Core nem passavam por ele). Agora cada comando INSERT em 'contratacoes',
+# venha do ORM, de insert().values([...]) ou de um executemany, é seguido de UM
+# único UPDATE restrito aos ids que esse INSERT acabou de criar (pela chave
+# primária: não varre a tabela nem trava linhas de outras transações).
+# Coluna calculada no banco não serve aqui: o MySQL não aceita coluna gerada
+# que dependa de uma coluna AUTO_INCREMENT.
+
+def codigo_identificador(id, exercicio, secretaria_id):
+    """Formato oficial do código. Não alterar: os códigos já publicados seguem este padrão."""
+    return f"PCA-{id}.{exercicio}-{secretaria_id}"
+
+def expressao_codigo_identificador(tabela=None):
     """
-    Este evento é acionado pelo SQLAlchemy IMEDIATAMENTE após a linha ser inserida
-    no banco de dados, ou seja, AGORA nós já temos o 'id' verdadeiro (target.id).
+    O mesmo código de codigo_identificador(), só que como expressão SQL
+    (o operador + vira || no SQLite e CONCAT() no MySQL).
     """
-    codigo = f"PCA-{target.id}.{target.exercicio}-{target.secretaria_id}"
-    
-    # Atualiza o próprio registro recém-criado com o código formatado
-    connection.execute(
-        Contratacao.__table__.update().
-        where(Contratacao.id == target.id).
-        values(codigo_identificador=codigo)
-    )
\ No newline at end of file
+    t = (tabela if tabela is not None else Contratacao.__table__).c
+    return (db.literal('PCA-') + db.cast(t.id, db.String) + '.' +
+            db.cast(t.exercicio, db.String) + '-' + db.cast(t.secretaria_id, db.String))
+
+def ids_inseridos(connection, result):
+    """
+    Ids criados pelo INSERT de 'result' (lista ou range), ou None quando o
+    driver não informa (executemany sem RETURNING, como no MySQL).
+    """
+    ids = [linha[0] for linha in result.inserted_primary_key_rows]
+    if ids and None not in ids:
+        return ids  # Uma linha, ou executemany com RETURNING (ORM, importação fora do MySQL)
+    if not result.context.executemany and result.lastrowid and result.rowcount > 0:
+        # Um só INSERT com várias linhas (VALUES (...), (...)): os ids são
+        # consecutivos e o lastrowid é o da primeira linha no MySQL, o da última no SQLite
+        if connection.dialect.name in ('mysql', 'mariadb'):
+            primeiro = result.lastrowid
+        else:
+            primeiro = result.lastrowid - result.rowcount + 1
+        return range(primeiro, primeiro + result.rowcount)
+    return None
+
+def preencher_codigos_pendentes(connection, ids=None):
+    """
+    Gera, num só comando, o código das contratações 'ids' (lista ou range).
+    Sem 'ids', vale para toda contratação ainda sem código (varre a tabela).
+    """
+    tabela = Contratacao.__table__
+    condicao = tabela.c.codigo_identificador.is_(None)
+    if isinstance(ids, range):
+        condicao = db.and_(tabela.c.id.between(ids.start, ids.stop - 1), condicao)
+    elif ids is not None:
+        condicao = db.and_(tabela.c.id.in_(ids), condicao)
+    return connection.execute(
+        tabela.update().
+        where(condicao).
+        values(codigo_identificador=expressao_codigo_identificador(tabela))
+    ).rowcount
+
+@event.listens_for(Engine, 'after_execute')
+def gerar_codigos_apos_insert(conn, clauseelement, multiparams, params, execution_options, result):
+    tabela = getattr(clauseelement, 'table', None)
+    if isinstance(clauseelement, Insert) and tabela is not None and tabela.name == Contratacao.__tablename__:
+        # Sem os ids (executemany sem RETURNING no MySQL, só em scripts avulsos como
+        # os de benchmark), cai na varredura; a importação nunca passa por aqui
+        preencher_codigos_pendentes(conn, ids_inseridos(conn, result))
+
+@event.listens_for(Session, 'after_flush')
+def sincronizar_codigos_apos_flush(session, flush_context):
+    """
+    O UPDATE acima roda direto no banco; aqui só copiamos o mesmo valor para os
+    objetos recém-inseridos (sem SQL), para quem lê c.codigo_identificador logo
+    depois do flush, antes do commit.
+    """
+    for objeto in session.new:
+        if isinstance(objeto, Contratacao) and objeto.codigo_identificador is None:
+            set_committed_value(objeto, 'codigo_identificador',
+                                codigo_identificador(objeto.id, objeto.exercicio, objeto.secretaria_id))
+
+# =====================================================================
+# EVENT HOOK: Versão dos dados públicos (invalidação de cache)
+# =====================================================================
+def incrementar_versao_dados(connection):
+    """Soma 1 no contador global de versão. Cria a linha na primeira vez."""
+    tabela = VersaoDados.__table__
+    resultado = connection.execute(
+        tabela.update().where(tabela.c.id == 1).
+        values(versao=tabela.c.versao + 1, atualizado_em=datetime.now())
+    )
+    if resultado.rowcount == 0:
+        connection.execute(tabela.insert().values(id=1, versao=1, atualizado_em=datetime.now()))
+
+def marcar_dados_alterados(mapper, connection, target):
+    """Só marca a sessão: o incremento acontece uma única vez no fim do flush."""
+    session = object_session(target)
+    if session is not None:
+        session.info['pca_versionar'] = True
+
+# Secretaria entra também: o nome dela aparece nas listagens e exportações
+for _modelo in (Contratacao, Ente, Secretaria):
+    for _evento in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_modelo, _evento, marcar_dados_alterados)
+
+@event.listens_for(Session, 'after_flush')
+def versionar_apos_flush(session, flush_context):
+    if session.info.pop('pca_versionar', False):
+        incrementar_versao_dados(session.connection())
+        # Fica registrado até o commit/rollback para o cache local decidir o que fazer
+        session.info['pca_dados_alterados'] = True
@@ -0,0 +1,111 @@
+import os
+import time
+import threading
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import TimeoutError as TempoEsgotadoPool
+
+# ============================================================================
+# POOL DE CONEXÕES DO MYSQL (CONFIGURÁVEL E INSTRUMENTADO)
+# ============================================================================
+# Sem opções, o SQLAlchemy guardava conexões que o MySQL já tinha derrubado
+# pelo wait_timeout: a primeira requisição em cada uma falhava ou pagava a
+# reconexão. Aqui as opções do engine vêm do ambiente (PCA_DB_POOL_*), com
+# pre-ping e reciclagem ligados, e o pool conta quanto tempo as requisições
+# esperam por uma conexão, para dimensionar o pool com dados reais.
+#
+# As métricas são por processo (cada worker do Gunicorn tem o seu pool).
+
+DRIVERS_MYSQL = {
+    'pymysql': 'mysql+pymysql',
+    # mysql-connector-python (já no requirements) usa a extensão em C quando disponível
+    'mysqlconnector': 'mysql+mysqlconnector',
+}
+
+class QueuePoolInstrumentado(QueuePool):
+    """
+    QueuePool que mede a espera de cada checkout (inclusive os que estouram o
+    pool_timeout). Um engine.dispose() recria o pool pela mesma classe, com as
+    métricas zeradas. Cada espera também é repassada a 'observadores_espera'
+    (funções espera_segundos, estourou), como o exportador de métricas.
+    """
+
+    observadores_espera = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock_metricas = threading.Lock()
+        self._medindo = threading.local()
+        self._checkouts = 0
+        self._espera_total = 0.0
+        self._espera_maxima = 0.0
+        self._timeouts = 0
+
+    def _do_get(self):
+        # O _do_get original chama a si mesmo ao tentar de novo: só a chamada externa é medida
+        if getattr(self._medindo, 'ativo', False):
+            return super()._do_get()
+        self._medindo.ativo = True
+        estourou = False
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TempoEsgotadoPool:
+            estourou = True
+            with self._lock_metricas:
+                self._timeouts += 1
+            raise
+        finally:
+            self._medindo.ativo = False
+            espera = time.perf_counter() - inicio
+            with self._lock_metricas:
+                self._checkouts += 1
+                self._espera_total += espera
+                self._espera_maxima = max(self._espera_maxima, espera)
+            for observador in self.observadores_espera:
+                observador(espera, estourou)
+
+    def metricas(self):
+        with self._lock_metricas:
+            checkouts, espera_total = self._checkouts, self._espera_total
+            espera_maxima, timeouts = self._espera_maxima, self._timeouts
+        return dict(
+            pid=os.getpid(),
+            tamanho=self.size(),
+            max_overflow=self._max_overflow,
+            em_uso=self.checkedout(),
+            livres=self.checkedin(),
+            overflow=max(self.overflow(), 0),
+            checkouts=checkouts,
+            espera_media_ms=round(espera_total / checkouts * 1000, 3) if checkouts else 0.0,
+            espera_maxima_ms=round(espera_maxima * 1000, 3),
+            timeouts=timeouts,
+        )
+
+def url_mysql(usuario, senha, host, porta, banco, driver='pymysql'):
+    if driver not in DRIVERS_MYSQL:
+        raise ValueError(f"PCA_DB_DRIVER inválido: {driver} (use {', '.join(DRIVERS_MYSQL)})")
+    return f"{DRIVERS_MYSQL[driver]}://{usuario}:{senha}@{host}:{porta}/{banco}"
+
+def opcoes_engine(uri, ambiente=os.environ):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS para a URI. Só o MySQL recebe o pool
+    configurado: o SQLite em memória dos testes usa um pool próprio.
+    """
+    if not uri.startswith('mysql'):
+        return {}
+    return dict(
+        poolclass=QueuePoolInstrumentado,
+        pool_size=int(ambiente.get('PCA_DB_POOL_SIZE', 5)),
+        max_overflow=int(ambiente.get('PCA_DB_POOL_MAX_OVERFLOW', 10)),
+        # Abaixo do wait_timeout do servidor: a conexão é trocada antes de o MySQL derrubá-la
+        pool_recycle=int(ambiente.get('PCA_DB_POOL_RECYCLE', 280)),
+        pool_pre_ping=ambiente.get('PCA_DB_POOL_PRE_PING', 'True') == 'True',
+        pool_timeout=float(ambiente.get('PCA_DB_POOL_TIMEOUT', 30)),
+    )
+
+def metricas_pool(engine):
+    """Métricas do pool deste processo (básicas se o pool não for o instrumentado)."""
+    pool = engine.pool
+    if isinstance(pool, QueuePoolInstrumentado):
+        return pool.metricas()
+    return dict(pid=os.getpid(), classe=type(pool).__name__, status=pool.status())
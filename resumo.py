@@ -0,0 +1,251 @@
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from models import db, Contratacao, Secretaria, ResumoGasto
+
+# ============================================================================
+# RESUMO DE GASTOS POR SECRETARIA, EXERCÍCIO E MÊS (TABELA AGREGADA)
+# ============================================================================
+# "Quanto cada secretaria planeja gastar em 2026?" só era respondido baixando
+# a exportação inteira e somando. A tabela 'resumo_gastos' guarda quantidade,
+# soma, mínimo e máximo do valor estimado por (secretaria, exercício, mês), e
+# a página /resumo lê só ela: custo proporcional ao número de grupos, não de
+# contratações.
+#
+# Manutenção incremental: cada flush que mexe em contratações anota, por
+# (secretaria, exercício, mês), o que entrou e o que saiu (numa troca de
+# secretaria, ano, data ou valor, sai do grupo antigo e entra no novo). No fim
+# do flush, as entradas viram um único upsert nas linhas do resumo
+# (quantidade + n, total + soma, mínimo/máximo só se o novo valor os supera),
+# sem ler as contratações do grupo. Saída não dá para "descontar" no mínimo e
+# no máximo: só quando o valor removido ERA o mínimo ou o máximo daquele mês,
+# essa linha (e só ela) é recalculada a partir das contratações. A importação
+# em massa monta os mesmos deltas e chama aplicar_deltas().
+#
+# 'flask reconstruir-resumo' refaz a tabela inteira com pandas (agregação
+# vetorizada em memória), para a carga inicial ou para conferir divergências.
+
+def _mes(coluna):
+    return db.func.coalesce(db.extract('month', coluna), 0)
+
+def _selecao_agregada():
+    return db.select(
+        Contratacao.secretaria_id, Contratacao.exercicio, _mes(Contratacao.data_planejada),
+        db.func.count(), db.func.sum(Contratacao.valor_estimado),
+        db.func.min(Contratacao.valor_estimado), db.func.max(Contratacao.valor_estimado),
+    ).group_by(Contratacao.secretaria_id, Contratacao.exercicio, _mes(Contratacao.data_planejada))
+
+COLUNAS_RESUMO = ['secretaria_id', 'exercicio', 'mes', 'quantidade', 'total', 'minimo', 'maximo']
+
+def recalcular_grupos(conexao, pares=None):
+    """
+    Recalcula o resumo dos pares (secretaria_id, exercicio) informados, ou de
+    tudo se 'pares' for None, direto no banco (um DELETE e um INSERT ... SELECT).
+    """
+    tabela = ResumoGasto.__table__
+    exclusao, selecao = tabela.delete(), _selecao_agregada()
+    if pares is not None:
+        pares = sorted({(s, e) for s, e in pares if s is not None and e is not None})
+        if not pares:
+            return
+        filtro = db.tuple_(Contratacao.secretaria_id, Contratacao.exercicio).in_(pares)
+        exclusao = exclusao.where(db.tuple_(tabela.c.secretaria_id, tabela.c.exercicio).in_(pares))
+        selecao = selecao.where(filtro)
+    conexao.execute(exclusao)
+    conexao.execute(tabela.insert().from_select(COLUNAS_RESUMO, selecao))
+
+def chave_resumo(secretaria_id, exercicio, data_planejada):
+    return (secretaria_id, exercicio, data_planejada.month if data_planejada else 0)
+
+def anotar_delta(deltas, chave, valor, sinal=1):
+    """Acumula em 'deltas' a entrada (sinal=1) ou a saída (sinal=-1) de um item com 'valor' no grupo 'chave'."""
+    if chave[0] is None or chave[1] is None:
+        return
+    delta = deltas.setdefault(chave, dict(quantidade=0, total=None, minimo=None, maximo=None, removidos=[]))
+    delta['quantidade'] += sinal
+    if valor is None:
+        return
+    delta['total'] = (delta['total'] or 0) + sinal * valor
+    if sinal > 0:
+        delta['minimo'] = valor if delta['minimo'] is None else min(delta['minimo'], valor)
+        delta['maximo'] = valor if delta['maximo'] is None else max(delta['maximo'], valor)
+    else:
+        delta['removidos'].append(valor)
+
+def _upsert(conexao, tabela, registros):
+    """
+    INSERT ... ON CONFLICT/ON DUPLICATE KEY somando os deltas à linha existente.
+    Devolve False se o banco não tiver upsert (quem chama recalcula o grupo).
+    """
+    dialeto = conexao.dialect.name
+    if dialeto in ('sqlite', 'postgresql'):
+        comando = (sqlite if dialeto == 'sqlite' else postgresql).insert(tabela)
+        novo = comando.excluded
+    elif dialeto in ('mysql', 'mariadb'):
+        comando = mysql.insert(tabela)
+        novo = comando.inserted
+    else:
+        return False
+    atual = tabela.c
+    # NULL em 'novo' (só saídas, ou valores não informados) mantém o que já estava
+    valores = dict(
+        quantidade=atual.quantidade + novo.quantidade,
+        total=db.case((novo.total.is_(None), atual.total), (atual.total.is_(None), novo.total),
+                      else_=atual.total + novo.total),
+        minimo=db.case((atual.minimo.is_(None), novo.minimo), (novo.minimo < atual.minimo, novo.minimo),
+                       else_=atual.minimo),
+        maximo=db.case((atual.maximo.is_(None), novo.maximo), (novo.maximo > atual.maximo, novo.maximo),
+                       else_=atual.maximo),
+    )
+    if dialeto in ('mysql', 'mariadb'):
+        comando = comando.on_duplicate_key_update(**valores)
+    else:
+        comando = comando.on_conflict_do_update(index_elements=['secretaria_id', 'exercicio', 'mes'], set_=valores)
+    conexao.execute(comando, registros)
+    return True
+
+def recalcular_mes(conexao, chave):
+    """Refaz, a partir das contratações, só a linha (secretaria, exercício, mês) de 'chave'."""
+    tabela = ResumoGasto.__table__
+    secretaria_id, exercicio, mes = chave
+    conexao.execute(tabela.delete().where(tabela.c.secretaria_id == secretaria_id,
+                                          tabela.c.exercicio == exercicio, tabela.c.mes == mes))
+    selecao = _selecao_agregada().where(Contratacao.secretaria_id == secretaria_id, Contratacao.exercicio == exercicio,
+                                        _mes(Contratacao.data_planejada) == mes)
+    conexao.execute(tabela.insert().from_select(COLUNAS_RESUMO, selecao))
+
+def aplicar_deltas(conexao, deltas):
+    """Grava no resumo os deltas de anotar_delta(), na ordem da chave (mesma ordem de travas em todo worker)."""
+    tabela = ResumoGasto.__table__
+    chaves = sorted(deltas)
+    if not chaves:
+        return
+    registros = [dict(secretaria_id=s, exercicio=e, mes=m, quantidade=deltas[(s, e, m)]['quantidade'],
+                      total=deltas[(s, e, m)]['total'], minimo=deltas[(s, e, m)]['minimo'],
+                      maximo=deltas[(s, e, m)]['maximo'])
+                 for s, e, m in chaves]
+    if not _upsert(conexao, tabela, registros):
+        recalcular_grupos(conexao, [chave[:2] for chave in chaves])
+        return
+
+    for chave in chaves:
+        removidos = deltas[chave]['removidos']
+        if not removidos and deltas[chave]['quantidade'] >= 0:
+            continue
+        secretaria_id, exercicio, mes = chave
+        filtro = (tabela.c.secretaria_id == secretaria_id, tabela.c.exercicio == exercicio, tabela.c.mes == mes)
+        linha = conexao.execute(db.select(tabela.c.quantidade, tabela.c.minimo, tabela.c.maximo).where(*filtro)).first()
+        if linha is None:
+            continue
+        if linha.quantidade <= 0:
+            conexao.execute(tabela.delete().where(*filtro))
+        elif removidos and linha.minimo is not None and any(v <= linha.minimo or v >= linha.maximo for v in removidos):
+            recalcular_mes(conexao, chave)
+
+def reconstruir_resumo(conexao):
+    """Refaz a tabela inteira agregando com pandas. Retorna a quantidade de grupos."""
+    import numpy as np
+    import pandas as pd
+
+    resultado = conexao.execute(db.select(
+        Contratacao.secretaria_id, Contratacao.exercicio, Contratacao.data_planejada, Contratacao.valor_estimado))
+    dados = pd.DataFrame(resultado.fetchall(), columns=['secretaria_id', 'exercicio', 'data_planejada', 'valor_estimado'])
+    dados['mes'] = pd.to_datetime(dados['data_planejada']).dt.month.fillna(0).astype(np.int64)
+    dados['valor_estimado'] = dados['valor_estimado'].astype(np.float64)
+    grupos = (dados.groupby(['secretaria_id', 'exercicio', 'mes'])['valor_estimado']
+              .agg(quantidade='size', total=lambda v: v.sum(min_count=1), minimo='min', maximo='max')
+              .reset_index())
+
+    conexao.execute(ResumoGasto.__table__.delete())
+    if len(grupos):
+        # NaN (grupo sem nenhum valor informado) vira NULL, como o SUM/MIN/MAX do banco
+        registros = grupos.astype(object).where(grupos.notna(), None).to_dict('records')
+        conexao.execute(ResumoGasto.__table__.insert(), registros)
+    return len(grupos)
+
+def resumo_gastos(exercicio=None):
+    """
+    Linhas do resumo com o nome da secretaria, já somadas por (secretaria, exercício)
+    e com os meses em 'meses'. Lê só a tabela agregada.
+    """
+    query = (db.session.query(ResumoGasto, Secretaria.nome)
+             .join(Secretaria, Secretaria.id == ResumoGasto.secretaria_id)
+             .order_by(ResumoGasto.exercicio.desc(), Secretaria.nome, ResumoGasto.mes))
+    if exercicio:
+        query = query.filter(ResumoGasto.exercicio == exercicio)
+
+    linhas = {}
+    for grupo, nome in query:
+        linha = linhas.setdefault((grupo.exercicio, grupo.secretaria_id), dict(
+            exercicio=grupo.exercicio, secretaria_id=grupo.secretaria_id, secretaria=nome,
+            quantidade=0, total=None, minimo=None, maximo=None, meses=[]))
+        linha['quantidade'] += grupo.quantidade
+        if grupo.total is not None:
+            linha['total'] = (linha['total'] or 0) + grupo.total
+            linha['minimo'] = grupo.minimo if linha['minimo'] is None else min(linha['minimo'], grupo.minimo)
+            linha['maximo'] = grupo.maximo if linha['maximo'] is None else max(linha['maximo'], grupo.maximo)
+        linha['meses'].append(dict(mes=grupo.mes, quantidade=grupo.quantidade, total=grupo.total,
+                                   minimo=grupo.minimo, maximo=grupo.maximo))
+    return list(linhas.values())
+
+def exercicios_com_resumo():
+    return [e for (e,) in db.session.query(ResumoGasto.exercicio).distinct().order_by(ResumoGasto.exercicio.desc())]
+
+# ----------------------------------------------------------------------------
+# EVENTOS: ANOTA ENTRADAS E SAÍDAS DE CADA GRUPO E APLICA NO FIM DO FLUSH
+# ----------------------------------------------------------------------------
+CAMPOS_RESUMO = ('secretaria_id', 'exercicio', 'data_planejada', 'valor_estimado')
+
+def _deltas_da_sessao(target):
+    session = inspect(target).session
+    return None if session is None else session.info.setdefault('pca_resumo', {})
+
+def _valores_antigos(target):
+    """(secretaria_id, exercicio, data_planejada, valor_estimado) como estavam no banco antes deste flush."""
+    estado = inspect(target)
+    antigos = []
+    for campo in CAMPOS_RESUMO:
+        removido = estado.attrs[campo].history.deleted
+        antigos.append(removido[0] if removido else getattr(target, campo))
+    return antigos
+
+def _carregar_valor_antigo(target, valor, antigo, iniciador):
+    pass  # Só a opção active_history importa
+
+# active_history: ao trocar um destes campos de um objeto expirado (ex: depois
+# de um commit), o SQLAlchemy carrega o valor antigo antes de trocar, e o
+# after_update sabe de qual grupo (e com qual valor) o item saiu.
+for _atributo in (Contratacao.secretaria_id, Contratacao.exercicio, Contratacao.data_planejada, Contratacao.valor_estimado):
+    event.listen(_atributo, 'set', _carregar_valor_antigo, active_history=True)
+
+@event.listens_for(Contratacao, 'after_insert')
+def anotar_entrada_resumo(mapper, connection, target):
+    deltas = _deltas_da_sessao(target)
+    if deltas is not None:
+        anotar_delta(deltas, chave_resumo(target.secretaria_id, target.exercicio, target.data_planejada), target.valor_estimado)
+
+@event.listens_for(Contratacao, 'after_delete')
+def anotar_saida_resumo(mapper, connection, target):
+    deltas = _deltas_da_sessao(target)
+    if deltas is not None:
+        secretaria_id, exercicio, data_planejada, valor = _valores_antigos(target)
+        anotar_delta(deltas, chave_resumo(secretaria_id, exercicio, data_planejada), valor, sinal=-1)
+
+@event.listens_for(Contratacao, 'after_update')
+def anotar_mudanca_resumo(mapper, connection, target):
+    deltas = _deltas_da_sessao(target)
+    if deltas is None:
+        return
+    secretaria_id, exercicio, data_planejada, valor = _valores_antigos(target)
+    chave_antiga = chave_resumo(secretaria_id, exercicio, data_planejada)
+    chave_nova = chave_resumo(target.secretaria_id, target.exercicio, target.data_planejada)
+    if chave_antiga == chave_nova and valor == target.valor_estimado:
+        return  # Mudou só o objeto, a descrição etc.
+    anotar_delta(deltas, chave_antiga, valor, sinal=-1)
+    anotar_delta(deltas, chave_nova, target.valor_estimado)
+
+@event.listens_for(Session, 'after_flush')
+def aplicar_resumo_apos_flush(session, flush_context):
+    deltas = session.info.pop('pca_resumo', None)
+    if deltas:
+        aplicar_deltas(session.connection(), deltas)
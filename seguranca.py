@@ -0,0 +1,181 @@
+import os
+import time
+import secrets
+import tempfile
+import threading
+from collections import deque
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    import fcntl
+except ImportError:  # Fora do Linux/Unix: o teto vale só por processo
+    fcntl = None
+
+# ============================================================================
+# HASH DE SENHAS COM CONCORRÊNCIA LIMITADA + LIMITE DE TENTATIVAS DE LOGIN
+# ============================================================================
+# O hash de senha (scrypt/pbkdf2) é caro de propósito. Feito direto na
+# requisição, uma rajada de logins (ou um ataque de credenciais) ocupava os 3
+# workers e derrubava junto o portal público. Aqui:
+#   - o teto de hashes simultâneos vale para o SERVIDOR inteiro, não por
+#     worker: com workers sync do Gunicorn, um teto por processo não limitava
+#     nada. Cada vaga é um arquivo em PCA_HASH_TRAVAS_DIR preso com flock; se
+#     o worker morrer no meio do hash, o kernel solta a vaga. Sem vaga dentro
+#     de HASH_ESPERA segundos, a requisição recebe SistemaOcupado (503);
+#   - antes de qualquer hash, um limitador em memória (por IP e por login)
+#     recusa quem está tentando demais. Ao contrário das vagas de hash, ele
+#     vale POR PROCESSO: cada worker conta sozinho, então o teto real é
+#     workers x PCA_LOGIN_MAX_*. Segue útil porque as vagas de hash seguram o
+#     custo total; contagem exata exigiria um armazenamento compartilhado.
+#     O IP é o request.remote_addr: atrás de proxy reverso, PCA_PROXIES
+#     (app.py) tem que estar configurado, senão todos os clientes dividem o
+#     IP do proxy e 20 tentativas de qualquer um bloqueiam o login de todos;
+#   - login inexistente também paga um hash (contra um hash fictício): o tempo
+#     de resposta não revela quais logins existem;
+#   - o método do hash é configurável (PCA_HASH_METODO). Hashes antigos
+#     continuam válidos e são refeitos no próximo login com sucesso.
+
+HASH_METODO = os.environ.get('PCA_HASH_METODO', 'scrypt')
+HASH_CONCORRENCIA = int(os.environ.get('PCA_HASH_CONCORRENCIA', 2))
+HASH_FILA = int(os.environ.get('PCA_HASH_FILA', 4))
+HASH_ESPERA = float(os.environ.get('PCA_HASH_ESPERA', 2))   # Segundos aguardando vaga antes de desistir
+HASH_TRAVAS_DIR = os.environ.get('PCA_HASH_TRAVAS_DIR', os.path.join(tempfile.gettempdir(), 'pca_hash'))
+INTERVALO_VAGA = 0.01  # Entre uma rodada e outra de tentativas nas vagas ocupadas
+TAMANHO_MAXIMO_SENHA = 1024  # Senha gigante não merece nem entrar no hash
+
+class SistemaOcupado(Exception):
+    """Todas as vagas de hash do servidor estão ocupadas; o cliente deve tentar de novo."""
+
+class PoolHash:
+    def __init__(self, concorrencia, fila, espera, pasta=HASH_TRAVAS_DIR):
+        self.concorrencia = concorrencia
+        self.espera = espera
+        self.pasta = pasta
+        # Por processo: requisições calculando ou aguardando vaga ao mesmo tempo (threads)
+        self._vagas = threading.BoundedSemaphore(concorrencia + fila)
+        self._vagas_processo = threading.BoundedSemaphore(concorrencia)  # Sem fcntl
+
+    def _obter_vaga(self, limite):
+        """Descritor de uma vaga presa (flock) ou None se o tempo acabou."""
+        if fcntl is None:
+            obtida = self._vagas_processo.acquire(timeout=max(0, limite - time.monotonic()))
+            return self._vagas_processo if obtida else None
+        os.makedirs(self.pasta, exist_ok=True)
+        while True:
+            for numero in range(self.concorrencia):
+                fd = os.open(os.path.join(self.pasta, f'vaga_{numero}.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    os.close(fd)
+            if time.monotonic() >= limite:
+                return None
+            time.sleep(INTERVALO_VAGA)
+
+    def _soltar_vaga(self, vaga):
+        if fcntl is None:
+            vaga.release()
+        else:
+            os.close(vaga)  # Fechar o descritor solta o flock
+
+    def executar(self, funcao, *args):
+        limite = time.monotonic() + self.espera
+        if not self._vagas.acquire(timeout=self.espera):
+            raise SistemaOcupado()
+        try:
+            vaga = self._obter_vaga(limite)
+            if vaga is None:
+                raise SistemaOcupado()
+            try:
+                return funcao(*args)
+            finally:
+                self._soltar_vaga(vaga)
+        finally:
+            self._vagas.release()
+
+pool_hash = PoolHash(HASH_CONCORRENCIA, HASH_FILA, HASH_ESPERA)
+
+_hash_ficticio = {}  # método -> hash de uma senha aleatória (gerado uma vez por processo)
+
+def hash_ficticio():
+    """Hash de mesmo método/custo dos reais, para conferir quando o login não existe."""
+    if HASH_METODO not in _hash_ficticio:
+        _hash_ficticio[HASH_METODO] = pool_hash.executar(generate_password_hash, secrets.token_hex(16), HASH_METODO)
+    return _hash_ficticio[HASH_METODO]
+
+def gerar_hash(senha):
+    return pool_hash.executar(generate_password_hash, senha, HASH_METODO)
+
+def conferir_hash(hash_salvo, senha):
+    """
+    Confere a senha. Vazia ou longa demais é recusada sem gastar um hash. Sem
+    'hash_salvo' (login inexistente), confere contra o hash fictício e recusa:
+    custa o mesmo tempo que uma senha errada.
+    """
+    if not senha or len(senha) > TAMANHO_MAXIMO_SENHA:
+        return False
+    if not hash_salvo:
+        pool_hash.executar(check_password_hash, hash_ficticio(), senha)
+        return False
+    return pool_hash.executar(check_password_hash, hash_salvo, senha)
+
+def precisa_refazer_hash(hash_salvo):
+    """
+    True se o hash foi gerado com outro método/parâmetros que não o configurado
+    agora. Parâmetros omitidos em PCA_HASH_METODO aceitam o padrão do werkzeug
+    ('scrypt' vale para 'scrypt:32768:8:1').
+    """
+    metodo_salvo = (hash_salvo or '').split('$', 1)[0]
+    return not (metodo_salvo == HASH_METODO or metodo_salvo.startswith(HASH_METODO + ':'))
+
+# ----------------------------------------------------------------------------
+# LIMITE DE TENTATIVAS (JANELA DESLIZANTE, EM MEMÓRIA POR PROCESSO)
+# ----------------------------------------------------------------------------
+class Limitador:
+    """Conta eventos por chave numa janela de 'janela' segundos; bloqueia a partir de 'maximo'."""
+
+    def __init__(self, maximo, janela, max_chaves=10000):
+        self.maximo = maximo
+        self.janela = janela
+        self.max_chaves = max_chaves
+        self._eventos = {}
+        self._lock = threading.Lock()
+
+    def _limpar(self, fila, agora):
+        while fila and fila[0] <= agora - self.janela:
+            fila.popleft()
+
+    def bloqueado(self, chave):
+        agora = time.monotonic()
+        with self._lock:
+            fila = self._eventos.get(chave)
+            if not fila:
+                return False
+            self._limpar(fila, agora)
+            return len(fila) >= self.maximo
+
+    def registrar(self, chave):
+        agora = time.monotonic()
+        with self._lock:
+            if chave not in self._eventos and len(self._eventos) >= self.max_chaves:
+                # Memória limitada mesmo sob ataque com muitos IPs: descarta chaves vencidas
+                for antiga in [c for c, f in self._eventos.items() if not f or f[-1] <= agora - self.janela]:
+                    del self._eventos[antiga]
+                if len(self._eventos) >= self.max_chaves:
+                    self._eventos.pop(next(iter(self._eventos)))
+            fila = self._eventos.setdefault(chave, deque())
+            self._limpar(fila, agora)
+            fila.append(agora)
+
+    def liberar(self, chave):
+        with self._lock:
+            self._eventos.pop(chave, None)
+
+    def limpar(self):
+        with self._lock:
+            self._eventos.clear()
+
+# Tentativas de login (qualquer resultado) por IP e falhas por login
+tentativas_por_ip = Limitador(int(os.environ.get('PCA_LOGIN_MAX_POR_IP', 20)), float(os.environ.get('PCA_LOGIN_JANELA', 300)))
+falhas_por_login = Limitador(int(os.environ.get('PCA_LOGIN_MAX_FALHAS', 5)), float(os.environ.get('PCA_LOGIN_JANELA', 300)))
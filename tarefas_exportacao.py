@@ -0,0 +1,165 @@
+import os
+import re
+import json
+import time
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# ============================================================================
+# FILA LOCAL DE TAREFAS DE EXPORTAÇÃO (SEM BROKER EXTERNO)
+# ============================================================================
+# Exportações grandes seguravam um worker síncrono do Gunicorn do início ao fim.
+# Aqui o pedido só registra a tarefa e devolve um id; o arquivo é montado num
+# pool de processos e o cliente acompanha pelo endpoint de status.
+#
+# O estado de cada tarefa fica num JSON na pasta compartilhada, então qualquer
+# worker consegue responder o status e o download, mesmo que a tarefa tenha
+# sido aceita por outro. A fila é limitada por worker (PCA_TAREFAS_MAX_FILA) e
+# a concorrência pelo tamanho do pool (PCA_TAREFAS_CONCORRENCIA). Arquivos
+# prontos expiram após PCA_TAREFAS_TTL segundos: o status já responde "não
+# encontrada" a partir daí, e a varredura que apaga os arquivos roda no
+# máximo a cada 'intervalo_limpeza' segundos, nas submissões (não a cada
+# consulta de status, que o navegador repete enquanto espera).
+
+ID_VALIDO = re.compile(r'^[0-9a-f]{32}$')
+
+# tipo -> (função geradora, extensão). A função recebe (args, caminho_destino).
+# O registro é herdado pelos processos filhos (fork).
+TIPOS_TAREFA = {}
+
+class FilaCheia(Exception):
+    """A fila deste worker atingiu o limite; o cliente deve tentar mais tarde."""
+
+def registrar_tipo(tipo, extensao, funcao):
+    TIPOS_TAREFA[tipo] = (funcao, extensao)
+
+def _gravar_json(caminho, dados):
+    provisorio = f"{caminho}.{os.getpid()}.tmp"
+    with open(provisorio, 'w') as f:
+        json.dump(dados, f)
+    os.replace(provisorio, caminho)
+
+def executar_tarefa(pasta, id_tarefa, tipo, args):
+    """Roda no processo (ou thread) do pool: gera o arquivo e atualiza o status."""
+    caminho_status = os.path.join(pasta, f"{id_tarefa}.json")
+    with open(caminho_status) as f:
+        status = json.load(f)
+    status.update(estado='executando', iniciado_em=time.time())
+    _gravar_json(caminho_status, status)
+
+    funcao, extensao = TIPOS_TAREFA[tipo]
+    destino = os.path.join(pasta, f"{id_tarefa}.{extensao}")
+    try:
+        funcao(args, destino)
+        status.update(estado='concluida', arquivo=os.path.basename(destino), tamanho=os.path.getsize(destino))
+    except Exception as e:
+        print(f"Erro na tarefa de exportação {id_tarefa}: {e}")
+        status.update(estado='erro')
+    status['concluido_em'] = time.time()
+    _gravar_json(caminho_status, status)
+
+class FilaTarefas:
+    def __init__(self, pasta, concorrencia=1, max_fila=4, ttl=3600, modo='processo', intervalo_limpeza=60):
+        self.pasta = pasta
+        self.concorrencia = concorrencia
+        self.max_fila = max_fila
+        self.ttl = ttl
+        self.modo = modo
+        self.intervalo_limpeza = intervalo_limpeza
+        self._ultima_limpeza = 0.0
+        self.inicializador = None   # Chamado em cada processo filho (ex: descartar conexões herdadas)
+        self._executor = None
+        self._pid = None
+        self._pendentes = set()
+        self._lock = threading.Lock()
+
+    def _obter_executor(self):
+        # Criado sob demanda e recriado após um fork: o pool do processo master
+        # (gunicorn --preload) não pode ser reaproveitado pelos workers.
+        if self._executor is None or self._pid != os.getpid():
+            if self.modo == 'thread':
+                self._executor = ThreadPoolExecutor(max_workers=self.concorrencia)
+            else:
+                metodo = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.concorrencia,
+                    mp_context=multiprocessing.get_context(metodo),
+                    initializer=self.inicializador,
+                )
+            self._pid = os.getpid()
+            self._pendentes = set()
+        return self._executor
+
+    def submeter(self, tipo, args):
+        """Registra a tarefa e a coloca no pool. Retorna o id. Levanta FilaCheia se o limite estourou."""
+        if tipo not in TIPOS_TAREFA:
+            raise KeyError(tipo)
+        self.limpar_se_preciso()
+        os.makedirs(self.pasta, exist_ok=True)
+
+        with self._lock:
+            executor = self._obter_executor()
+            if len(self._pendentes) >= self.max_fila:
+                raise FilaCheia()
+
+            id_tarefa = uuid.uuid4().hex
+            _gravar_json(os.path.join(self.pasta, f"{id_tarefa}.json"),
+                         dict(id=id_tarefa, tipo=tipo, estado='na_fila', criado_em=time.time()))
+            futuro = executor.submit(executar_tarefa, self.pasta, id_tarefa, tipo, dict(args))
+            self._pendentes.add(futuro)
+        futuro.add_done_callback(self._finalizar)
+        return id_tarefa
+
+    def _finalizar(self, futuro):
+        with self._lock:
+            self._pendentes.discard(futuro)
+
+    def status(self, id_tarefa):
+        """Dicionário de status da tarefa, ou None se o id não existir (ou já tiver expirado)."""
+        if not ID_VALIDO.match(id_tarefa or ''):
+            return None
+        try:
+            with open(os.path.join(self.pasta, f"{id_tarefa}.json")) as f:
+                status = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return None if self._expirada(status) else status
+
+    def _expirada(self, status):
+        # Tarefa sem conclusão (worker morto no meio) expira a partir da criação
+        referencia = status.get('concluido_em') or status.get('criado_em')
+        return bool(referencia) and referencia < time.time() - self.ttl
+
+    def caminho_arquivo(self, status):
+        return os.path.join(self.pasta, status['arquivo'])
+
+    def limpar_se_preciso(self):
+        """Roda limpar_expiradas() se a última varredura deste processo tiver mais de 'intervalo_limpeza' segundos."""
+        agora = time.monotonic()
+        if agora - self._ultima_limpeza >= self.intervalo_limpeza:
+            self._ultima_limpeza = agora
+            self.limpar_expiradas()
+
+    def limpar_expiradas(self):
+        """Apaga status e arquivos de tarefas finalizadas (ou abandonadas) há mais de 'ttl' segundos."""
+        try:
+            nomes = os.listdir(self.pasta)
+        except FileNotFoundError:
+            return
+        for nome in nomes:
+            if not nome.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.pasta, nome)) as f:
+                    status = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            if self._expirada(status):
+                for arquivo in (nome, status.get('arquivo')):
+                    if arquivo:
+                        try:
+                            os.remove(os.path.join(self.pasta, arquivo))
+                        except FileNotFoundError:
+                            pass
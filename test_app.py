@@ -1,16 +1,32 @@
 import os
+import re
+import gzip
+import tempfile
 os.environ['AMBIENTE_DE_TESTE'] = 'True'
+os.environ['PCA_CACHE_EXPORTACAO_DIR'] = tempfile.mkdtemp(prefix='pca_teste_cache_')
+os.environ['PCA_TAREFAS_DIR'] = tempfile.mkdtemp(prefix='pca_teste_tarefas_')
+os.environ['PCA_TAREFAS_MODO'] = 'thread' # O SQLite em memória não é visível para outros processos
 
 import pytest
 from datetime import date
 from werkzeug.security import generate_password_hash
 from app import app, db, Ente, Secretaria, Usuario, Contratacao, formatar_moeda
+from seguranca import tentativas_por_ip, falhas_por_login
+from instrumentacao import impressao_digital
+from prometheus_client import REGISTRY
+from estaticos import estaticos, construir as construir_estaticos
+from busca import indice_busca
 
 @pytest.fixture
 def client():
     app.config['TESTING'] = True
     app.config['WTF_CSRF_ENABLED'] = False 
     app.config['MAIL_SUPPRESS_SEND'] = True
+    app.config['BOOTSTRAP_AUTOMATICO'] = False # A base de cada teste é montada abaixo, não pelo bootstrap
+    app.config['EMAIL_ENVIO_AUTOMATICO'] = False # A caixa de saída é esvaziada pelos próprios testes
+    # Todos os testes logam do mesmo IP: o limite de tentativas recomeça a cada teste
+    tentativas_por_ip.limpar()
+    falhas_por_login.limpar()
 
     with app.test_client() as client:
         with app.app_context():
@@ -19,9 +35,10 @@ def client():
                 raise RuntimeError("⚠️ ALERTA DE SEGURANÇA: O teste tentou conectar em um banco real. Abortando!")
             
             # --- A SOLUÇÃO DEFINITIVA ---
-            # Apaga o "admin" que o app.py criou na memória e cria uma base limpa só para o teste
+            # Cria uma base limpa só para o teste
             db.drop_all()
             db.create_all()
+            indice_busca.descartar()  # Base nova: o índice de busca em memória recomeça do zero
             
             # 1. Cria a Secretaria e o Ente
             ente_teste = Ente(nome="Prefeitura Teste")
@@ -176,4 +193,1407 @@ def test_reset_de_senha_via_token(client):
     # Simula o usuário clicando no link do e-mail (GET) e salvando a senha nova (POST)
     client.get(f'/admin/resetar/{token}')
     resposta = client.post(f'/admin/resetar/{token}', data={'nova_senha': '789', 'confirma_senha': '789'}, follow_redirects=True)
-    assert b"redefinida com sucesso" in resposta.data
\ No newline at end of file
+    assert b"redefinida com sucesso" in resposta.data
+
+# =========================================================================
+# BLOCO 12: PAGINAÇÃO POR CURSOR NA CONSULTA PÚBLICA
+# =========================================================================
+
+def test_home_paginacao_keyset(client):
+    """Percorre a listagem pública página a página usando os cursores da URL"""
+    with app.app_context():
+        for i in range(4):
+            db.session.add(Contratacao(exercicio=2025 + (i % 2), objeto=f"Item {i}", valor_estimado=10.0, secretaria_id=1))
+        db.session.commit()
+
+    primeira = client.get('/?por_pagina=2')
+    assert b"5 contrata" in primeira.data
+    assert b"Item 0" in primeira.data and b"Item 2" in primeira.data
+    assert b"apos=2025." in primeira.data and b"antes=" not in primeira.data
+
+    segunda = client.get('/?por_pagina=2&apos=2025.4')
+    assert b"Notebooks" in segunda.data and b"Item 1" in segunda.data
+    assert b"antes=2026.1" in segunda.data and b"apos=2026.3" in segunda.data
+
+    anterior = client.get('/?por_pagina=2&antes=2026.1')
+    assert b"Item 0" in anterior.data and b"Item 2" in anterior.data
+    assert b"Item 1" not in anterior.data
+
+
+# =========================================================================
+# BLOCO 13: SEM N+1 NAS LISTAGENS (NÚMERO FIXO DE SQL POR REQUISIÇÃO)
+# =========================================================================
+
+def contar_sql(client, url):
+    """Faz a requisição (com cache já aquecido e sessão limpa) e devolve quantos comandos SQL foram executados."""
+    from sqlalchemy import event
+    comandos = []
+    def registrar(conn, cursor, statement, *args):
+        comandos.append(statement)
+    client.get(url)
+    db.session.remove()
+    event.listen(db.engine, 'before_cursor_execute', registrar)
+    try:
+        assert client.get(url).status_code == 200
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', registrar)
+    return len(comandos)
+
+def test_listagens_sem_n_mais_1(client):
+    """A quantidade de SQL por rota não pode crescer com o número de linhas/secretarias"""
+    client.post('/admin/login', data={'login': 'admin', 'senha': 'senha_segura_123'}, follow_redirects=True)
+    rotas = ['/', '/exportar/excel', '/exportar/pdf', '/admin/dashboard', '/admin/api/contratacoes']
+
+    def semear(inicio, quantidade):
+        with app.app_context():
+            for i in range(inicio, inicio + quantidade):
+                sec = Secretaria(nome=f"Secretaria {i}")
+                db.session.add(sec)
+                db.session.flush()
+                db.session.add_all([Contratacao(exercicio=2026, objeto=f"Obj {i}-{j}", valor_estimado=1.0, secretaria_id=sec.id) for j in range(3)])
+            db.session.commit()
+
+    # Sem o cache em disco: as exportações precisam ser geradas (e consultadas) de verdade
+    app.config['CACHE_EXPORTACAO'] = False
+    try:
+        semear(0, 10)
+        com_n = {rota: contar_sql(client, rota) for rota in rotas}
+        semear(10, 10)
+        com_2n = {rota: contar_sql(client, rota) for rota in rotas}
+    finally:
+        app.config['CACHE_EXPORTACAO'] = True
+    assert com_2n == com_n
+    assert all(com_n.values())
+
+
+# =========================================================================
+# BLOCO 14: CACHE DOS DADOS GLOBAIS (ENTE + ÚLTIMA ATUALIZAÇÃO)
+# =========================================================================
+
+def test_cache_global_invalida_no_commit_local(client):
+    """Alteração feita neste processo aparece na próxima página, sem esperar a janela"""
+    from cache_global import cache_global
+    cache_global.janela = 3600
+    try:
+        assert b"Prefeitura Teste" in client.get('/').data
+        client.post('/admin/login', data={'login': 'admin', 'senha': 'senha_segura_123'}, follow_redirects=True)
+        client.post('/admin/configuracoes', data={'nome': 'Prefeitura Renomeada', 'endereco': 'X', 'telefone': '1', 'email': 'x@x.com'})
+        assert b"Prefeitura Renomeada" in client.get('/').data
+    finally:
+        cache_global.janela = 5
+
+def test_cache_global_respeita_versao_de_outro_worker(client):
+    """Escrita de outro worker (só o contador muda) é percebida quando a janela vence"""
+    from cache_global import cache_global
+    from models import incrementar_versao_dados
+    cache_global.janela = 3600
+    try:
+        client.get('/')
+        # UPDATE direto (Core) não dispara os eventos do ORM: simula o que outro processo faria
+        db.session.execute(Ente.__table__.update().values(nome='Prefeitura de Outro Worker'))
+        incrementar_versao_dados(db.session.connection())
+        db.session.commit()
+        assert b"Prefeitura de Outro Worker" not in client.get('/').data
+        cache_global.janela = 0
+        assert b"Prefeitura de Outro Worker" in client.get('/').data
+    finally:
+        cache_global.janela = 5
+
+
+# =========================================================================
+# BLOCO 15: EXCEL EM MODO STREAMING (MEMÓRIA CONSTANTE)
+# =========================================================================
+
+def test_excel_streaming_igual_ao_modo_em_memoria(client):
+    """Os dois modos de exportação precisam gerar exatamente as mesmas células"""
+    import io
+    import openpyxl
+
+    def celulas(conteudo):
+        ws = openpyxl.load_workbook(io.BytesIO(conteudo)).active
+        return [[c.value for c in linha] for linha in ws.iter_rows()], ws['G6'].number_format, ws.merged_cells.ranges
+
+    app.config['CACHE_EXPORTACAO'] = False
+    try:
+        streaming = client.get('/exportar/excel?exercicio=2026').data
+        app.config['EXCEL_STREAMING'] = False
+        em_memoria = client.get('/exportar/excel?exercicio=2026').data
+    finally:
+        app.config['EXCEL_STREAMING'] = True
+        app.config['CACHE_EXPORTACAO'] = True
+
+    assert celulas(streaming)[:2] == celulas(em_memoria)[:2]
+    assert sorted(map(str, celulas(streaming)[2])) == sorted(map(str, celulas(em_memoria)[2]))
+    valores, formato, _ = celulas(streaming)
+    assert valores[5][0].startswith('PCA-1.2026') and valores[5][6] == 5000.0
+    assert formato == 'R$ #,##0.00'
+
+
+# =========================================================================
+# BLOCO 16: DADOS ABERTOS EM STREAMING (CSV E NDJSON)
+# =========================================================================
+
+def test_exportar_csv_respeita_filtros(client):
+    """O CSV sai em streaming com cabeçalho e só as linhas do filtro"""
+    import csv, io
+    with app.app_context():
+        db.session.add(Contratacao(exercicio=2025, objeto="Cadeiras, mesas", valor_estimado=99.9, secretaria_id=1))
+        db.session.commit()
+
+    resposta = client.get('/exportar/csv?exercicio=2025')
+    assert resposta.status_code == 200 and resposta.is_streamed
+    assert resposta.mimetype == 'text/csv'
+    linhas = list(csv.DictReader(io.StringIO(resposta.get_data(as_text=True))))
+    assert len(linhas) == 1
+    assert linhas[0]['objeto'] == "Cadeiras, mesas" and linhas[0]['secretaria'] == "Secretaria de Teste"
+
+def test_exportar_ndjson(client):
+    """Cada linha do NDJSON é um objeto JSON completo"""
+    import json
+    resposta = client.get('/exportar/ndjson')
+    assert resposta.status_code == 200
+    registros = [json.loads(l) for l in resposta.get_data(as_text=True).splitlines()]
+    assert registros[0]['objeto'] == "Notebooks"
+    assert registros[0]['data_planejada'] == "2026-01-01" and registros[0]['valor_estimado'] == 5000.0
+
+def test_exportacoes_com_secretaria_invalida_nao_dao_erro(client):
+    """?secretaria=abc não vira 500 (nem antes do primeiro byte do streaming): o filtro só não casa nada"""
+    for url in ('/exportar/csv', '/exportar/ndjson', '/exportar/pdf', '/exportar/excel', '/exportar/impressao'):
+        resposta = client.get(url + '?secretaria=abc')
+        assert resposta.status_code == 200, url
+        resposta.get_data()
+
+def test_links_de_exportacao_so_repassam_filtros(client):
+    """Parâmetros que não são filtros (formato, _external, cursores) não quebram a home nem vão para os links"""
+    resposta = client.get('/?formato=csv&_external=1&apos=2026.1&exercicio=2026&busca=note')
+    assert resposta.status_code == 200
+    html = resposta.get_data(as_text=True)
+    links = re.findall(r'href="(/exportar/(?:csv|ndjson|impressao)[^"]*)"', html)
+    assert len(links) == 3
+    for link in links:
+        assert 'exercicio=2026' in link and 'busca=note' in link
+        assert 'formato' not in link and '_external' not in link and 'apos' not in link
+
+
+# =========================================================================
+# BLOCO 17: CACHE EM DISCO DAS EXPORTAÇÕES
+# =========================================================================
+
+def test_cache_exportacao_reaproveita_arquivo_ate_os_dados_mudarem(client):
+    """Segundo pedido igual não consulta as contratações; uma edição gera arquivo novo"""
+    url = '/exportar/excel?secretaria=Todas&exercicio=2026'
+    primeira = client.get(url).data
+    assert contar_sql(client, url) <= 1  # no máximo a conferência da versão dos dados
+    assert client.get('/exportar/excel?exercicio=2026&secretaria=').data == primeira  # mesmos filtros normalizados
+
+    client.post('/admin/login', data={'login': 'admin', 'senha': 'senha_segura_123'}, follow_redirects=True)
+    client.post('/admin/editar/contratacao/1', data={'exercicio': '2026', 'objeto': 'Monitores', 'descricao': 'TI', 'valor': '10', 'dotacao': '1', 'data': '2026-01-01', 'secretaria_id': '1'})
+    assert b"Monitores" in texto_pdf(client.get('/exportar/pdf?exercicio=2026').data)
+    assert client.get(url).data != primeira
+
+def test_cache_exportacao_poda_lru_por_tamanho(tmp_path):
+    """Ao passar do limite, os arquivos usados há mais tempo são removidos primeiro"""
+    from cache_exportacao import CacheExportacao
+    cache = CacheExportacao(str(tmp_path), limite_bytes=35)
+    for i, chave in enumerate(['a', 'b', 'c']):
+        cache.gravar(chave, 'bin', lambda f: f.write(b'x' * 10)).close()
+        os.utime(tmp_path / f"{chave}.bin", (1000 + i, 1000 + i))
+    cache.abrir('a', 'bin').close()  # 'a' volta a ser o mais recente
+    cache.gravar('d', 'bin', lambda f: f.write(b'x' * 10)).close()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.bin', 'c.bin', 'd.bin']
+
+
+# =========================================================================
+# BLOCO 18: EXPORTAÇÕES EM SEGUNDO PLANO (FILA DE TAREFAS)
+# =========================================================================
+
+def test_tarefa_exportacao_excel_ate_o_download(client):
+    """Aceita a tarefa (202), acompanha o status e baixa a planilha pronta"""
+    import time
+    app.config['PDF_MAX_LINHAS'] = 0  # Só exportações grandes vão para a fila
+    try:
+        resposta = client.post('/exportar/tarefas', data={'tipo': 'excel', 'exercicio': '2026'})
+    finally:
+        app.config['PDF_MAX_LINHAS'] = 5000
+    assert resposta.status_code == 202
+
+    for _ in range(100):
+        status = client.get(resposta.json['url_status']).json
+        if status['estado'] in ('concluida', 'erro'):
+            break
+        time.sleep(0.05)
+    assert status['estado'] == 'concluida'
+
+    download = client.get(status['url_download'])
+    assert download.status_code == 200 and download.data[:2] == b'PK'
+
+def test_tarefa_exportacao_fila_cheia_e_id_invalido(client):
+    """Fila lotada responde 503 (com Retry-After) e ids desconhecidos dão 404"""
+    from app import fila_tarefas
+    fila_tarefas.max_fila = 0
+    app.config['PDF_MAX_LINHAS'] = 0
+    try:
+        resposta = client.post('/exportar/tarefas', data={'tipo': 'excel'})
+        assert resposta.status_code == 503 and resposta.headers['Retry-After']
+    finally:
+        fila_tarefas.max_fila = 4
+        app.config['PDF_MAX_LINHAS'] = 5000
+    assert client.get('/exportar/tarefas/../../etc/passwd').status_code == 404
+    assert client.get('/exportar/tarefas/' + 'f' * 32).status_code == 404
+
+def test_tarefa_exportacao_pequena_ou_em_cache_vai_direto(client):
+    """Exportação pequena ou já no cache não ocupa o pool: 303 para o download direto, e o segundo clique não cria tarefa"""
+    import time
+    import shutil
+    from app import fila_tarefas, cache_exportacao
+    # A versão dos dados recomeça a cada teste: arquivos de outros testes acertariam a mesma chave
+    shutil.rmtree(cache_exportacao.pasta, ignore_errors=True)
+    dados = {'tipo': 'excel', 'exercicio': '2026', 'busca': 'Notebooks'}
+
+    resposta = client.post('/exportar/tarefas', data=dados)
+    assert resposta.status_code == 303
+    assert resposta.headers['Location'] == '/exportar/excel?exercicio=2026&busca=Notebooks'
+
+    def tarefas_criadas():
+        return len([nome for nome in os.listdir(fila_tarefas.pasta) if nome.endswith('.json')])
+
+    app.config['PDF_MAX_LINHAS'] = 0
+    try:
+        antes = tarefas_criadas()
+        resposta = client.post('/exportar/tarefas', data={'tipo': 'excel', 'exercicio': '2026'})
+        assert resposta.status_code == 202
+        for _ in range(100):
+            if client.get(resposta.json['url_status']).json['estado'] in ('concluida', 'erro'):
+                break
+            time.sleep(0.05)
+        assert tarefas_criadas() == antes + 1
+
+        # A tarefa publicou o arquivo no cache: o segundo clique baixa direto
+        segundo = client.post('/exportar/tarefas', data={'tipo': 'excel', 'exercicio': '2026'})
+    finally:
+        app.config['PDF_MAX_LINHAS'] = 5000
+    assert segundo.status_code == 303 and tarefas_criadas() == antes + 1
+    download = client.get(segundo.headers['Location'])
+    assert download.status_code == 200 and download.data[:2] == b'PK'
+
+def _tarefa_grava_pid(args, destino):
+    with open(destino, 'w') as f:
+        f.write(f"{os.getpid()} {args['exercicio']}")
+
+def test_tarefa_em_processo_filho(tmp_path):
+    """No modo de produção (pool de processos por fork) a tarefa roda fora do worker e o status é visível"""
+    import time
+    from tarefas_exportacao import FilaTarefas, registrar_tipo
+    registrar_tipo('teste_pid', 'txt', _tarefa_grava_pid)
+    fila = FilaTarefas(str(tmp_path), modo='processo')
+    try:
+        id_tarefa = fila.submeter('teste_pid', {'exercicio': '2026'})
+        for _ in range(200):
+            status = fila.status(id_tarefa)
+            if status['estado'] in ('concluida', 'erro'):
+                break
+            time.sleep(0.05)
+        assert status['estado'] == 'concluida'
+        pid, exercicio = open(fila.caminho_arquivo(status)).read().split()
+        assert int(pid) != os.getpid() and exercicio == '2026'
+    finally:
+        fila._obter_executor().shutdown(wait=True)
+
+def test_tarefa_expirada_some_sem_varredura(tmp_path):
+    """O status já trata a tarefa vencida como inexistente; a varredura dos arquivos fica para a submissão"""
+    import json, time
+    from tarefas_exportacao import FilaTarefas
+    fila = FilaTarefas(str(tmp_path), ttl=10, modo='thread')
+    id_tarefa = 'a' * 32
+    (tmp_path / f'{id_tarefa}.json').write_text(json.dumps(dict(id=id_tarefa, estado='concluida', concluido_em=time.time() - 60)))
+    assert fila.status(id_tarefa) is None
+    assert (tmp_path / f'{id_tarefa}.json').exists()
+    fila.limpar_se_preciso()
+    assert not (tmp_path / f'{id_tarefa}.json').exists()
+
+
+# =========================================================================
+# BLOCO 19: RELATÓRIO PDF NATIVO (REPORTLAB)
+# =========================================================================
+
+def texto_pdf(dados):
+    """Conteúdo das páginas do PDF (streams do ReportLab em ASCII85 + Flate), uma página por item"""
+    import base64, zlib
+    paginas = []
+    for stream in re.findall(rb'stream\r?\n(.*?)endstream', dados, re.S):
+        try:
+            paginas.append(zlib.decompress(base64.a85decode(stream.strip().removesuffix(b'~>'))))
+        except ValueError:
+            continue
+    return b'\n'.join(paginas)
+
+def test_exportar_pdf_nativo_multiplas_paginas(client):
+    """O PDF é gerado no servidor, com várias páginas quando há muitas linhas"""
+    with app.app_context():
+        sec = Secretaria.query.first()
+        db.session.add_all([
+            Contratacao(exercicio=2026, objeto=f"Item de teste {i}", valor_estimado=10.0, secretaria_id=sec.id)
+            for i in range(120)
+        ])
+        db.session.commit()
+
+    resposta = client.get('/exportar/pdf?exercicio=2026')
+    assert resposta.status_code == 200
+    assert resposta.mimetype == 'application/pdf'
+    assert resposta.data.startswith(b'%PDF')
+    assert len(re.findall(rb'/Type /Page\b', resposta.data)) > 1
+    texto = texto_pdf(resposta.data)
+    assert b'(Item de teste 0)' in texto and b'(Item de teste 119)' in texto  # primeira e última página
+    assert b'(Total: 121 item\\(ns\\))' in texto
+
+def test_exportar_pdf_grande_vai_para_fila(client):
+    """Acima de PDF_MAX_LINHAS o PDF não é desenhado no worker: o pedido vira tarefa e o arquivo sai pela fila"""
+    import time
+    app.config['PDF_MAX_LINHAS'] = 0
+    try:
+        resposta = client.get('/exportar/pdf?exercicio=2026')
+    finally:
+        app.config['PDF_MAX_LINHAS'] = 5000
+    assert resposta.status_code == 202 and resposta.headers['Location'] == resposta.json['url_status']
+
+    for _ in range(100):
+        status = client.get(resposta.json['url_status']).json
+        if status['estado'] in ('concluida', 'erro'):
+            break
+        time.sleep(0.05)
+    assert status['estado'] == 'concluida'
+    assert client.get(status['url_download']).data.startswith(b'%PDF')
+
+def test_versao_para_impressao_continua_disponivel(client):
+    """A antiga página HTML de impressão pelo navegador segue em /exportar/impressao"""
+    resposta = client.get('/exportar/impressao?exercicio=2026')
+    assert resposta.status_code == 200
+    assert b"Notebooks" in resposta.data
+
+
+# =========================================================================
+# BLOCO 20: IMPORTAÇÃO EM LOTE (XLSX / CSV)
+# =========================================================================
+
+def test_sanitizar_valor_formatos_aceitos():
+    """A regra do formulário (Lei de Postel) vale também para a importação"""
+    from importacao import sanitizar_valor
+    assert sanitizar_valor('R$ 1.000,50') == 1000.5
+    assert sanitizar_valor('1000,50') == 1000.5
+    assert sanitizar_valor('1000.50') == 1000.5
+    assert sanitizar_valor(42) == 42.0
+    with pytest.raises(ValueError):
+        sanitizar_valor('mil reais')
+
+def test_importar_csv_com_erros_por_linha(client):
+    """Linhas válidas entram com código gerado; as inválidas são relatadas sem abortar o lote"""
+    import io
+    client.post('/admin/login', data={'login': 'admin', 'senha': 'senha_segura_123'})
+    planilha = (
+        "Exercício;Secretaria;Objeto;Data Planejada;Dotação;Valor Estimado\n"
+        "2026;Secretaria de Teste;Cadeiras;15/03/2026;02.01;R$ 1.500,00\n"
+        "2026;Secretaria Inexistente;Mesas;;;100\n"
+        "2027;1;Projetores;2027-01-10;;2.000,00\n"
+        "abc;1;Lousas;;;10\n"
+        "2026;1;Canetas;;;dez reais\n"
+    ).encode('utf-8')
+    resposta = client.post('/admin/importar/contratacoes', data={'planilha': (io.BytesIO(planilha), 'pca.csv')},
+                           content_type='multipart/form-data', follow_redirects=True)
+    assert "2 item(ns) cadastrado(s), 3 linha(s) com erro".encode() in resposta.data
+    assert b"Linha 3" in resposta.data and b"Linha 5" in resposta.data
+
+    with app.app_context():
+        cadeiras = Contratacao.query.filter_by(objeto='Cadeiras').one()
+        assert cadeiras.valor_estimado == 1500.0 and cadeiras.data_planejada == date(2026, 3, 15)
+        assert cadeiras.codigo_identificador == f"PCA-{cadeiras.id}.2026-1"
+        assert Contratacao.query.filter_by(objeto='Projetores').one().codigo_identificador.endswith('.2027-1')
+        assert Contratacao.query.filter_by(objeto='Mesas').first() is None
+
+@pytest.mark.parametrize('codificacao', ['cp1252', 'latin-1', 'utf-8'])
+def test_importar_csv_salvo_pelo_excel_em_ansi(client, codificacao):
+    """CSV fora do UTF-8 (o "ANSI" do Excel brasileiro) é importado com os acentos intactos"""
+    import io
+    client.post('/admin/login', data={'login': 'admin', 'senha': 'senha_segura_123'})
+    planilha = (
+        "Exercício;Secretaria;Objeto;Dotação;Valor Estimado\n"
+        "2026;Secretaria de Teste;Manutenção de ar-condicionado – sede;02.01;R$ 1.500,00\n"
+    )
+    if codificacao == 'latin-1':
+        planilha = planilha.replace('–', '-')  # travessão não existe no latin-1
+    resposta = client.post('/admin/importar/contratacoes',
+                           data={'planilha': (io.BytesIO(planilha.encode(codificacao)), 'pca.csv')},
+                           content_type='multipart/form-data', follow_redirects=True)
+    assert "1 item(ns) cadastrado(s)".encode() in resposta.data
+    with app.app_context():
+        assert Contratacao.query.filter(Contratacao.objeto.like('Manutenção de ar-condicionado %')).one().dotacao == '02.01'
+
+def test_importar_xlsx_exportado_pelo_portal(client):
+    """A planilha exportada (com título acima da tabela) pode ser reimportada"""
+    import io
+    exportada = client.get('/exportar/excel').data
+    client.post('/admin/login', data={'login': 'comum', 'senha': 'senha_segura_123'})
+    client.post('/admin/importar/contratacoes', data={'planilha': (io.BytesIO(exportada), 'pca.xlsx')},
+                content_type='multipart/form-data')
+    with app.app_context():
+        assert Contratacao.query.filter_by(objeto='Notebooks').count() == 2
+        assert Contratacao.query.filter(Contratacao.codigo_identificador.is_(None)).count() == 0
+
+def test_importar_usuario_comum_nao_importa_para_outra_secretaria(client):
+    """RBAC: usuário comum não consegue gravar itens em outra secretaria pela planilha"""
+    import io
+    with app.app_context():
+        db.session.add(Secretaria(nome="Outra Secretaria"))
+        db.session.commit()
+    client.post('/admin/login', data={'login': 'comum', 'senha': 'senha_segura_123'})
+    planilha = "exercicio,secretaria,objeto,valor\n2026,Outra Secretaria,Tablets,10\n".encode('utf-8')
+    client.post('/admin/importar/contratacoes', data={'planilha': (io.BytesIO(planilha), 'pca.csv')},
+                content_type='multipart/form-data')
+    with app.app_context():
+        assert Contratacao.query.filter_by(objeto='Tablets').first() is None
+
+
+# =========================================================================
+# BLOCO 21: CÓDIGO IDENTIFICADOR GERADO EM CONJUNTO
+# =========================================================================
+
+def test_codigo_gerado_com_um_update_por_insert(client):
+    """Vários itens no mesmo flush custam um único UPDATE (antes era um por linha)"""
+    from sqlalchemy import event
+    comandos = []
+    contar = lambda conn, cursor, sql, *a: comandos.append(sql)
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', contar)
+        try:
+            novos = [Contratacao(exercicio=2027, objeto=f"Lote {i}", valor_estimado=1.0, secretaria_id=1) for i in range(5)]
+            db.session.add_all(novos)
+            db.session.flush()
+            # O valor já está no objeto antes do commit, sem nova consulta
+            assert [c.codigo_identificador for c in novos] == [f"PCA-{c.id}.2027-1" for c in novos]
+            db.session.commit()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', contar)
+        assert sum(1 for sql in comandos if sql.startswith('UPDATE contratacoes')) == 1
+
+def test_codigo_gerado_em_insert_em_massa_igual_ao_formato_oficial(client):
+    """insert().values([...]) também recebe código, no mesmo formato do Python"""
+    from models import codigo_identificador
+    with app.app_context():
+        db.session.execute(Contratacao.__table__.insert().values([
+            dict(exercicio=2028, objeto=f"Massa {i}", valor_estimado=1.0, secretaria_id=1) for i in range(3)
+        ]))
+        db.session.commit()
+        for c in Contratacao.query.all():
+            assert c.codigo_identificador == codigo_identificador(c.id, c.exercicio, c.secretaria_id)
+
+
+@pytest.mark.parametrize('executemany_returning', [True, False])
+def test_codigo_gerado_so_nas_linhas_do_insert(client, executemany_returning):
+    """O UPDATE dos códigos vai pelos ids recém-criados, também sem RETURNING em executemany (caso do MySQL)"""
+    import io
+    from sqlalchemy import event, text
+    from importacao import importar_contratacoes, ler_planilha
+    dialeto = db.engine.dialect
+    flags = ('insert_executemany_returning', 'insert_executemany_returning_sort_by_parameter_order')
+    originais = {flag: getattr(dialeto, flag) for flag in flags}
+    comandos = []
+    contar = lambda conn, cursor, sql, *a: comandos.append(sql)
+    with app.app_context():
+        # Linha de "outra transação" ainda sem código: nenhum UPDATE deste teste pode alcançá-la
+        db.session.execute(text("INSERT INTO contratacoes (exercicio, objeto, valor_estimado, secretaria_id) "
+                                "VALUES (2026, 'Alheia', 1, 1)"))
+        for flag in flags:
+            setattr(dialeto, flag, originais[flag] and executemany_returning)
+        event.listen(db.engine, 'before_cursor_execute', contar)
+        try:
+            db.session.add_all([Contratacao(exercicio=2027, objeto=f"ORM {i}", valor_estimado=1.0, secretaria_id=1) for i in range(3)])
+            db.session.flush()
+            planilha = "exercicio;secretaria;objeto;valor\n" + "".join(f"2028;1;Lote {i};10\n" for i in range(4))
+            inseridos, erros = importar_contratacoes(ler_planilha(io.BytesIO(planilha.encode()), 'pca.csv'), lote=2)
+            db.session.commit()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', contar)
+            for flag, valor in originais.items():
+                setattr(dialeto, flag, valor)
+
+        assert (inseridos, erros) == (4, [])
+        atualizacoes = [sql for sql in comandos if sql.startswith('UPDATE contratacoes') and 'codigo_identificador=' in sql]
+        assert atualizacoes and all('contratacoes.id IN' in sql or 'contratacoes.id BETWEEN' in sql for sql in atualizacoes)
+        assert Contratacao.query.filter_by(objeto='Alheia').one().codigo_identificador is None
+        for c in Contratacao.query.filter(Contratacao.objeto.like('ORM %') | Contratacao.objeto.like('Lote %')):
+            assert c.codigo_identificador == f"PCA-{c.id}.{c.exercicio}-1"
+
+
+# =========================================================================
+# BLOCO 22: BUSCA INDEXADA (CÓDIGO, OBJETO E DESCRIÇÃO)
+# =========================================================================
+
+def test_busca_textual_sem_acento_e_por_prefixo(client):
+    """Todas as palavras precisam aparecer; acentos não importam e a última vale como prefixo"""
+    with app.app_context():
+        db.session.add_all([
+            Contratacao(exercicio=2026, objeto="Aquisição de computadores", descricao="Laboratório de informática", valor_estimado=1.0, secretaria_id=1),
+            Contratacao(exercicio=2026, objeto="Merenda escolar", descricao="Gêneros alimentícios", valor_estimado=1.0, secretaria_id=1),
+        ])
+        db.session.commit()
+    assert b"computadores" in client.get('/?busca=aquisicao+laboratorio').data
+    assert b"computadores" in client.get('/?busca=compu').data
+    resposta = client.get('/?busca=merenda+compu').data
+    assert b"computadores" not in resposta and b"Merenda" not in resposta
+
+def test_busca_acompanha_edicao_e_importacao_em_massa(client):
+    """O índice em memória recebe as alterações da sessão e os INSERTs em massa (pela versão dos dados)"""
+    from cache_global import cache_global
+    assert b"Notebooks" in client.get('/?busca=notebooks').data
+
+    client.post('/admin/login', data={'login': 'admin', 'senha': 'senha_segura_123'})
+    client.post('/admin/editar/contratacao/1', data={'exercicio': '2026', 'objeto': 'Impressoras', 'descricao': 'TI', 'valor': '10', 'dotacao': '1', 'data': '2026-01-01', 'secretaria_id': '1'})
+    assert b"Impressoras" in client.get('/?busca=impressoras').data
+    assert b"Impressoras" not in client.get('/?busca=notebooks').data
+
+    with app.app_context():
+        db.session.execute(Contratacao.__table__.insert(), [dict(exercicio=2026, objeto="Cadeiras giratórias", valor_estimado=1.0, secretaria_id=1)])
+        from models import incrementar_versao_dados
+        incrementar_versao_dados(db.session.connection())
+        db.session.commit()
+    cache_global.invalidar()
+    assert "Cadeiras giratórias".encode() in client.get('/?busca=giratorias').data
+
+def test_busca_ignora_exclusao_de_outro_processo_sem_remontar(client):
+    """DELETE feito fora desta sessão: o id que sobrou no índice em memória não volta como resultado"""
+    from sqlalchemy import text
+    from cache_global import cache_global
+    from models import incrementar_versao_dados
+    assert b"Notebooks" in client.get('/?busca=notebooks').data
+    with app.app_context():
+        db.session.execute(text("DELETE FROM contratacoes WHERE objeto = 'Notebooks'"))
+        incrementar_versao_dados(db.session.connection())
+        db.session.commit()
+    cache_global.invalidar()
+    assert b"Notebooks" not in client.get('/?busca=notebooks').data
+
+def test_busca_fulltext_descarta_palavras_que_o_innodb_nao_indexa():
+    """No MySQL, palavras curtas e stopwords do InnoDB não entram como '+termo' obrigatório (a busca voltaria vazia)"""
+    from busca import termos_fulltext, tokenizar
+    assert termos_fulltext(tokenizar('Manutenção de ar-condicionado')) == '+manutencao +condicionado*'
+    assert termos_fulltext(tokenizar('computadores com TI')) == '+computadores'
+    assert termos_fulltext(tokenizar('merenda compu')) == '+merenda +compu*'
+    assert termos_fulltext(tokenizar('de ti')) is None
+
+def test_filtro_de_codigo_usa_indice_e_nao_like(client):
+    """Código completo vira igualdade e parcial vira faixa de prefixo (nada de LIKE '%...%')"""
+    from busca import filtro_codigo
+    with app.app_context():
+        assert 'LIKE' not in str(filtro_codigo('PCA-1'))
+        assert str(filtro_codigo('pca-1.2026-1')).count('=') == 1
+    assert b"PCA-1.2026-1" in client.get('/?codigo=PCA-1.2026-1').data
+    assert b"PCA-1.2026-1" in client.get('/?codigo=1').data
+    assert b"PCA-1.2026-1" not in client.get('/?codigo=PCA-2').data
+
+
+# =========================================================================
+# BLOCO 23: ÍNDICES COMPOSTOS E MIGRAÇÕES DE ESQUEMA
+# =========================================================================
+
+def planos_de_execucao(client, url):
+    """EXPLAIN QUERY PLAN de cada SELECT em 'contratacoes' que a página executou de verdade."""
+    from sqlalchemy import event
+    from cache_global import cache_global
+    capturadas = []
+    capturar = lambda conn, cursor, sql, params, *a: capturadas.append((sql, params))
+    cache_global.invalidar()  # Para a consulta do rodapé (última atualização) também rodar
+    event.listen(db.engine, 'before_cursor_execute', capturar)
+    try:
+        client.get(url)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capturar)
+    planos = []
+    with app.app_context():
+        for sql, params in capturadas:
+            if sql.startswith('SELECT') and 'FROM contratacoes' in sql:
+                linhas = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+                planos.append((sql, [linha[-1] for linha in linhas]))
+    return planos
+
+def test_consultas_quentes_nao_fazem_varredura_completa(client):
+    """Home (com e sem filtros/cursor), API do painel e rodapé precisam usar índice: falha se voltar a ler a tabela inteira"""
+    with app.app_context():
+        db.session.add_all([Contratacao(exercicio=2025 + i % 3, objeto=f"Item {i}", valor_estimado=1.0, secretaria_id=1) for i in range(30)])
+        db.session.commit()
+    urls = ['/', '/?exercicio=2026', '/?secretaria=1&exercicio=2026', '/?secretaria=1', '/?apos=2026.5', '/?antes=2026.20']
+    planos = [p for url in urls for p in planos_de_execucao(client, url)]
+
+    client.post('/admin/login', data={'login': 'comum', 'senha': 'senha_segura_123'})
+    planos += planos_de_execucao(client, '/admin/api/contratacoes')  # Listagem do painel (carregada sob demanda)
+    assert len(planos) >= 10
+
+    for sql, detalhes in planos:
+        for detalhe in detalhes:
+            assert detalhe != 'SCAN contratacoes', f"Varredura completa em: {sql}"
+            assert 'TEMP B-TREE' not in detalhe, f"Ordenação sem índice em: {sql}"
+        # Com filtro ou cursor, o índice precisa ser usado como busca (SEARCH), não percorrido inteiro
+        if ' WHERE ' in sql and 'count(' not in sql.split(' FROM ')[0]:
+            assert any(d.startswith('SEARCH contratacoes') for d in detalhes), f"Sem SEARCH em: {sql} -> {detalhes}"
+
+def test_migracao_cria_indices_que_faltam_em_base_existente(client):
+    """Base antiga (sem os índices): a migração cria o que falta uma única vez e registra a versão"""
+    from sqlalchemy import inspect, text
+    from migracoes import aplicar_migracoes, schema_versao, MIGRACOES
+    with app.app_context():
+        with db.engine.begin() as conexao:
+            conexao.execute(text('DROP INDEX ix_contratacoes_exercicio_id'))
+            conexao.execute(schema_versao.delete())
+        assert aplicar_migracoes() == [m[0] for m in MIGRACOES]
+        assert aplicar_migracoes() == []
+        nomes = {i['name'] for i in inspect(db.engine).get_indexes('contratacoes')}
+        assert {'ix_contratacoes_exercicio_id', 'ix_contratacoes_secretaria_exercicio_id', 'ix_contratacoes_data_atualizacao'} <= nomes
+
+
+def test_bootstrap_da_primeira_requisicao_nao_migra(client, caplog, monkeypatch):
+    """A primeira requisição cria o que falta mas não roda migração: só avisa no log que há pendências"""
+    import app as modulo_app
+    from migracoes import schema_versao
+    with app.app_context():
+        with db.engine.begin() as conexao:
+            conexao.execute(schema_versao.delete())
+    monkeypatch.setattr(modulo_app, '_banco_inicializado', False)
+    app.config['BOOTSTRAP_AUTOMATICO'] = True
+    assert client.get('/').status_code == 200
+    with app.app_context():
+        with db.engine.connect() as conexao:
+            assert conexao.execute(db.select(db.func.count()).select_from(schema_versao)).scalar() == 0
+    assert "flask migrar" in caplog.text
+
+def test_migracao_nao_segue_sem_a_trava_do_mysql():
+    """GET_LOCK devolvendo 0 (tempo esgotado) ou NULL: tenta de novo e, sem a trava, desiste em vez de migrar"""
+    from migracoes import obter_trava, MigracaoEmAndamento
+
+    class ConexaoFalsa:
+        def __init__(self, respostas):
+            self.respostas = list(respostas)
+        def execute(self, *args):
+            resposta = self.respostas.pop(0)
+            return type('Resultado', (), {'scalar': lambda _: resposta})()
+
+    conexao = ConexaoFalsa([0, None, 1])
+    obter_trava(conexao, tentativas=3)
+    assert conexao.respostas == []
+    with pytest.raises(MigracaoEmAndamento):
+        obter_trava(ConexaoFalsa([0, None]), tentativas=2)
+
+
+# =========================================================================
+# BLOCO 24: GET CONDICIONAL E CACHE HTTP DAS ROTAS PÚBLICAS
+# =========================================================================
+
+def test_rotas_publicas_cacheaveis_e_admin_no_store(client):
+    """Home e exportações: ETag + public/max-age. Área administrativa continua no-store"""
+    for url in ['/', '/exportar/excel', '/exportar/csv', '/exportar/pdf']:
+        resposta = client.get(url)
+        assert resposta.status_code == 200 and resposta.data  # Consome o streaming do CSV
+        assert resposta.headers['ETag'] and resposta.last_modified
+        assert 'public' in resposta.headers['Cache-Control'] and 'max-age' in resposta.headers['Cache-Control']
+        assert 'no-cache' not in resposta.headers['Cache-Control'] and 'Pragma' not in resposta.headers
+
+    assert 'no-store' in client.get('/admin/login').headers['Cache-Control']
+    client.post('/admin/login', data={'login': 'admin', 'senha': 'senha_segura_123'})
+    assert 'no-store' in client.get('/admin/dashboard').headers['Cache-Control']
+    assert 'no-store' in client.get('/').headers['Cache-Control']  # Logado: a home não é cacheada
+
+def test_304_sai_antes_de_qualquer_consulta_pesada(client):
+    """If-None-Match igual devolve 304 sem tocar em 'contratacoes'; qualquer escrita troca a ETag"""
+    from sqlalchemy import event
+    resposta = client.get('/?exercicio=2026')
+    etag = resposta.headers['ETag']
+
+    comandos = []
+    capturar = lambda conn, cursor, sql, *a: comandos.append(sql)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', capturar)
+    try:
+        nao_mudou = client.get('/?exercicio=2026', headers={'If-None-Match': etag})
+        por_data = client.get('/?exercicio=2026', headers={'If-Modified-Since': resposta.headers['Last-Modified']})
+    finally:
+        event.remove(engine, 'before_cursor_execute', capturar)
+    assert nao_mudou.status_code == 304 and not nao_mudou.data
+    assert por_data.status_code == 304
+    assert not [sql for sql in comandos if 'FROM contratacoes' in sql]
+
+    # Outro filtro é outro conteúdo
+    assert client.get('/?exercicio=2025', headers={'If-None-Match': etag}).status_code == 200
+
+    with app.app_context():
+        db.session.get(Contratacao, 1).objeto = 'Tablets'
+        db.session.commit()
+    from cache_global import cache_global
+    cache_global.invalidar()
+    mudou = client.get('/?exercicio=2026', headers={'If-None-Match': etag})
+    assert mudou.status_code == 200 and mudou.headers['ETag'] != etag
+
+
+# =========================================================================
+# BLOCO 25: POOL DE CONEXÕES CONFIGURÁVEL E INSTRUMENTADO
+# =========================================================================
+
+def test_opcoes_do_pool_vem_do_ambiente():
+    """MySQL recebe pre-ping, reciclagem e tamanhos do ambiente; o SQLite fica com o pool padrão"""
+    from pool_banco import opcoes_engine, url_mysql, QueuePoolInstrumentado
+    opcoes = opcoes_engine('mysql+pymysql://u:s@h:3306/b', {'PCA_DB_POOL_SIZE': '8', 'PCA_DB_POOL_RECYCLE': '120'})
+    assert opcoes['poolclass'] is QueuePoolInstrumentado
+    assert opcoes['pool_size'] == 8 and opcoes['pool_recycle'] == 120 and opcoes['pool_pre_ping'] is True
+    assert opcoes_engine('sqlite:///:memory:') == {}
+    assert url_mysql('u', 's', 'h', 3306, 'b', 'mysqlconnector').startswith('mysql+mysqlconnector://')
+    with pytest.raises(ValueError):
+        url_mysql('u', 's', 'h', 3306, 'b', 'mysqldb')
+
+def test_pool_instrumentado_mede_uso_espera_e_timeouts(tmp_path):
+    """Checkout esgotado conta como timeout; conexões em uso e esperas aparecem nas métricas"""
+    from sqlalchemy import create_engine, exc
+    from pool_banco import QueuePoolInstrumentado, metricas_pool
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=QueuePoolInstrumentado,
+                           pool_size=1, max_overflow=0, pool_timeout=0.05)
+    conexao = engine.connect()
+    assert metricas_pool(engine)['em_uso'] == 1
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    metricas = metricas_pool(engine)
+    assert metricas['checkouts'] == 2 and metricas['timeouts'] == 1
+    assert metricas['espera_maxima_ms'] >= 50
+    conexao.close()
+    assert metricas_pool(engine)['em_uso'] == 0
+    engine.dispose()
+
+def test_endpoint_interno_do_pool_restrito(client, monkeypatch):
+    """Só a própria máquina (sem proxy) ou quem tem o token vê as métricas do pool"""
+    assert client.get('/interno/pool').status_code == 200
+    assert client.get('/interno/pool', headers={'X-Forwarded-For': '200.1.2.3'}).status_code == 403
+    monkeypatch.setenv('PCA_METRICAS_TOKEN', 'segredo')
+    remoto = {'REMOTE_ADDR': '200.1.2.3'}
+    assert client.get('/interno/pool', environ_base=remoto).status_code == 403
+    assert client.get('/interno/pool', environ_base=remoto, headers={'X-Token-Metricas': 'segredo'}).status_code == 200
+
+
+# =========================================================================
+# BLOCO 26: BOOTSTRAP FORA DO IMPORT (flask init-db / 1ª REQUISIÇÃO)
+# =========================================================================
+
+def test_init_db_idempotente(client):
+    """O comando init-db cria secretaria padrão e admin numa base vazia, e pode rodar de novo sem duplicar"""
+    db.session.remove()  # Sessão do fixture (o CLI roda no mesmo contexto de aplicação)
+    db.drop_all()
+    for _ in range(2):
+        resultado = app.test_cli_runner().invoke(args=['init-db'])
+        assert resultado.exit_code == 0 and 'Banco de dados pronto' in resultado.output
+    with app.app_context():
+        assert Usuario.query.filter_by(login='admin').count() == 1
+        assert Secretaria.query.filter_by(nome='Secretaria de Administração').count() == 1
+
+def test_bootstrap_automatico_na_primeira_requisicao(client, monkeypatch):
+    """Com o bootstrap automático ligado, a 1ª requisição do processo prepara o banco (uma vez só)"""
+    import app as modulo_app
+    chamadas = []
+    monkeypatch.setattr(modulo_app, 'inicializar_banco', lambda migrar=True: chamadas.append(migrar))
+    monkeypatch.setattr(modulo_app, '_banco_inicializado', False)
+    app.config['BOOTSTRAP_AUTOMATICO'] = True
+    client.get('/')
+    client.get('/')
+    assert chamadas == [False]  # Migrações ficam para o 'flask init-db' / 'flask migrar'
+
+
+def test_enviador_de_email_liga_uma_vez_por_processo(client, monkeypatch):
+    """O before_request só confere um booleano: o enviador de e-mails é ligado na 1ª requisição do worker"""
+    import app as modulo_app
+    chamadas = []
+    monkeypatch.setattr(modulo_app.enviador_email, 'iniciar', lambda: chamadas.append(1))
+    monkeypatch.setattr(modulo_app, '_enviador_iniciado', False)
+    monkeypatch.setitem(app.config, 'EMAIL_ENVIO_AUTOMATICO', True)
+    for _ in range(3):
+        client.get('/')
+    assert chamadas == [1]
+
+# =========================================================================
+# BLOCO 27: HASH DE SENHAS FORA DA REQUISIÇÃO E LIMITE DE TENTATIVAS
+# =========================================================================
+
+def test_login_bloqueado_apos_falhas_sem_calcular_hash(client, monkeypatch):
+    """Depois de N falhas no mesmo login, a próxima tentativa recebe 429 sem chegar ao hash"""
+    import seguranca
+    for _ in range(falhas_por_login.maximo):
+        client.post('/admin/login', data={'login': 'comum', 'senha': 'errada'})
+    chamadas = []
+    monkeypatch.setattr(seguranca.pool_hash, 'executar', lambda *a: chamadas.append(a))
+    resposta = client.post('/admin/login', data={'login': 'comum', 'senha': 'senha_segura_123'})
+    assert resposta.status_code == 429 and 'Retry-After' in resposta.headers
+    assert chamadas == []
+    # Outro login do mesmo IP segue funcionando (o limite por IP é mais folgado)
+    monkeypatch.undo()
+    assert client.post('/admin/login', data={'login': 'admin', 'senha': 'senha_segura_123'}).status_code == 302
+
+def test_limite_por_ip_usa_o_cliente_atras_do_proxy(client, monkeypatch):
+    """Com PCA_PROXIES, o limite por IP conta o cliente do X-Forwarded-For, não o proxy que todos dividem"""
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    monkeypatch.setattr(app, 'wsgi_app', ProxyFix(app.wsgi_app, x_for=1))
+    monkeypatch.setattr(tentativas_por_ip, 'maximo', 2)
+    for i in range(2):
+        client.post('/admin/login', data={'login': f'fantasma{i}', 'senha': 'x'}, headers={'X-Forwarded-For': '200.1.1.1'})
+    bloqueado = client.post('/admin/login', data={'login': 'admin', 'senha': 'senha_segura_123'}, headers={'X-Forwarded-For': '200.1.1.1'})
+    assert bloqueado.status_code == 429
+    outro = client.post('/admin/login', data={'login': 'admin', 'senha': 'senha_segura_123'}, headers={'X-Forwarded-For': '200.2.2.2'})
+    assert outro.status_code == 302
+
+def test_login_inexistente_paga_o_mesmo_hash(client, monkeypatch):
+    """Login desconhecido confere a senha contra um hash fictício (sem oráculo de tempo); senha vazia não gasta hash"""
+    import seguranca
+    chamadas = []
+    executar = seguranca.pool_hash.executar
+    monkeypatch.setattr(seguranca.pool_hash, 'executar', lambda funcao, *a: chamadas.append(funcao.__name__) or executar(funcao, *a))
+    for dados in ({'login': 'fantasma', 'senha': 'qualquer'}, {'login': 'admin', 'senha': ''}):
+        resposta = client.post('/admin/login', data=dados)
+        assert resposta.status_code == 200 and 'Login ou senha incorretos' in resposta.get_data(as_text=True)
+    assert chamadas.count('check_password_hash') == 1
+
+def test_pool_hash_saturado_responde_503(client, monkeypatch, tmp_path):
+    """Sem vaga no pool de hash, o login responde 503 na hora em vez de enfileirar"""
+    import threading
+    import seguranca
+    pool = seguranca.PoolHash(concorrencia=1, fila=0, espera=0.01, pasta=str(tmp_path))
+    monkeypatch.setattr(seguranca, 'pool_hash', pool)
+    liberar = threading.Event()
+    ocupante = threading.Thread(target=pool.executar, args=(liberar.wait,))
+    ocupante.start()
+    try:
+        resposta = client.post('/admin/login', data={'login': 'admin', 'senha': 'senha_segura_123'})
+        assert resposta.status_code == 503 and resposta.headers['Retry-After']
+    finally:
+        liberar.set()
+        ocupante.join()
+
+def _ocupar_vaga_de_hash(pasta, ocupada, liberar):
+    import seguranca
+    seguranca.PoolHash(concorrencia=1, fila=0, espera=1, pasta=pasta).executar(lambda: (ocupada.set(), liberar.wait(10)))
+
+def test_teto_de_hash_vale_entre_processos(tmp_path):
+    """As vagas são do servidor: um hash em outro worker (processo) ocupa a vaga também para este"""
+    import multiprocessing
+    import seguranca
+    contexto = multiprocessing.get_context('fork')
+    ocupada, liberar = contexto.Event(), contexto.Event()
+    outro_worker = contexto.Process(target=_ocupar_vaga_de_hash, args=(str(tmp_path), ocupada, liberar))
+    outro_worker.start()
+    try:
+        assert ocupada.wait(10)
+        pool = seguranca.PoolHash(concorrencia=1, fila=4, espera=0.05, pasta=str(tmp_path))
+        with pytest.raises(seguranca.SistemaOcupado):
+            pool.executar(lambda: None)
+    finally:
+        liberar.set()
+        outro_worker.join(10)
+    assert pool.executar(lambda: 'livre') == 'livre'  # Processo terminou: a vaga voltou
+
+def test_hash_refeito_com_metodo_configurado(client, monkeypatch):
+    """Login com hash de método antigo regrava a senha no método de PCA_HASH_METODO"""
+    import seguranca
+    from werkzeug.security import generate_password_hash as gerar_antigo
+    monkeypatch.setattr(seguranca, 'HASH_METODO', 'pbkdf2:sha256:1000')
+    with app.app_context():
+        usuario = Usuario.query.filter_by(login='comum').first()
+        usuario.senha = gerar_antigo('senha_segura_123', 'pbkdf2:sha256:500')
+        db.session.commit()
+    assert client.post('/admin/login', data={'login': 'comum', 'senha': 'senha_segura_123'}).status_code == 302
+    with app.app_context():
+        usuario = Usuario.query.filter_by(login='comum').first()
+        assert usuario.senha.startswith('pbkdf2:sha256:1000$') and usuario.check_password('senha_segura_123')
+        assert not seguranca.precisa_refazer_hash(usuario.senha)
+
+
+# =========================================================================
+# BLOCO 28: CAIXA DE SAÍDA DE E-MAILS (ENVIO FORA DA REQUISIÇÃO)
+# =========================================================================
+
+def test_esqueci_senha_so_enfileira_e_agrupa_repeticoes(client, monkeypatch):
+    """A requisição não abre conexão SMTP; cliques repetidos viram uma única mensagem com o link mais novo"""
+    import app as modulo_app
+    from models import EmailPendente
+    def smtp_proibido():
+        raise AssertionError('A requisição não deve falar com o SMTP')
+    monkeypatch.setattr(modulo_app.mail, 'connect', smtp_proibido)
+    for _ in range(3):
+        resposta = client.post('/admin/esqueci-senha', data={'email': 'admin@teste.com'})
+        assert resposta.status_code == 302
+    with app.app_context():
+        pendentes = EmailPendente.query.all()
+        assert len(pendentes) == 1 and pendentes[0].estado == 'pendente'
+        assert pendentes[0].destinatario == 'admin@teste.com' and '/admin/resetar/' in pendentes[0].corpo
+
+def test_fila_email_envia_em_lote_com_uma_conexao(client, monkeypatch):
+    """O enviador manda o lote pela mesma conexão SMTP e não repete quem acabou de receber"""
+    import app as modulo_app
+    from models import EmailPendente
+    from fila_email import TransporteSMTP, esvaziar_fila, enfileirar_email
+    # O Flask-Mail lê a configuração só na criação do Mail(app): supressão e remetente vão direto no estado
+    monkeypatch.setattr(modulo_app.mail.state, 'suppress', True)
+    monkeypatch.setattr(modulo_app.mail.state, 'default_sender', 'pca@teste.com')
+    conexoes = []
+    conectar_original = modulo_app.mail.connect
+    monkeypatch.setattr(modulo_app.mail, 'connect', lambda: conexoes.append(1) or conectar_original())
+    with app.app_context():
+        for i in range(5):
+            enfileirar_email(f'pessoa{i}@teste.com', 'Aviso', f'Mensagem {i}')
+        enfileirar_email('admin@teste.com', 'Recuperação', 'link', chave='recuperacao-senha:1')
+        transporte = TransporteSMTP(modulo_app.mail)
+        with modulo_app.mail.record_messages() as caixa:
+            assert esvaziar_fila(transporte, limite=2) == (6, 0)
+        transporte.fechar()
+        assert len(caixa) == 6 and conexoes == [1]
+        assert EmailPendente.query.filter_by(estado='enviado').count() == 6
+        # Novo pedido logo após o envio: não gera outro e-mail
+        assert enfileirar_email('admin@teste.com', 'Recuperação', 'link', chave='recuperacao-senha:1') is None
+
+def test_fila_email_reagenda_com_espera_e_desiste(client, monkeypatch):
+    """Falha de SMTP reagenda a mensagem com espera crescente; depois do limite ela fica como 'falhou'"""
+    import smtplib
+    import fila_email
+    from datetime import datetime
+    from models import EmailPendente
+    class TransporteFora:
+        def enviar(self, mensagem):
+            raise smtplib.SMTPServerDisconnected('servidor fora')
+    monkeypatch.setattr(fila_email, 'EMAIL_MAX_TENTATIVAS', 3)
+    with app.app_context():
+        registro = fila_email.enfileirar_email('admin@teste.com', 'Aviso', 'texto')
+        esperas = []
+        for _ in range(3):
+            registro.proxima_tentativa = datetime.now()  # Simula o fim da espera
+            db.session.commit()
+            assert fila_email.processar_fila(TransporteFora()) == (0, 1)
+            esperas.append((registro.proxima_tentativa - datetime.now()).total_seconds())
+        assert registro.estado == 'falhou' and registro.tentativas == 3 and 'servidor fora' in registro.ultimo_erro
+        assert esperas[0] < esperas[1]  # Espera exponencial entre a 1ª e a 2ª retentativa
+        assert fila_email.processar_fila(TransporteFora()) == (0, 0)
+
+
+# =========================================================================
+# BLOCO 29: LOGOTIPO COM VARIANTES GERADAS NO UPLOAD
+# =========================================================================
+
+def _png_de_teste(largura, altura):
+    import io
+    from PIL import Image
+    saida = io.BytesIO()
+    Image.new('RGB', (largura, altura), (36, 84, 156)).save(saida, 'PNG')
+    return saida.getvalue()
+
+def test_upload_logo_gera_variantes_com_hash(client, monkeypatch, tmp_path):
+    """O upload grava cabeçalho, Excel (75x75) e PDF com o hash do conteúdo no nome"""
+    import io
+    from PIL import Image
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    client.post('/admin/login', data={'login': 'admin', 'senha': 'senha_segura_123'})
+    dados = {'nome': 'Prefeitura', 'endereco': 'X', 'telefone': '1', 'email': 'x@x.com',
+             'logo': (io.BytesIO(_png_de_teste(2000, 1000)), 'brasao enorme.png')}
+    resposta = client.post('/admin/configuracoes', data=dados, content_type='multipart/form-data', follow_redirects=True)
+    assert b"sucesso" in resposta.data
+    with app.app_context():
+        logo_path = Ente.query.first().logo_path
+    assert logo_path.startswith('img/logo-') and logo_path.endswith('-cabecalho.png')
+    base = logo_path[len('img/'):-len('-cabecalho.png')]
+    tamanhos = {v: Image.open(tmp_path / f"{base}-{v}.png").size for v in ('cabecalho', 'excel', 'pdf')}
+    assert tamanhos == {'cabecalho': (320, 160), 'excel': (75, 75), 'pdf': (480, 240)}
+
+def test_exportacoes_usam_logo_em_memoria(client, monkeypatch, tmp_path):
+    """Depois do upload, Excel e PDF usam os bytes em cache, sem reabrir nem reprocessar o original"""
+    import io
+    import openpyxl
+    import logotipo
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    client.post('/admin/login', data={'login': 'admin', 'senha': 'senha_segura_123'})
+    client.post('/admin/configuracoes', content_type='multipart/form-data', data={
+        'nome': 'Prefeitura', 'endereco': 'X', 'telefone': '1', 'email': 'x@x.com',
+        'logo': (io.BytesIO(_png_de_teste(600, 600)), 'logo.png')})
+    client.get('/admin/logout')
+    def reprocessar(*args):
+        raise AssertionError('O logotipo não deve ser decodificado de novo na exportação')
+    monkeypatch.setattr(logotipo, 'gerar_variantes', reprocessar)
+    planilha = openpyxl.load_workbook(io.BytesIO(client.get('/exportar/excel').data))
+    assert len(planilha.active._images) == 1
+    assert client.get('/exportar/pdf').data.startswith(b'%PDF')
+
+def test_upload_logo_invalido_nao_altera_ente(client, monkeypatch, tmp_path):
+    """Arquivo que não é imagem é recusado com aviso e o logotipo anterior continua"""
+    import io
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    client.post('/admin/login', data={'login': 'admin', 'senha': 'senha_segura_123'})
+    resposta = client.post('/admin/configuracoes', content_type='multipart/form-data', follow_redirects=True, data={
+        'nome': 'Outro Nome', 'endereco': 'X', 'telefone': '1', 'email': 'x@x.com',
+        'logo': (io.BytesIO(b'isto nao e uma imagem'), 'logo.png')})
+    assert 'Arquivo de imagem inválido' in resposta.get_data(as_text=True)
+    with app.app_context():
+        assert Ente.query.first().logo_path is None
+    assert list(tmp_path.iterdir()) == []
+
+
+# =========================================================================
+# BLOCO 30: RESUMO DE GASTOS (TABELA AGREGADA MANTIDA POR EVENTOS)
+# =========================================================================
+
+def _resumo_gravado():
+    from models import ResumoGasto
+    return sorted((r.secretaria_id, r.exercicio, r.mes, r.quantidade, r.total, r.minimo, r.maximo) for r in ResumoGasto.query)
+
+def test_resumo_acompanha_insercao_edicao_e_exclusao(client):
+    """Cada escrita recalcula só os grupos afetados, e o resultado bate com a reconstrução completa (pandas)"""
+    from resumo import reconstruir_resumo
+    with app.app_context():
+        outra = Secretaria(nome="Secretaria de Obras")
+        db.session.add(outra)
+        db.session.commit()
+        itens = [
+            Contratacao(exercicio=2026, objeto="Cadeiras", valor_estimado=300.0, data_planejada=date(2026, 1, 20), secretaria_id=1),
+            Contratacao(exercicio=2026, objeto="Asfalto", valor_estimado=90000.0, data_planejada=date(2026, 5, 2), secretaria_id=outra.id),
+            Contratacao(exercicio=2026, objeto="Consultoria", valor_estimado=700.0, secretaria_id=1),
+        ]
+        db.session.add_all(itens)
+        db.session.commit()
+        assert (1, 2026, 1, 2, 5300.0, 300.0, 5000.0) in _resumo_gravado()
+        assert (1, 2026, 0, 1, 700.0, 700.0, 700.0) in _resumo_gravado()
+
+        # Troca de secretaria e de ano: o grupo antigo e o novo são recalculados
+        itens[0].secretaria_id, itens[0].exercicio = outra.id, 2027
+        db.session.delete(itens[1])
+        db.session.commit()
+        incremental = _resumo_gravado()
+        assert (1, 2026, 1, 1, 5000.0, 5000.0, 5000.0) in incremental
+        assert (outra.id, 2027, 1, 1, 300.0, 300.0, 300.0) in incremental
+        assert not any(g[:2] == (outra.id, 2026) for g in incremental)
+
+        with db.engine.begin() as conexao:
+            assert reconstruir_resumo(conexao) == len(incremental)
+        assert _resumo_gravado() == incremental
+
+def test_resumo_incremental_sem_reler_o_grupo(client):
+    """Inclusão vira upsert somando no resumo; só a saída do mínimo/máximo recalcula, e apenas aquele mês"""
+    from sqlalchemy import event
+    comandos = []
+    capturar = lambda conn, cursor, sql, *a: comandos.append(sql)
+    with app.app_context():
+        itens = [Contratacao(exercicio=2026, objeto=f"Item {v}", valor_estimado=float(v), data_planejada=date(2026, 2, 5), secretaria_id=1)
+                 for v in (100, 200, 300)]
+        event.listen(db.engine, 'before_cursor_execute', capturar)
+        try:
+            db.session.add_all(itens)
+            db.session.commit()
+            inclusao, comandos[:] = list(comandos), []
+            db.session.delete(itens[1])  # 200: nem mínimo nem máximo
+            db.session.commit()
+            saida_do_meio, comandos[:] = list(comandos), []
+            db.session.delete(itens[2])  # 300: era o máximo de fevereiro
+            db.session.commit()
+            saida_do_maximo = list(comandos)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capturar)
+
+        relendo_contratacoes = lambda sqls: [sql for sql in sqls if 'INSERT INTO resumo_gastos' in sql and 'FROM contratacoes' in sql]
+        assert not relendo_contratacoes(inclusao) and not relendo_contratacoes(saida_do_meio)
+        assert any('ON CONFLICT' in sql for sql in inclusao)
+        assert len(relendo_contratacoes(saida_do_maximo)) == 1
+        assert (1, 2026, 2, 1, 100.0, 100.0, 100.0) in _resumo_gravado()
+
+def test_resumo_incremental_bate_com_reconstrucao(client):
+    """Sequência de inclusões, trocas de grupo/valor e exclusões, em vários flushes: igual à reconstrução completa"""
+    import random
+    from resumo import reconstruir_resumo
+    aleatorio = random.Random(7)
+    with app.app_context():
+        outra = Secretaria(nome="Secretaria de Obras")
+        db.session.add(outra)
+        db.session.commit()
+        secretarias = [1, outra.id]
+        vivos = []
+        for rodada in range(12):
+            for _ in range(aleatorio.randint(1, 6)):
+                item = Contratacao(exercicio=aleatorio.choice([2026, 2027]), objeto="Item", secretaria_id=aleatorio.choice(secretarias),
+                                   valor_estimado=aleatorio.choice([None, 10.0 * aleatorio.randint(1, 50)]),
+                                   data_planejada=aleatorio.choice([None, date(2026, aleatorio.randint(1, 3), 1)]))
+                db.session.add(item)
+                vivos.append(item)
+            db.session.flush()
+            for item in aleatorio.sample(vivos, min(len(vivos), 3)):
+                campo = aleatorio.choice(['secretaria_id', 'exercicio', 'valor_estimado', 'data_planejada', 'excluir'])
+                if campo == 'excluir':
+                    db.session.delete(item)
+                    vivos.remove(item)
+                elif campo == 'secretaria_id':
+                    item.secretaria_id = aleatorio.choice(secretarias)
+                elif campo == 'exercicio':
+                    item.exercicio = aleatorio.choice([2026, 2027])
+                elif campo == 'valor_estimado':
+                    item.valor_estimado = aleatorio.choice([None, 10.0 * aleatorio.randint(1, 50)])
+                else:
+                    item.data_planejada = aleatorio.choice([None, date(2026, aleatorio.randint(1, 3), 1)])
+            db.session.flush() if rodada % 3 else db.session.commit()
+        db.session.commit()
+        incremental = _resumo_gravado()
+        with db.engine.begin() as conexao:
+            reconstruir_resumo(conexao)
+        assert _resumo_gravado() == incremental
+
+def test_resumo_acompanha_importacao_em_massa(client):
+    """O INSERT em massa da importação também atualiza o resumo"""
+    from importacao import importar_contratacoes
+    registros = [dict(numero_linha=i + 2, exercicio='2028', secretaria='1', objeto=f'Item {i}',
+                      data_planejada='10/02/2028', valor=str(100 * (i + 1))) for i in range(3)]
+    with app.app_context():
+        assert importar_contratacoes(registros, lote=2)[0] == 3
+        assert (1, 2028, 2, 3, 600.0, 100.0, 300.0) in _resumo_gravado()
+
+def test_pagina_resumo_le_so_a_tabela_agregada(client):
+    """A página e o JSON do resumo não consultam a tabela de contratações"""
+    from sqlalchemy import event
+    from cache_global import cache_global
+    consultas = []
+    capturar = lambda conn, cursor, sql, *a: consultas.append(sql)
+    with app.app_context():
+        motor = db.engine
+        cache_global.obter()  # A data do rodapé (MAX(data_atualizacao)) vem do cache de todas as páginas
+    event.listen(motor, 'before_cursor_execute', capturar)
+    try:
+        pagina = client.get('/resumo?exercicio=2026')
+        dados = client.get('/resumo?exercicio=2026&formato=json').get_json()
+    finally:
+        event.remove(motor, 'before_cursor_execute', capturar)
+    assert pagina.status_code == 200 and 'Secretaria de Teste' in pagina.get_data(as_text=True)
+    assert dados['secretarias'][0]['total'] == 5000.0 and dados['secretarias'][0]['quantidade'] == 1
+    assert not any('FROM contratacoes' in sql for sql in consultas)
+
+
+# =========================================================================
+# BLOCO 31: PAINEL COM CARREGAMENTO SOB DEMANDA E API JSON
+# =========================================================================
+
+def _popular_duas_secretarias():
+    with app.app_context():
+        obras = Secretaria(nome="Secretaria de Obras")
+        db.session.add(obras)
+        db.session.commit()
+        db.session.add_all([Contratacao(exercicio=2026, objeto=f"Obra {i}", valor_estimado=float(i), secretaria_id=obras.id) for i in range(1, 6)])
+        db.session.add_all([Contratacao(exercicio=2027, objeto=f"Material {i}", valor_estimado=10.0 * i, secretaria_id=1) for i in range(1, 4)])
+        db.session.commit()
+        return obras.id
+
+def test_painel_nao_renderiza_as_contratacoes(client):
+    """A página do painel sai sem as linhas e sem um modal por item (a tabela vem da API)"""
+    client.post('/admin/login', data={'login': 'admin', 'senha': 'senha_segura_123'})
+    html = client.get('/admin/dashboard').get_data(as_text=True)
+    assert 'Notebooks' not in html and 'modalEditar1' not in html
+    assert '/admin/api/contratacoes' in html
+
+def test_api_painel_pagina_ordena_e_filtra(client):
+    """Admin vê todas as secretarias, com paginação, ordenação e filtros no servidor"""
+    obras_id = _popular_duas_secretarias()
+    client.post('/admin/login', data={'login': 'admin', 'senha': 'senha_segura_123'})
+    dados = client.get('/admin/api/contratacoes?por_pagina=4&ordem=valor&direcao=desc').get_json()
+    assert dados['total'] == 9 and dados['paginas'] == 3 and len(dados['itens']) == 4
+    assert [i['valor_estimado'] for i in dados['itens']] == [5000.0, 30.0, 20.0, 10.0]
+    ultima = client.get('/admin/api/contratacoes?por_pagina=4&pagina=3&ordem=valor&direcao=desc').get_json()
+    assert [i['valor_estimado'] for i in ultima['itens']] == [1.0]
+
+    filtrado = client.get(f'/admin/api/contratacoes?secretaria={obras_id}&busca=obra').get_json()
+    assert filtrado['total'] == 5 and {i['secretaria'] for i in filtrado['itens']} == {'Secretaria de Obras'}
+    assert client.get('/admin/api/contratacoes?ordem=senha').status_code == 400
+
+def test_api_painel_respeita_rbac(client):
+    """Usuário comum só lista e só abre itens da própria secretaria; sem login, 401"""
+    obras_id = _popular_duas_secretarias()
+    assert client.get('/admin/api/contratacoes').status_code == 401
+    client.post('/admin/login', data={'login': 'comum', 'senha': 'senha_segura_123'})
+    dados = client.get(f'/admin/api/contratacoes?secretaria={obras_id}').get_json()
+    assert dados['total'] == 0
+    dados = client.get('/admin/api/contratacoes').get_json()
+    assert dados['total'] == 4 and {i['secretaria_id'] for i in dados['itens']} == {1}
+
+    with app.app_context():
+        id_obra = Contratacao.query.filter_by(secretaria_id=obras_id).first().id
+    assert client.get(f'/admin/api/contratacoes/{id_obra}').status_code == 404
+    item = client.get('/admin/api/contratacoes/1').get_json()
+    assert item['objeto'] == 'Notebooks' and item['data_planejada'] == '2026-01-01'
+
+# =========================================================================
+# BLOCO 32: INSTRUMENTAÇÃO POR REQUISIÇÃO (SERVER-TIMING E LOG DE LENTIDÃO)
+# =========================================================================
+def test_server_timing_conta_comandos_sql(client):
+    """Toda resposta traz o Server-Timing com os comandos SQL e os tempos da requisição"""
+    resposta = client.get('/')
+    cabecalho = resposta.headers['Server-Timing']
+    comandos = int(re.search(r'db;desc="(\d+) SQL"', cabecalho).group(1))
+    assert comandos >= 1
+    assert 'app;dur=' in cabecalho and 'total;dur=' in cabecalho
+
+def test_log_de_sql_e_requisicao_lentos(client, monkeypatch, caplog):
+    """Acima dos limites, o log traz a rota, os filtros e a impressão digital do SQL"""
+    monkeypatch.setitem(app.config, 'LIMITE_SQL_LENTO_MS', 0)
+    monkeypatch.setitem(app.config, 'LIMITE_REQUISICAO_LENTA_MS', 0)
+    with caplog.at_level('WARNING'):
+        client.get('/?busca=notebook')
+    mensagens = [r.getMessage() for r in caplog.records]
+    lentos = [m for m in mensagens if m.startswith('SQL lento')]
+    assert lentos and all("'busca': ['notebook']" in m for m in lentos)
+    assert not any('notebook' in m.split(']}: ', 1)[1] for m in lentos) # O SQL sai sem os valores
+    assert any(m.startswith('Requisição lenta') and 'GET home ' in m for m in mensagens)
+
+def test_impressao_digital_agrupa_valores_diferentes():
+    """O mesmo comando com literais e listas IN diferentes tem a mesma impressão digital"""
+    a = impressao_digital("SELECT * FROM t WHERE id IN (1, 2, 3) AND nome = 'x'")
+    b = impressao_digital("SELECT *  FROM t WHERE id IN (7) AND nome = 'outro'")
+    assert a[0] == b[0]
+    assert a[1] == "SELECT * FROM t WHERE id IN (?+) AND nome = ?"
+    assert impressao_digital("SELECT * FROM t WHERE id IN (%s, %s)")[0] == impressao_digital("SELECT * FROM t WHERE id IN (?)")[0]
+
+def test_instrumentacao_desligada(client, monkeypatch):
+    """Com PCA_INSTRUMENTACAO=False não há medição nem cabeçalho"""
+    monkeypatch.setitem(app.config, 'INSTRUMENTACAO', False)
+    assert 'Server-Timing' not in client.get('/').headers
+
+# =========================================================================
+# BLOCO 33: MÉTRICAS NO FORMATO DO PROMETHEUS (/metrics)
+# =========================================================================
+def _amostra(nome, **rotulos):
+    return REGISTRY.get_sample_value(nome, rotulos) or 0
+
+def test_metrics_latencia_por_endpoint_e_pool(client):
+    """/metrics traz o histograma de latência por endpoint e o estado do pool"""
+    antes = _amostra('pca_requisicao_segundos_count', endpoint='home', metodo='GET', status='200')
+    client.get('/')
+    assert _amostra('pca_requisicao_segundos_count', endpoint='home', metodo='GET', status='200') == antes + 1
+
+    resposta = client.get('/metrics')
+    assert resposta.status_code == 200 and resposta.content_type.startswith('text/plain')
+    texto = resposta.get_data(as_text=True)
+    assert 'pca_requisicao_segundos_bucket{endpoint="home"' in texto
+    assert 'pca_pool_espera_segundos_count' in texto # No SQLite de teste o pool não é o instrumentado
+
+def test_metrics_exportacoes_e_linhas_servidas(client):
+    """A 1ª exportação conta como gerada (com duração e tamanho), a 2ª como acerto do cache"""
+    antes_linhas = _amostra('pca_linhas_servidas_total', origem='excel')
+    antes_geradas = _amostra('pca_exportacao_geracao_segundos_count', tipo='excel')
+    antes_acertos = _amostra('pca_exportacoes_total', tipo='excel', cache='acerto')
+    url = '/exportar/excel?busca=metricas-prometheus'
+    client.get(url)
+    client.get(url)
+    assert _amostra('pca_exportacao_geracao_segundos_count', tipo='excel') == antes_geradas + 1
+    assert _amostra('pca_exportacoes_total', tipo='excel', cache='acerto') == antes_acertos + 1
+    assert _amostra('pca_exportacao_bytes_sum', tipo='excel') > 0
+    assert _amostra('pca_linhas_servidas_total', origem='excel') == antes_linhas # A busca não encontra nada
+
+    antes_csv = _amostra('pca_linhas_servidas_total', origem='csv')
+    client.get('/exportar/csv').get_data()
+    assert _amostra('pca_linhas_servidas_total', origem='csv') == antes_csv + 1
+
+def test_metrics_restrito(client):
+    """Mesma regra do /interno/pool: fora da máquina, só com o token"""
+    assert client.get('/metrics', headers={'X-Forwarded-For': '200.1.2.3'}).status_code == 403
+
+# =========================================================================
+# BLOCO 34: ESTÁTICOS VERSIONADOS E PRÉ-COMPRIMIDOS
+# =========================================================================
+@pytest.fixture
+def estaticos_construidos(tmp_path):
+    """Build dos estáticos numa pasta temporária; no fim, volta ao manifesto original"""
+    pasta_original = estaticos.pasta
+    manifesto = construir_estaticos(app.static_folder, os.path.join(app.root_path, app.template_folder), str(tmp_path))
+    estaticos.carregar(str(tmp_path))
+    yield manifesto, tmp_path
+    estaticos.carregar(pasta_original)
+
+def test_construir_estaticos_so_com_arquivos_usados(estaticos_construidos):
+    """Só entram os arquivos citados nos templates, com hash no nome e variantes comprimidas"""
+    manifesto, pasta = estaticos_construidos
+    assert set(manifesto) == {'css/bootstrap.min.css', 'js/bootstrap.bundle.min.js'}
+    versionado = manifesto['css/bootstrap.min.css']
+    assert re.fullmatch(r'css/bootstrap\.min\.[0-9a-f]{12}\.css', versionado)
+    with open(os.path.join(app.static_folder, 'css', 'bootstrap.min.css'), 'rb') as f:
+        original = f.read()
+    assert gzip.decompress((pasta / (versionado + '.gz')).read_bytes()) == original
+
+def test_estaticos_versionados_com_cache_imutavel(client, estaticos_construidos):
+    """As páginas apontam para o nome versionado, servido pré-comprimido e com cache de um ano"""
+    manifesto, _ = estaticos_construidos
+    url = f"/static/dist/{manifesto['css/bootstrap.min.css']}"
+    assert url in client.get('/').get_data(as_text=True)
+
+    resposta = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert resposta.headers['Content-Encoding'] == 'gzip'
+    assert resposta.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert 'Accept-Encoding' in resposta.headers['Vary']
+    sem_compressao = client.get(url, headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in sem_compressao.headers
+    assert gzip.decompress(resposta.data) == sem_compressao.data
+
+def test_estaticos_sem_build_usam_originais(client):
+    """Sem manifesto, os templates continuam nos arquivos originais, agora com cache público curto"""
+    pasta_original = estaticos.pasta
+    estaticos.carregar(tempfile.mkdtemp(prefix='pca_teste_sem_dist_'))
+    try:
+        assert '/static/css/bootstrap.min.css' in client.get('/').get_data(as_text=True)
+        resposta = client.get('/static/css/bootstrap.min.css')
+        assert resposta.cache_control.public and 'no-store' not in resposta.headers['Cache-Control']
+    finally:
+        estaticos.carregar(pasta_original)
+
+def test_etag_publica_muda_com_o_build_dos_estaticos(client, tmp_path):
+    """Depois de um deploy com CSS/JS novos, a revalidação não devolve 304 com HTML apontando para arquivos antigos"""
+    pasta_original = estaticos.pasta
+    estaticos.carregar(tempfile.mkdtemp(prefix='pca_teste_sem_dist_'))
+    try:
+        etag = client.get('/').headers['ETag']
+        construir_estaticos(app.static_folder, os.path.join(app.root_path, app.template_folder), str(tmp_path))
+        estaticos.carregar(str(tmp_path))
+        resposta = client.get('/', headers={'If-None-Match': etag})
+    finally:
+        estaticos.carregar(pasta_original)
+    assert resposta.status_code == 200 and resposta.headers['ETag'] != etag
+    assert '/static/dist/' in resposta.get_data(as_text=True)
+
+# =========================================================================
+# BLOCO 35: COMPRESSÃO DAS RESPOSTAS (GZIP, BROTLI E ZSTD)
+# =========================================================================
+def _popular_listagem(quantidade=60):
+    db.session.add_all([Contratacao(exercicio=2026, objeto=f"Aquisição de material de consumo {i}",
+                                    valor_estimado=100.0 + i, secretaria_id=1) for i in range(quantidade)])
+    db.session.commit()
+
+def test_home_comprimida_com_etag_por_codificacao(client):
+    """A home sai em gzip para quem aceita, com ETag própria e 304 na revalidação"""
+    _popular_listagem()
+    cru = client.get('/', headers={'Accept-Encoding': 'identity'})
+    comprimido = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in cru.headers
+    assert comprimido.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in comprimido.headers['Vary']
+    assert gzip.decompress(comprimido.data) == cru.data
+    assert len(comprimido.data) < len(cru.data) / 3
+    assert comprimido.headers['ETag'] != cru.headers['ETag']
+
+    revalidado = client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': comprimido.headers['ETag']})
+    assert revalidado.status_code == 304
+    assert client.get('/', headers={'If-None-Match': comprimido.headers['ETag']}).status_code == 200
+
+@pytest.mark.parametrize('codificacao', ['br', 'zstd'])
+def test_csv_em_streaming_comprimido(client, codificacao):
+    """O CSV em streaming é comprimido pedaço a pedaço com o algoritmo preferido pelo navegador"""
+    modulo = pytest.importorskip({'br': 'brotli', 'zstd': 'zstandard'}[codificacao])
+    _popular_listagem()
+    cru = client.get('/exportar/csv').data
+    resposta = client.get('/exportar/csv', headers={'Accept-Encoding': f'gzip;q=0.5, {codificacao}'})
+    assert resposta.headers['Content-Encoding'] == codificacao and 'Content-Length' not in resposta.headers
+    if codificacao == 'br':
+        assert modulo.decompress(resposta.data) == cru
+    else:
+        assert modulo.ZstdDecompressor().decompressobj().decompress(resposta.data) == cru
+
+def test_sem_compressao_para_xlsx_respostas_pequenas_ou_desligada(client, monkeypatch):
+    """Planilhas (já comprimidas) e respostas pequenas saem como estão; PCA_COMPRESSAO=False desliga tudo"""
+    _popular_listagem()
+    cabecalhos = {'Accept-Encoding': 'gzip, br, zstd'}
+    assert 'Content-Encoding' not in client.get('/exportar/excel', headers=cabecalhos).headers
+    assert 'Content-Encoding' not in client.get('/exportar/tarefas/inexistente', headers=cabecalhos).headers
+    monkeypatch.setitem(app.config, 'COMPRESSAO', False)
+    assert 'Content-Encoding' not in client.get('/', headers=cabecalhos).headers